@@ -4,8 +4,8 @@ import matplotlib.pyplot as plt
 import matplotlib.dates as mdates
 import matplotlib.patheffects as path_effects
 import scipy.interpolate as si
-from scipy.signal import ShortTimeFFT
-from scipy.signal.windows import hamming
+from spectral_plan import get_spectral_plan, frequency_band
+from capture_files import load_smp, load_spg
 import os
 import shutil
 from stat import S_IREAD, S_IRGRP, S_IROTH
@@ -208,14 +208,13 @@ class MeteorPlotter() :
 
         # Limit the data to the required frequency band
         if full_frequency_band :
-            freq_slice = np.where((f >= (centre_freq-FULL_FREQUENCY_BAND)/1e6) & (f <= (centre_freq+FULL_FREQUENCY_BAND)/1e6))
+            freq_slice = frequency_band(f*1e6, centre_freq-FULL_FREQUENCY_BAND, centre_freq+FULL_FREQUENCY_BAND, include_low=True)
         else:
-            freq_slice = np.where((f >= (centre_freq-SPECGRAM_BAND)/1e6) & (f <= (centre_freq+SPECGRAM_BAND)/1e6))
+            freq_slice = frequency_band(f*1e6, centre_freq-SPECGRAM_BAND, centre_freq+SPECGRAM_BAND, include_low=True)
 
-        f = f[freq_slice]
-        f *= 1e6
-        f -= (centre_freq)
-        Pxx = Pxx[freq_slice,:][0]
+        # The slice is a view of the frequencies, so make a new array for the offsets from the centre frequency
+        f = f[freq_slice]*1e6 - centre_freq
+        Pxx = Pxx[freq_slice]
 
         # Collect the detection stats
         mn, sigmax, init_freq, peak_freq, snr = get_capture_stats(Pxx, f, bins)
@@ -292,16 +291,15 @@ class MeteorPlotter() :
     def plot_3dspecgram(self, Pxx, f, bins, centre_freq, save_images=False, noplot=False):
 
         # Limit the data to the narrow frequency band
-        freq_slice = np.where((f >= (centre_freq-SPECGRAM_BAND)/1e6) & (f <= (centre_freq+SPECGRAM_BAND)/1e6))
+        freq_slice = frequency_band(f*1e6, centre_freq-SPECGRAM_BAND, centre_freq+SPECGRAM_BAND, include_low=True)
         f = f[freq_slice]
-        Pxx = Pxx[freq_slice,:][0]
+        Pxx = Pxx[freq_slice]
 
         # Plot the 3d spectrogram
         fig = plt.figure(figsize=(10,7.5))
         ax = plt.axes(projection='3d')
         # ax = fig.gca(projection='3d')
-        f -= (centre_freq/1e6)
-        f *= 1e6
+        f = (f - centre_freq/1e6)*1e6
         ax.plot_surface(bins[None, :], f[:, None], 10.0*np.log10(Pxx), cmap='coolwarm')
         plt.title('Meteor Radio Detection  ' + str(obs_time)[:-3], y=1.08)
         ax.set_xlabel('Time (s)' )
@@ -323,7 +321,7 @@ class MeteorPlotter() :
 
     def plot_psd(self, Pxx, f, centre_freq) :
         # Restrict the band for plotting to a band around the required centre frequency
-        detection_band = np.where((f*1e6 > (centre_freq - FULL_FREQUENCY_BAND)) & (f*1e6 <= (centre_freq + FULL_FREQUENCY_BAND)))
+        detection_band = frequency_band(f*1e6, centre_freq - FULL_FREQUENCY_BAND, centre_freq + FULL_FREQUENCY_BAND)
         X = np.float16(Pxx[detection_band])
         sigdb = 10*np.log10(X)
         fplot = f[detection_band]
@@ -436,6 +434,8 @@ if __name__ == "__main__":
     # ap.add_argument("-r", "--rate", type=int, default=960000, help="Sample rate")
     ap.add_argument("-3", "--3d", action='store_true', help="Show 3d specgram")
     ap.add_argument("-a", "--audio", action='store_true', help="Create audio file")
+    ap.add_argument("--start", type=float, default=None, help="Start of the time window to display, in seconds from the start of the file (or first file when combining)")
+    ap.add_argument("--end", type=float, default=None, help="End of the time window to display, in seconds from the start of the file (or first file when combining)")
 
     args = vars(ap.parse_args())
 
@@ -452,6 +452,8 @@ if __name__ == "__main__":
     # centre_freq = args['frequency']
     show_3d = args['3d']
     audio = args['audio']
+    start_time = args['start']
+    end_time = args['end']
 
     # Print command key help
     print(HELP_TEXT)
@@ -484,36 +486,31 @@ if __name__ == "__main__":
             new_obs_time, centre_freq, sample_rate = get_observation_data(file_name)
             obs_times.append(new_obs_time)
 
+            # The time window is from the start of the first file, so find the window within this file
+            file_offset = (new_obs_time - obs_times[0]).total_seconds()
+            file_start_time = None if start_time is None else start_time - file_offset
+            file_end_time = None if end_time is None else end_time - file_offset
+            if file_end_time is not None and file_end_time <= 0 :
+                obs_times.pop()
+                break
+
             # Unpack the data
             if 'SMP' in file_name and 'npz' in file_name :
-                npz_data = np.load(file_name)
-                samples = npz_data['samples']
-                sample_rate = DEFAULT_SAMPLE_RATE
-                try:
-                    centre_freq = npz_data['centre_freq']
-                    sample_rate = npz_data['sample_rate']
-                    obs_time = datetime.datetime.strptime(str(npz_data['obs_time']), "%Y-%m-%d %H:%M:%S.%f")
-                except Exception as e :
-                    print(e)
+                samples, smp_obs_time, smp_centre_freq, sample_rate = load_smp(file_name, file_start_time, file_end_time)
+                if sample_rate is None : sample_rate = DEFAULT_SAMPLE_RATE
+                if smp_centre_freq is not None : centre_freq = smp_centre_freq
 
-                window = hamming(NUM_FFT, sym=True)  # symmetric Gaussian window
-                sft = ShortTimeFFT(window, hop=HOP, fs=sample_rate, mfft=NUM_FFT, fft_mode='centered')
-                new_Pxx = sft.spectrogram(samples)
+                plan = get_spectral_plan(sample_rate, NUM_FFT, HOP, centre_freq - 2000)
+                new_Pxx = plan.spectrogram(samples)
+                new_bins = plan.bins(new_Pxx.shape[1])
+                new_f = plan.f
 
-                T_x, N = HOP / sample_rate, new_Pxx.shape[1]
-                new_bins = np.arange(N) * T_x
-
-                f = sft.f
-                f = (f + centre_freq - 2000) / 1e6
-                new_f = f
+                # The bins are from the start of the samples read, which may be later than the start of the file
+                if smp_obs_time is not None : new_bins += (smp_obs_time - new_obs_time).total_seconds()
 
 
             if 'SPG' in file_name and 'npz' in file_name :
-                npz_data = np.load(file_name)
-
-                new_bins = npz_data['bins']
-                new_f = npz_data['f']
-                new_Pxx = npz_data['Pxx']
+                new_Pxx, new_f, new_bins = load_spg(file_name, file_start_time, file_end_time, bins_sample_rate=sample_rate)
 
             # Set the variables for the first observation
             if len(obs_times) == 1 :
@@ -569,39 +566,23 @@ if __name__ == "__main__":
             meteor_plotter.set_colour(colour_scheme)
             # If this is specgram data, plot the spectrogram only
             if 'SPG' in filename and 'npz' in filename :
-                # Get the np data from file
-                npz_data = np.load(filename)
-
-                # Extract the FFT data. bins is time in seconds, but old format required division by the sample rate
-                bins = npz_data['bins']
-                if sample_rate is not None : bins /= sample_rate
-                f = npz_data['f']
-                Pxx = npz_data['Pxx']
+                # Get the FFT data for the time window from file. bins is time in seconds, but old format required division by the sample rate
+                Pxx, f, bins = load_spg(filename, start_time, end_time, bins_sample_rate=sample_rate)
 
                 meteor_plotter.plot_specgram(Pxx, f, bins, centre_freq, obs_time, flipped=False)
                 # if show_3d : plot_3dspecgram(Pxx, f, bins, centre_freq)
 
             # If this is raw sample data, create the spectrogram display data and display it
             if 'SMP' in filename and 'npz' in filename :
-                npz_data = np.load(filename)
-                samples = npz_data['samples']
-                sample_rate = DEFAULT_SAMPLE_RATE
-                try:
-                    centre_freq = npz_data['centre_freq']
-                    sample_rate = npz_data['sample_rate']
-                    obs_time = datetime.datetime.strptime(str(npz_data['obs_time']), "%Y-%m-%d %H:%M:%S.%f")
-                except Exception as e :
-                    print(e)
-
-                window = hamming(NUM_FFT, sym=True)  # symmetric Gaussian window
-                sft = ShortTimeFFT(window, hop=HOP, fs=sample_rate, mfft=NUM_FFT, fft_mode='centered')
-                Pxx = sft.spectrogram(samples)
-
-                T_x, N = HOP / sample_rate, Pxx.shape[1]
-                bins = np.arange(N) * T_x
-
-                f = sft.f
-                f = (f + centre_freq - 2000) / 1e6
+                samples, smp_obs_time, smp_centre_freq, sample_rate = load_smp(filename, start_time, end_time)
+                if sample_rate is None : sample_rate = DEFAULT_SAMPLE_RATE
+                if smp_centre_freq is not None : centre_freq = smp_centre_freq
+                if smp_obs_time is not None : obs_time = smp_obs_time
+
+                plan = get_spectral_plan(sample_rate, NUM_FFT, HOP, centre_freq - 2000)
+                Pxx = plan.spectrogram(samples)
+                bins = plan.bins(Pxx.shape[1])
+                f = plan.f
 
                 if save_images :
                     meteor_plotter.set_file_name(filename)
@@ -0,0 +1,25 @@
+# Settings of the sample stream and the detection analysis
+#
+# These are used by meteor_radar.py, and by trigger_compare.py, workspace_benchmark.py and echo_benchmark.py so
+# that the benchmarks measure the same configuration as the live acquisition. This module imports nothing, so
+# the benchmarks can use it without the SDR and plotting packages that meteor_radar.py needs.
+
+# RTL SDR settings - 225001 to 300000 and 900001 to 3200000
+SAMPLE_RATE = 300000       #    960000 (262144-causes noise near 143.05) 262144, 240000
+SDR_BLOCK_SIZE = 128*1024  # Number of samples in each block streamed from the SDR
+DECIMATION = 8             # Channelizer reduces the sample rate from 300k to 37.5k for analysis, saving and audio
+DECIMATED_SAMPLE_RATE = SAMPLE_RATE // DECIMATION
+BLOCK_LENGTH = SDR_BLOCK_SIZE // DECIMATION     # Samples in each decimated block
+
+# FFT Settings
+FREQUENCY_OFFSET = -2000   # Tuning frequency offset from centre (so signal appears as 2kHz audio on upper sideband)
+DETECTION_FREQUENCY_BAND = [-120,+120]    # Band for detection is +/- F Hz
+NOISE_CALCULATION_BAND = [-500,+500]    # Band for noise calculation is +/- F Hz
+ANALYSIS_OVERLAP = 0.5     # Overlap for detection analysis
+COMPRESSION_FREQUENCY_BAND = 1000   # Band for compression data saving is +/- 1000 Hz
+NUM_FFT = 2**12            # FFT size at the decimated sample rate (same frequency resolution as 2**15 at the SDR sample rate)
+HOP=int(NUM_FFT*(1-ANALYSIS_OVERLAP))
+HISTORY_LENGTH = NUM_FFT - HOP   # Samples of the previous block analysed with each block, so the analysis frames are continuous across blocks
+
+# Trigger condition settings
+MAX_MEDIAN_NOISE_RATIO = 3
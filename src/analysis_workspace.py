@@ -0,0 +1,100 @@
+# Analysis workspace for the trigger engines
+#
+# Holds preallocated float32 and complex64 buffers for the analysis of a block of samples: the windowed frames
+# (transformed in place by the FFT), the power of each frame, the band power, the median power of each frame and
+# the per bin statistics. Each analysis worker owns a workspace, and the trigger engines write into it with out=
+# parameters and in place operations, so the analysis of a block allocates no array memory once it is running.
+#
+# The arrays returned by the trigger engines are views of the workspace, and are overwritten by the analysis
+# of the next block, so they must be copied if they are kept.
+
+import numpy as np
+
+
+class AnalysisWorkspace():
+
+    def __init__(self, max_frames, num_fft, num_power_bins, num_band_bins, num_detection_bins) :
+        self.max_frames = max_frames
+        self.num_band_bins = num_band_bins
+
+        # The FFT is done in place in the frames, so a separate spectrum is only needed when fewer bins are computed
+        self.frames = np.zeros((max_frames, num_fft), dtype=np.complex64)
+        self.spectrum = self.frames if num_power_bins == num_fft else np.zeros((max_frames, num_power_bins), dtype=np.complex64)
+        self.power = np.zeros((max_frames, num_power_bins), dtype=np.float32)
+
+        # The band power is held as (bins, frames) in a flat buffer, so the band power of any number of frames is contiguous
+        self.band_buffer = np.zeros(num_band_bins * max_frames, dtype=np.float32)
+        self.time_medians = np.zeros(max_frames, dtype=np.float32)
+        self.bin_mean = np.zeros(num_band_bins, dtype=np.float32)
+        self.band_max = np.zeros(num_band_bins, dtype=np.float32)
+        self.detection_max = np.zeros(num_detection_bins, dtype=np.float32)
+        self.scratch = np.zeros(max(max_frames, num_band_bins), dtype=np.float32)
+
+
+    # Band power array for a number of frames, as a view of the band buffer
+    def band_power(self, num_frames) :
+        return self.band_buffer[:self.num_band_bins * num_frames].reshape(self.num_band_bins, num_frames)
+
+
+    # Median of each row of an array, written to out. The rows are partially sorted in place
+    def row_medians(self, values, out) :
+        half = values.shape[1] // 2
+        if values.shape[1] % 2 :
+            values.partition(half, axis=1)
+            np.copyto(out, values[:, half])
+        else:
+            values.partition((half - 1, half), axis=1)
+            np.add(values[:, half - 1], values[:, half], out=out)
+            out *= 0.5
+        return out
+
+
+    # Median of a 1d array, calculated in the scratch buffer so the array is not changed
+    def median(self, values) :
+        scratch = self.scratch[:len(values)]
+        np.copyto(scratch, values)
+        half = len(scratch) // 2
+        if len(scratch) % 2 :
+            scratch.partition(half)
+            return scratch[half]
+        scratch.partition((half - 1, half))
+        return (scratch[half - 1] + scratch[half]) / 2
+
+
+# Analysis workspace for the zoom FFT of the dft engine. The frames, spectrum and power are those of the decimated
+# frames, and the workspace also holds the samples padded for the decimation filter, the products of the rows of
+# the samples with the filter phases, the decimated samples, and the windowed full frames folded for the probe bins
+class ZoomWorkspace(AnalysisWorkspace):
+
+    def __init__(self, max_samples, max_frames, num_fft, zoom_fft, decimation, filter_rows, num_probe_bins, num_band_bins, num_detection_bins) :
+        AnalysisWorkspace.__init__(self, max_frames, zoom_fft, zoom_fft, num_band_bins, num_detection_bins)
+        max_decimated = max_samples // decimation
+
+        self.padded = np.zeros((max_decimated + filter_rows) * decimation, dtype=np.complex64)
+        self.products = np.zeros((max_decimated + filter_rows, filter_rows), dtype=np.complex64)
+        self.decimated = np.zeros(max_decimated, dtype=np.complex64)
+        self.full_frames = np.zeros((max_frames, num_fft), dtype=np.complex64)
+        self.probe_spectrum = np.zeros((max_frames, num_probe_bins), dtype=np.complex64)
+        self.probe_power = np.zeros((max_frames, num_probe_bins), dtype=np.float32)
+
+
+# Analysis workspace of the cfar engine. As well as the buffers of AnalysisWorkspace, it holds the float64 integral of the
+# trigger rows of the band power and the box sums of the cells calculated from it, and the noise level, SNR and detection
+# mask of the cells with the rows and time steps of the detection
+class CfarWorkspace(AnalysisWorkspace):
+
+    def __init__(self, max_frames, num_fft, num_band_bins, num_trigger_bins, num_detection_bins) :
+        AnalysisWorkspace.__init__(self, max_frames, num_fft, num_fft, num_band_bins, num_detection_bins)
+        self.integral_buffer = np.zeros((num_trigger_bins + 1) * (max_frames + 1))
+        self.box_buffer = np.zeros(num_trigger_bins * max_frames)
+        self.corner_buffer = np.zeros(num_trigger_bins * max_frames)
+        self.noise_buffer = np.zeros(num_trigger_bins * max_frames, dtype=np.float32)
+        self.snr_buffer = np.zeros(num_detection_bins * max_frames, dtype=np.float32)
+        self.mask_buffer = np.zeros(num_detection_bins * max_frames, dtype=bool)
+        self.detection_rows = np.zeros(num_detection_bins, dtype=bool)
+        self.detection_steps = np.zeros(max_frames, dtype=bool)
+
+
+    # Array of cells for a number of rows and frames, as a view of the start of a flat buffer so it is contiguous for any number of frames
+    def cells(self, buffer, num_rows, num_frames) :
+        return buffer[:num_rows * num_frames].reshape(num_rows, num_frames)
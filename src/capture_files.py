@@ -0,0 +1,249 @@
+# Capture file reading and writing
+#
+# SMP capture files are numpy .npz files. The original format holds the decimated samples as complex64 in the
+# 'samples' member. The compact format holds the samples as int8 or int16 interleaved IQ values in the 'iq'
+# member with a 'scale' factor, so each sample is (iq[2n] + j iq[2n+1]) * scale. Both formats hold the
+# 'obs_time', 'centre_freq' and 'sample_rate' metadata, and the members may be compressed with fast (level 1)
+# zlib compression. np.load can open all of the formats, and load_smp decodes any of them to complex64.
+#
+# int16 keeps the resolution of the decimated samples for half the size of complex64 before compression.
+# int8 is a quarter of the size, but may lose weak signals in the presence of strong ones.
+#
+# SPG spectrogram files in the original format hold the float64 power spectrogram 'Pxx', with the float64
+# frequencies 'f' in MHz and times 'bins' in seconds. The version 2 format holds the spectrogram in dB,
+# quantised to uint8 or float16 in the 'Pxx_db' member, so each value is Pxx_db * db_scale + db_offset dB.
+# The frequencies and times are evenly spaced, so they are held as start and step values, and the members are
+# compressed. uint8 has a resolution of around a third of a dB, which is finer than the display can show.
+#
+# Uncompressed members are written with their array data aligned to 64 bytes in the file, so they can be
+# memory mapped. np.load reads the whole of an .npz member, so load_smp and load_spg map the uncompressed
+# members and read only the time or frequency window that is needed. Compressed members are read in full.
+
+import datetime
+import io
+import struct
+import time
+import zipfile
+import numpy as np
+
+SMP_FORMATS = ['complex64', 'int16', 'int8']
+SMP_FORMAT_VERSION = 2
+SPG_FORMATS = ['float64', 'uint8', 'float16']
+SPG_FORMAT_VERSION = 2
+MIN_POWER = 1e-30               # Floor for the power before conversion to dB, so zero power is not -inf dB
+COMPRESSION_LEVEL = 1
+DEFAULT_SAMPLE_RATE = 37500
+ARRAY_ALIGNMENT = 64            # Alignment of the array data of uncompressed members, as the npy header is padded to 64 bytes
+PADDING_EXTRA_ID = 0xD935       # Zip extra field ID used to pad the local header of a member for alignment
+LOCAL_HEADER_LENGTH = 30        # Length of a zip local file header, before the member name and extra field
+
+
+# Write arrays to a .npz file, as np.savez, optionally compressing them with fast zlib compression.
+# Uncompressed members are aligned so that they can be memory mapped
+def write_npz(filename, arrays, compress=False) :
+    if compress :
+        with zipfile.ZipFile(filename, 'w', compression=zipfile.ZIP_DEFLATED, compresslevel=COMPRESSION_LEVEL) as npz_file :
+            for name, array in arrays.items() :
+                with npz_file.open(name + '.npy', 'w', force_zip64=True) as member :
+                    np.lib.format.write_array(member, np.asanyarray(array), allow_pickle=False)
+        return
+
+    with zipfile.ZipFile(filename, 'w', compression=zipfile.ZIP_STORED) as npz_file :
+        for name, array in arrays.items() :
+            member = io.BytesIO()
+            np.lib.format.write_array(member, np.asanyarray(array), allow_pickle=False)
+            write_aligned_member(npz_file, name + '.npy', member.getbuffer())
+
+
+# Write an uncompressed member to a zip file, padding the extra field of its local header so that the member data starts on an aligned offset
+def write_aligned_member(npz_file, member_name, data) :
+    zinfo = zipfile.ZipInfo(member_name, date_time=time.localtime()[:6])
+    zinfo.compress_type = zipfile.ZIP_STORED
+    header_length = LOCAL_HEADER_LENGTH + len(member_name.encode()) + 4
+    padding = -(npz_file.fp.tell() + header_length) % ARRAY_ALIGNMENT
+    zinfo.extra = struct.pack('<HH', PADDING_EXTRA_ID, padding) + bytes(padding)
+    npz_file.writestr(zinfo, data)
+
+
+# Memory map a member of an .npz file as a read only array without reading its data.
+# Returns None if the member is compressed or cannot be mapped, when it has to be read with np.load
+def map_npz_member(filename, name) :
+    with zipfile.ZipFile(filename) as npz_file :
+        try: zinfo = npz_file.getinfo(name + '.npy')
+        except KeyError: return None
+    if zinfo.compress_type != zipfile.ZIP_STORED : return None
+
+    with open(filename, 'rb') as npz_file :
+        # The member data follows the local header, whose name and extra field lengths may differ from the central directory
+        npz_file.seek(zinfo.header_offset)
+        name_length, extra_length = struct.unpack('<HH', npz_file.read(LOCAL_HEADER_LENGTH)[26:30])
+        npz_file.seek(zinfo.header_offset + LOCAL_HEADER_LENGTH + name_length + extra_length)
+
+        version = np.lib.format.read_magic(npz_file)
+        if version == (1, 0) : shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(npz_file)
+        else : shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(npz_file)
+        offset = npz_file.tell()
+
+    if dtype.hasobject or np.prod(shape) == 0 : return None
+    return np.memmap(filename, dtype=dtype, mode='r', offset=offset, shape=shape, order='F' if fortran_order else 'C')
+
+
+# Get a member of an open .npz file, memory mapped if possible
+def npz_member(npz_data, filename, name) :
+    member = map_npz_member(filename, name)
+    if member is None : member = npz_data[name]
+    return member
+
+
+# Check whether all the members of an .npz file are uncompressed and aligned for memory mapping
+def is_mappable(filename) :
+    with zipfile.ZipFile(filename) as npz_file :
+        members = npz_file.infolist()
+    for zinfo in members :
+        member = map_npz_member(filename, zinfo.filename[:-len('.npy')])
+        if member is None :
+            if zinfo.compress_type != zipfile.ZIP_STORED : return False
+            continue
+        if member.offset % ARRAY_ALIGNMENT != 0 : return False
+    return True
+
+
+# Check whether any member of an .npz file is compressed, as the SMP files saved with compression
+def is_compressed(filename) :
+    with zipfile.ZipFile(filename) as npz_file :
+        return any(zinfo.compress_type != zipfile.ZIP_STORED for zinfo in npz_file.infolist())
+
+
+# Get the range of indices of a time window, given in seconds from the start of the capture
+def time_window(num_samples, sample_rate, start_time=None, end_time=None) :
+    first = 0 if start_time is None else min(num_samples, max(0, int(start_time * sample_rate)))
+    last = num_samples if end_time is None else min(num_samples, max(first, int(np.ceil(end_time * sample_rate))))
+    return first, last
+
+
+# Save the samples of a capture as an SMP file. The samples may be a single array, or a list of arrays (such as the views of the sample ring)
+def save_smp(filename, samples, obs_time, centre_freq, sample_rate, sample_format='complex64', compress=False) :
+    views = samples if isinstance(samples, (list, tuple)) else [samples]
+    metadata = {'obs_time': str(obs_time), 'centre_freq': centre_freq, 'sample_rate': sample_rate}
+
+    if sample_format == 'complex64' :
+        samples = views[0] if len(views) == 1 else np.concatenate(views)
+        write_npz(filename, dict(metadata, samples=samples.astype(np.complex64, copy=False)), compress)
+        return
+
+    # Scale the largest I or Q value to the full range of the integer type
+    iq_type = np.dtype(sample_format)
+    full_scale = np.iinfo(iq_type).max
+    peak = max(max(np.max(np.abs(view.real)), np.max(np.abs(view.imag))) if len(view) > 0 else 0 for view in views)
+    scale = peak / full_scale if peak > 0 else 1.0
+
+    # Quantise each view straight into the interleaved IQ array
+    iq = np.empty(2 * sum(len(view) for view in views), dtype=iq_type)
+    position = 0
+    for view in views :
+        interleaved = view.astype(np.complex64, copy=False).view(np.float32)
+        np.rint(interleaved / scale, out=iq[position:position + len(interleaved)], casting='unsafe')
+        position += len(interleaved)
+
+    write_npz(filename, dict(metadata, format_version=SMP_FORMAT_VERSION, iq=iq, scale=np.float32(scale)), compress)
+
+
+# Load an SMP file in any of the formats. Returns the complex64 samples, the observation time, the centre frequency
+# and the sample rate. Metadata that is not in the file is returned as None.
+# Only the samples between start_time and end_time (in seconds from the start of the capture) are read from an uncompressed
+# file, and the observation time is then the time of the first sample returned
+def load_smp(filename, start_time=None, end_time=None) :
+    with np.load(filename) as npz_data :
+        obs_time = centre_freq = sample_rate = None
+        if 'obs_time' in npz_data :
+            obs_time = datetime.datetime.fromisoformat(str(npz_data['obs_time']))
+        if 'centre_freq' in npz_data : centre_freq = float(npz_data['centre_freq'])
+        if 'sample_rate' in npz_data : sample_rate = float(npz_data['sample_rate'])
+        window_rate = sample_rate if sample_rate is not None else DEFAULT_SAMPLE_RATE
+
+        if 'iq' in npz_data :
+            iq = npz_member(npz_data, filename, 'iq')
+            first, last = time_window(len(iq) // 2, window_rate, start_time, end_time)
+            samples = np.empty(last - first, dtype=np.complex64)
+            np.multiply(iq[2 * first:2 * last], npz_data['scale'], out=samples.view(np.float32), casting='unsafe')
+        else :
+            samples = npz_member(npz_data, filename, 'samples')
+            first, last = time_window(len(samples), window_rate, start_time, end_time)
+            samples = np.array(samples[first:last])
+
+    if obs_time is not None : obs_time += datetime.timedelta(seconds=first / window_rate)
+    return samples, obs_time, centre_freq, sample_rate
+
+
+# Get the rows and columns of a spectrogram between start_time and end_time (in seconds), and between low_freq and high_freq (in Hz)
+def spectrogram_window(f, bins, start_time=None, end_time=None, low_freq=None, high_freq=None) :
+    columns = slice(np.searchsorted(bins, start_time) if start_time is not None else 0,
+                    np.searchsorted(bins, end_time, side='right') if end_time is not None else len(bins))
+    rows = slice(np.searchsorted(f * 1e6, low_freq) if low_freq is not None else 0,
+                 np.searchsorted(f * 1e6, high_freq, side='right') if high_freq is not None else len(f))
+    return rows, columns
+
+
+# Save a spectrogram as an SPG file. float64 is the original format, and uint8 and float16 are the compressed version 2 format
+def save_spg(filename, Pxx, f, bins, spg_format='uint8') :
+    if spg_format == 'float64' :
+        write_npz(filename, {'Pxx': Pxx, 'f': f, 'bins': bins})
+        return
+
+    Pxx_db = 10.0*np.log10(np.maximum(Pxx, MIN_POWER))
+    db_offset = np.min(Pxx_db) if Pxx_db.size > 0 else 0.0
+    if spg_format == 'uint8' :
+        db_range = np.max(Pxx_db) - db_offset if Pxx_db.size > 0 else 0.0
+        db_scale = db_range / np.iinfo(np.uint8).max if db_range > 0 else 1.0
+        Pxx_db -= db_offset
+        Pxx_db /= db_scale
+        quantised = np.rint(Pxx_db).astype(np.uint8)
+    else:
+        db_scale = 1.0
+        quantised = (Pxx_db - db_offset).astype(np.float16)
+
+    f_step = f[1] - f[0] if len(f) > 1 else 0.0
+    bins_step = bins[1] - bins[0] if len(bins) > 1 else 0.0
+    write_npz(filename, {'format_version': SPG_FORMAT_VERSION, 'Pxx_db': quantised, 'db_offset': np.float64(db_offset), 'db_scale': np.float64(db_scale),
+                         'f_start': np.float64(f[0] if len(f) > 0 else 0.0), 'f_step': np.float64(f_step),
+                         'bins_start': np.float64(bins[0] if len(bins) > 0 else 0.0), 'bins_step': np.float64(bins_step)}, compress=True)
+
+
+# Load an SPG file in either format. Returns the power spectrogram, the frequencies in MHz and the time of each column in seconds.
+# Old format files hold the times in samples, and are converted to seconds with bins_sample_rate.
+# Only the spectrogram between start_time and end_time (in seconds), and between low_freq and high_freq (in Hz), is converted
+# from dB, or read from an uncompressed file
+def load_spg(filename, start_time=None, end_time=None, low_freq=None, high_freq=None, bins_sample_rate=None) :
+    with np.load(filename) as npz_data :
+        if 'Pxx_db' in npz_data :
+            return load_spg_v2(npz_data, start_time, end_time, low_freq, high_freq)
+
+        f = npz_data['f']
+        bins = npz_data['bins']
+        if bins_sample_rate is not None : bins = bins / bins_sample_rate
+
+        rows, columns = spectrogram_window(f, bins, start_time, end_time, low_freq, high_freq)
+
+        Pxx = np.array(npz_member(npz_data, filename, 'Pxx')[rows, columns])
+
+    return Pxx, f[rows], bins[columns]
+
+
+# Load the window of a version 2 SPG file, converting the quantised dB values back to power
+def load_spg_v2(npz_data, start_time=None, end_time=None, low_freq=None, high_freq=None) :
+    Pxx_db = npz_data['Pxx_db']
+    f = npz_data['f_start'] + npz_data['f_step'] * np.arange(Pxx_db.shape[0])
+    bins = npz_data['bins_start'] + npz_data['bins_step'] * np.arange(Pxx_db.shape[1])
+
+    rows, columns = spectrogram_window(f, bins, start_time, end_time, low_freq, high_freq)
+
+    db_scale, db_offset = float(npz_data['db_scale']), float(npz_data['db_offset'])
+    if Pxx_db.dtype == np.uint8 :
+        # Look up the power of each of the 256 quantised values
+        Pxx = np.power(10.0, (np.arange(256) * db_scale + db_offset) / 10.0)[Pxx_db[rows, columns]]
+    else:
+        Pxx = Pxx_db[rows, columns].astype(np.float64)
+        Pxx *= db_scale / 10.0
+        Pxx += db_offset / 10.0
+        np.power(10.0, Pxx, out=Pxx)
+    return Pxx, f[rows], bins[columns]
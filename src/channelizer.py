@@ -0,0 +1,75 @@
+# Streaming channelizer for the SDR sample blocks
+#
+# Mixes the SDR samples down by an optional frequency offset, low pass filters and decimates them with a
+# polyphase FIR filter. The filter history and oscillator phase are carried from one block to the next, so
+# a continuous stream of sample blocks gives a continuous decimated stream with no edge effects at the
+# block boundaries.
+
+import numpy as np
+import scipy.signal as scipy_signal
+
+TAPS_PER_PHASE = 8          # FIR filter length is TAPS_PER_PHASE * decimation
+CUTOFF = 0.8                # Filter cutoff as a fraction of the decimated Nyquist frequency (as scipy decimate)
+
+
+class Channelizer():
+
+    def __init__(self, sample_rate, decimation, mix_frequency=0.0, taps_per_phase=TAPS_PER_PHASE) :
+        self.sample_rate = sample_rate
+        self.decimation = decimation
+        self.output_sample_rate = sample_rate / decimation
+        self.mix_frequency = mix_frequency
+
+        # Low pass filter, split into one sub filter for each phase of the decimation
+        self.num_taps = taps_per_phase * decimation
+        self.taps = scipy_signal.firwin(self.num_taps, CUTOFF / decimation, window='hamming').astype(np.float32)
+        self.phase_taps = [self.taps[phase::decimation] for phase in range(decimation)]
+
+        # Filter state carried between blocks
+        self.history = np.zeros(self.num_taps - 1, dtype=np.complex64)
+        self.offset = 0                 # Position in the next block of the next output sample
+        self.mix_phase = 0.0
+        self.mix_step = -2.0 * np.pi * mix_frequency / sample_rate
+
+
+    # Filter delay in seconds at the input sample rate
+    @property
+    def delay(self) :
+        return (self.num_taps - 1) / 2 / self.sample_rate
+
+
+    # Restart the stream, clearing the filter history
+    def reset(self) :
+        self.history[:] = 0
+        self.offset = 0
+        self.mix_phase = 0.0
+
+
+    # Channelize a block of samples, returning the decimated samples
+    def process(self, samples) :
+        samples = np.asarray(samples, dtype=np.complex64)
+
+        # Mix down, keeping the oscillator phase continuous across blocks
+        if self.mix_frequency != 0 :
+            phases = self.mix_phase + self.mix_step * np.arange(len(samples))
+            samples = samples * np.exp(1j * phases).astype(np.complex64)
+            self.mix_phase = (self.mix_phase + self.mix_step * len(samples)) % (2.0 * np.pi)
+
+        extended = np.concatenate((self.history, samples))
+        num_outputs = max(0, -(-(len(samples) - self.offset) // self.decimation))
+
+        # Polyphase decimation. Each phase filters every decimation'th sample with its sub filter and the phases are summed
+        decimated = np.zeros(num_outputs, dtype=np.complex64)
+        if num_outputs > 0 :
+            first_output = len(self.history) + self.offset
+            taps_per_phase = len(self.phase_taps[0])
+            for phase, phase_taps in enumerate(self.phase_taps) :
+                start = first_output - phase - (taps_per_phase - 1) * self.decimation
+                stop = start + (num_outputs + taps_per_phase - 1) * self.decimation
+                decimated += np.convolve(extended[start:stop:self.decimation], phase_taps, mode='valid')
+
+        # Carry the filter history and output position to the next block
+        self.offset = self.offset + num_outputs * self.decimation - len(samples)
+        self.history = extended[len(extended) - len(self.history):]
+
+        return decimated
@@ -0,0 +1,132 @@
+# Control socket for the acquisition
+#
+# The acquisition serves a Unix domain socket, by default ~/radar_data/control.sock, that only the user running
+# it can connect to. Each request is a line of JSON with a command, and the reply is a line of JSON:
+#
+# {"command": "capture"}                                    Save the most recent samples, as SIGUSR1
+# {"command": "capture", "time": "2025-01-01T21:15:30.5"}    Save the samples around a time, such as that of a
+#                                                           visual detection. The capture has the same samples
+#                                                           before and after the time as a triggered capture
+# {"command": "set", "snr_threshold": 50,                   Change the SNR threshold and the detection and noise
+#  "detection_band": [-100, 100], "noise_band": [-400, 400]} bands, any of which may be given
+# {"command": "status"}                                     Counts, noise and settings of each device and target
+#
+# The commands are run by the sample analyser of each device between the blocks, so the streaming is never
+# interrupted. The replies have "status": "ok", "pending" if the analyser has not run the command in time, or
+# "error" with a "message".
+#
+# This file is also a client for the socket, e.g.
+#   python control_socket.py status
+#   python control_socket.py capture --time 2025-01-01T21:15:30.5
+#   python control_socket.py set --snr_threshold 50 --detection_band -100 100
+
+import argparse
+import json
+import os
+import socket
+import socketserver
+import syslog
+import threading
+
+CONTROL_SOCKET = os.path.expanduser('~/radar_data/control.sock')
+COMMAND_TIMEOUT = 5.0           # Seconds to wait for the analysers to run a command before replying that it is pending
+
+
+# Command for a sample analyser from the control socket or a signal. The sender may wait for the analyser to finish it
+class ControlCommand():
+
+    def __init__(self, name, arguments=None) :
+        self.name = name
+        self.arguments = arguments if arguments is not None else {}
+        self.reply = {'status': 'pending'}
+        self.done = threading.Event()
+
+
+    # Set the reply to the command once it has been run
+    def finish(self, reply) :
+        self.reply = reply
+        self.done.set()
+
+
+    # Wait for the command to be run and get the reply
+    def wait(self, timeout=COMMAND_TIMEOUT) :
+        self.done.wait(timeout)
+        return self.reply
+
+
+# Server for the control socket. Each request is passed to the handler, which returns the reply
+class ControlServer(threading.Thread):
+
+    def __init__(self, handler, path=CONTROL_SOCKET) :
+        threading.Thread.__init__(self, daemon=True)
+        self.handler = handler
+        self.path = path
+        self.server = None
+
+
+    def run(self) :
+        control_server = self
+
+        class ControlHandler(socketserver.StreamRequestHandler):
+            def handle(self) :
+                for line in self.rfile :
+                    if not line.strip() : continue
+                    try:
+                        request = json.loads(line)
+                        if not isinstance(request, dict) : raise ValueError("request is not a JSON object")
+                        reply = control_server.handler(request)
+                    except Exception as e :
+                        reply = {'status': 'error', 'message': str(e)}
+                    self.wfile.write((json.dumps(reply) + '\n').encode())
+
+        # Remove the socket of an earlier run, and let only this user connect
+        if os.path.exists(self.path) : os.remove(self.path)
+        try:
+            self.server = socketserver.ThreadingUnixStreamServer(self.path, ControlHandler)
+            os.chmod(self.path, 0o600)
+        except OSError as e :
+            print("Unable to start the control socket:", e)
+            syslog.syslog(syslog.LOG_DEBUG, "Unable to start the control socket: " + str(e))
+            return
+        self.server.daemon_threads = True
+        self.server.serve_forever()
+
+
+    # Stop the server and remove the socket
+    def stop(self) :
+        if self.server is not None : self.server.server_close()
+        try: os.remove(self.path)
+        except OSError: pass
+
+
+# Send a request to the control socket and return the reply
+def send_request(request, path=CONTROL_SOCKET) :
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client :
+        client.connect(path)
+        client.sendall((json.dumps(request) + '\n').encode())
+        reply = b''
+        while not reply.endswith(b'\n') :
+            data = client.recv(4096)
+            if not data : break
+            reply += data
+    return json.loads(reply)
+
+
+# Main program
+if __name__ == "__main__":
+
+    ap = argparse.ArgumentParser(description='Send a command to the control socket of the acquisition')
+    ap.add_argument("command", type=str, choices=['status', 'capture', 'set'], help="Command")
+    ap.add_argument("--time", type=str, default=None, help="Time to capture the samples around e.g. 2025-01-01T21:15:30.5. Default is the most recent samples")
+    ap.add_argument("--device", type=int, default=None, help="Index of the SDR device to capture from. Default is all the devices")
+    ap.add_argument("-s", "--snr_threshold", type=float, default=None, help="New SNR threshold")
+    ap.add_argument("--detection_band", nargs=2, type=int, default=None, help="New frequency band for detection in Hz e.g. -120 120")
+    ap.add_argument("--noise_band", nargs=2, type=int, default=None, help="New frequency band for noise calculation in Hz e.g. -500 500")
+    ap.add_argument("--socket", type=str, default=CONTROL_SOCKET, help="Control socket. Default is " + CONTROL_SOCKET)
+    args = vars(ap.parse_args())
+
+    request = {'command': args['command']}
+    for key in ['time', 'device', 'snr_threshold', 'detection_band', 'noise_band'] :
+        if args[key] is not None : request[key] = args[key]
+
+    print(json.dumps(send_request(request, args['socket']), indent=2))
@@ -0,0 +1,80 @@
+# Capture file layout converter
+#
+# Rewrites the SMP and SPG capture files in the Captures and Archive directories in place, so that all their
+# members are uncompressed and aligned for memory mapping. The sample format of the SMP files is not changed, and
+# SMP files saved with compression are left compressed, as they are smaller than the mappable layout.
+# Original format SPG files may instead be converted to the compact version 2 format, and version 2 SPG files
+# are left as they are.
+# Each file is written to a temporary file in the same directory which then replaces the original, keeping
+# the permissions and modification time of the original so the disk space checker deletes files in the same order.
+
+import argparse
+import glob
+import os
+import shutil
+import numpy as np
+from capture_files import write_npz, is_mappable, is_compressed, save_spg, load_spg, SPG_FORMATS
+
+DATA_DIR =  os.path.expanduser('~/radar_data')
+CAPTURE_DIRS = [os.path.join(DATA_DIR, 'Captures'), os.path.join(DATA_DIR, 'Archive')]
+
+
+# Check whether an SPG file is to be converted to the version 2 format. The oldest SPG files, with the sample rate in
+# the file name, hold their times in samples and are kept in the original format
+def to_spg_v2(filename, spg_format) :
+    basename = os.path.basename(filename)
+    return 'SPG' in basename and spg_format != 'float64' and len(basename.split('_')) <= 5
+
+
+# Check whether a capture file needs to be converted
+def needs_conversion(filename, spg_format) :
+    if 'SPG' in os.path.basename(filename) :
+        with np.load(filename) as npz_data :
+            if 'Pxx_db' in npz_data : return False
+        if to_spg_v2(filename, spg_format) : return True
+    elif is_compressed(filename) : return False
+    return not is_mappable(filename)
+
+
+# Rewrite a capture file with the memory mappable layout, or as a version 2 SPG file
+def convert_capture(filename, spg_format) :
+    temp_filename = filename + '.tmp'
+    try:
+        if to_spg_v2(filename, spg_format) :
+            save_spg(temp_filename, *load_spg(filename), spg_format)
+        else:
+            with np.load(filename) as npz_data :
+                arrays = {name : npz_data[name] for name in npz_data.files}
+            write_npz(temp_filename, arrays)
+        shutil.copystat(filename, temp_filename)
+        os.replace(temp_filename, filename)
+    finally:
+        if os.path.exists(temp_filename) : os.remove(temp_filename)
+
+
+# Main program
+if __name__ == "__main__":
+
+    ap = argparse.ArgumentParser(description='Convert SMP and SPG capture files in place to the memory mappable layout')
+    ap.add_argument("dirs", type=str, nargs='*', default=CAPTURE_DIRS, help="Directories to convert. Default is " + str(CAPTURE_DIRS))
+    ap.add_argument("--spg_format", type=str, choices=SPG_FORMATS, default='float64', help="Format for original format SPG files. float64 keeps the original format with the mappable layout, uint8 and float16 convert to the compact version 2 format. Default is float64")
+    ap.add_argument("-n", "--dry_run", action='store_true', help="List the files that would be converted without converting them")
+    args = vars(ap.parse_args())
+
+    converted = skipped = failed = 0
+    for dirname in args['dirs'] :
+        filenames = sorted(glob.glob(dirname + '/**/SMP*.npz', recursive=True) + glob.glob(dirname + '/**/SPG*.npz', recursive=True))
+        for filename in filenames :
+            try:
+                if not needs_conversion(filename, args['spg_format']) :
+                    skipped += 1
+                    continue
+
+                print("Converting", filename)
+                if not args['dry_run'] : convert_capture(filename, args['spg_format'])
+                converted += 1
+            except Exception as e :
+                print("Failed to convert", filename, e)
+                failed += 1
+
+    print("Converted:", converted, " Already converted:", skipped, " Failed:", failed)
@@ -0,0 +1,69 @@
+# CPU layout for the acquisition processes
+#
+# Sets the CPUs that each part of the acquisition runs on:
+#
+# streamer  The streaming coroutine and the USB reads of the SDR, in the main thread
+# analysis  The sample analyser thread and the analysis worker processes
+# save      The capture writer processes
+#
+# The auto layout gives the streamer its own CPU, so the USB reads never wait for an FFT, the last CPU to the
+# capture writers and the rest to the analysis. With fewer than three CPUs the analysis and the writers share
+# the CPUs other than the streamer's. The affinity is set for the calling thread, and is inherited by the
+# threads and processes it then starts.
+
+import os
+import syslog
+
+CPU_ROLES = ['streamer', 'analysis', 'save']
+AFFINITY_MODES = ['none', 'auto']
+
+
+# Parse a list of CPUs such as 0,2 or 1-3
+def parse_cpus(text) :
+    cpus = set()
+    for part in text.split(',') :
+        if '-' in part :
+            first, last = part.split('-')
+            cpus.update(range(int(first), int(last) + 1))
+        elif part.strip() :
+            cpus.add(int(part))
+    return sorted(cpus)
+
+
+# CPUs that this process may run on
+def available_cpus() :
+    try: return sorted(os.sched_getaffinity(0))
+    except AttributeError: return list(range(os.cpu_count() or 1))
+
+
+class CpuLayout():
+
+    def __init__(self, affinity='none', streamer_cpus=None, analysis_cpus=None, save_cpus=None) :
+        self.cpus = {role : None for role in CPU_ROLES}
+
+        if affinity == 'auto' :
+            cpus = available_cpus()
+            if len(cpus) >= 3 :
+                self.cpus = {'streamer': cpus[:1], 'analysis': cpus[1:-1], 'save': cpus[-1:]}
+            elif len(cpus) == 2 :
+                self.cpus = {'streamer': cpus[:1], 'analysis': cpus[1:], 'save': cpus[1:]}
+
+        # CPUs given for a role replace those of the auto layout
+        for role, cpus in zip(CPU_ROLES, [streamer_cpus, analysis_cpus, save_cpus]) :
+            if cpus : self.cpus[role] = cpus
+
+
+    # Pin the calling thread to the CPUs of a role. Nothing is changed if the role has no CPUs set
+    def apply(self, role) :
+        cpus = self.cpus[role]
+        if not cpus : return
+
+        try:
+            os.sched_setaffinity(0, cpus)
+        except (AttributeError, OSError) as e :
+            syslog.syslog(syslog.LOG_DEBUG, "Unable to set the CPU affinity for " + role + ": " + str(e))
+
+
+    # Description of the layout for the startup diagnostics
+    def describe(self) :
+        return '  '.join(role + ': ' + (','.join(str(cpu) for cpu in self.cpus[role]) if self.cpus[role] else 'any') for role in CPU_ROLES)
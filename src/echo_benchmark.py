@@ -0,0 +1,243 @@
+# Synthetic meteor echo benchmark for the acquisition pipeline
+#
+# Builds a synthetic IQ recording, at the SDR sample rate, of receiver noise with meteor echoes and interference at known times,
+# replays it through meteor_radar.py (streaming, channelizer, analysis workers, triggers and capture writers) and
+# compares the meteors logged with those put in. The echoes are:
+#
+# underdense  Short pings with a fast rise and an exponential decay of a few tenths of a second
+# overdense   Long trails of one to a few seconds, fading slowly
+# head        Head echo chirps, a short signal sweeping in frequency across the detection band
+# rfi         Broadband interference bursts, which should be rejected by the median noise ratio test
+#
+# Each echo has a peak SNR in dB, the peak power of a spectrogram bin over the median noise power of a bin,
+# chosen at random between the limits given. The replay runs as fast as possible by default, without dropping
+# any blocks, for the throughput. With --speed 1 it runs in real time, for the skipped blocks and the trigger
+# latency at the pace of the dongle. --cpus pins the whole acquisition to the CPUs given, e.g. --cpus 0 for a
+# single core, so a change that would overload a station shows up as skipped blocks and a lower recall.
+#
+# The acquisition runs with its data directory in a temporary home directory, so the station's data and logs
+# are untouched. The exit status is 1 if the recall of the meteor echoes is below --min_recall.
+
+import argparse
+import ast
+import csv
+import datetime
+import glob
+import os
+import re
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import numpy as np
+from scipy.signal.windows import hamming
+from analysis_settings import SAMPLE_RATE, DECIMATION, NUM_FFT, FREQUENCY_OFFSET
+
+CENTRE_FREQ = 143050000
+START_TIME = datetime.datetime(2025, 1, 1)
+CHUNK_SECONDS = 1.0                 # Seconds of the recording generated at a time
+MATCH_TOLERANCE = 1.0               # Seconds between an echo and a logged detection for them to match
+ECHO_TYPES = ['underdense', 'overdense', 'head', 'rfi']
+METEOR_TYPES = ['underdense', 'overdense', 'head']
+DEFAULT_MIX = [6, 2, 1, 1]          # Relative numbers of each type of echo
+
+
+# Amplitude of a tone for a peak SNR in dB over the median noise power of a spectrogram bin, for a noise level
+# (standard deviation of the complex noise samples). The channelizer passes all the tone but only 1/DECIMATION of
+# the noise, and the median of the noise power of a bin is ln 2 times its mean
+def tone_amplitude(snr_db, noise_level) :
+    window = hamming(NUM_FFT, sym=True)
+    noise_bin_power = np.log(2) * noise_level**2 / DECIMATION * np.sum(window**2)
+    return np.sqrt(10**(snr_db / 10) * noise_bin_power) / np.sum(window)
+
+
+# Synthetic echo at a time in the recording. The signal is generated for any span of sample times, so the echoes
+# can be added to each chunk of the recording as it is generated
+class SyntheticEcho():
+
+    def __init__(self, echo_type, start, snr_db, doppler, rng) :
+        self.echo_type = echo_type
+        self.start = start
+        self.snr_db = snr_db
+        self.doppler = doppler          # Frequency offset in Hz from the centre frequency
+        self.phase = rng.uniform(0, 2 * np.pi)
+
+        if echo_type == 'underdense' :
+            self.duration = rng.uniform(0.05, 0.5)      # Decay time constant
+            self.length = 5 * self.duration
+        elif echo_type == 'overdense' :
+            self.duration = rng.uniform(1.0, 4.0)
+            self.length = self.duration + 1.0
+            self.fade_freq = rng.uniform(0.5, 2.0)
+        elif echo_type == 'head' :
+            self.duration = rng.uniform(0.1, 0.4)
+            self.length = self.duration
+            self.sweep = rng.uniform(-3000, -1000)      # Frequency sweep in Hz over the duration, falling through the centre frequency
+            self.doppler = doppler - self.sweep / 2
+        else:
+            self.duration = rng.uniform(0.02, 0.2)
+            self.length = self.duration
+
+        self.end = start + self.length
+
+
+    # Add the echo to the samples at times t (seconds from the start of the recording), for the tuning frequency
+    # FREQUENCY_OFFSET below the centre frequency
+    def add_to(self, samples, t, noise_level, rng) :
+        in_echo = (t >= self.start) & (t < self.end)
+        if not np.any(in_echo) : return
+        t = t[in_echo] - self.start
+        amplitude = tone_amplitude(self.snr_db, noise_level)
+
+        if self.echo_type == 'rfi' :
+            # Broadband noise over the whole band, with the power of a bin raised by the SNR
+            burst = rng.standard_normal(len(t)) + 1j * rng.standard_normal(len(t))
+            samples[in_echo] += (burst * noise_level * np.sqrt(10**(self.snr_db / 10) / 2)).astype(np.complex64)
+            return
+
+        frequency = self.doppler - FREQUENCY_OFFSET
+        if self.echo_type == 'underdense' :
+            envelope = np.minimum(t / 0.01, 1.0) * np.exp(-t / self.duration)
+            phase = 2 * np.pi * frequency * t
+        elif self.echo_type == 'overdense' :
+            envelope = np.minimum(t / 0.05, 1.0) * np.clip((self.length - t) / 1.0, 0, 1) * (0.7 + 0.3 * np.cos(2 * np.pi * self.fade_freq * t))
+            phase = 2 * np.pi * frequency * t
+        else:
+            envelope = np.sin(np.pi * t / self.duration)**2
+            phase = 2 * np.pi * (frequency * t + self.sweep * t**2 / (2 * self.duration))
+
+        samples[in_echo] += (amplitude * envelope * np.exp(1j * (phase + self.phase))).astype(np.complex64)
+
+
+# Make the echoes at random times, with at least the gap between them
+def make_echoes(duration, num_echoes, mix, snr_range, gap, rng) :
+    types = rng.choice(ECHO_TYPES, size=num_echoes, p=np.array(mix) / np.sum(mix))
+    echoes = []
+    slot = (duration - 2 * gap) / max(1, num_echoes)
+    for index, echo_type in enumerate(types) :
+        start = gap + index * slot + rng.uniform(0, max(0, slot - gap))
+        echoes.append(SyntheticEcho(echo_type, start, rng.uniform(*snr_range), rng.uniform(-50, 50), rng))
+    return echoes
+
+
+# Write the synthetic recording as complex64 IQ, a chunk at a time
+def write_recording(filename, duration, echoes, noise_level, rng) :
+    chunk_length = int(CHUNK_SECONDS * SAMPLE_RATE)
+    total_samples = int(duration * SAMPLE_RATE)
+    with open(filename, 'wb') as recording :
+        for first in range(0, total_samples, chunk_length) :
+            length = min(chunk_length, total_samples - first)
+            samples = ((rng.standard_normal(length) + 1j * rng.standard_normal(length)) * noise_level / np.sqrt(2)).astype(np.complex64)
+            t = (first + np.arange(length)) / SAMPLE_RATE
+            for echo in echoes :
+                if echo.start < t[-1] and echo.end > t[0] : echo.add_to(samples, t, noise_level, rng)
+            samples.tofile(recording)
+
+
+# Read the start times of the detections from the monthly csv logs, in seconds from the start of the recording
+def read_detections(log_dir) :
+    detections = []
+    for filename in glob.glob(log_dir + '*.csv') :
+        if os.path.basename(filename).startswith('R') : continue
+        with open(filename) as csv_file :
+            for row in csv.DictReader(csv_file) :
+                detection_time = datetime.datetime.strptime(row['date'] + ' ' + row['time'], '%Y-%m-%d %H:%M:%S.%f')
+                detections.append((detection_time - START_TIME).total_seconds())
+    return np.sort(np.array(detections))
+
+
+# Check which of the echoes have a detection logged near their start time, and which detections match no meteor echo
+def match_detections(echoes, detections) :
+    found = [bool(np.any(np.abs(detections - echo.start) <= MATCH_TOLERANCE)) for echo in echoes]
+    meteors = [echo for echo in echoes if echo.echo_type in METEOR_TYPES]
+    false_detections = sum(1 for detection in detections if not any(echo.start - MATCH_TOLERANCE <= detection <= echo.end + MATCH_TOLERANCE for echo in meteors))
+    return found, false_detections
+
+
+# Get a value from a line of the acquisition output
+def find_value(pattern, output, default=0.0) :
+    match = re.search(pattern, output)
+    return float(match.group(1)) if match else default
+
+
+# Main program
+if __name__ == "__main__":
+
+    ap = argparse.ArgumentParser(description='Benchmark the acquisition pipeline with a synthetic recording of meteor echoes')
+    ap.add_argument("-d", "--duration", type=float, default=120, help="Length of the recording in seconds. Default is 120")
+    ap.add_argument("-n", "--echoes", type=int, default=10, help="Number of echoes in the recording. Default is 10")
+    ap.add_argument("--mix", type=float, nargs=4, default=DEFAULT_MIX, help="Relative numbers of underdense, overdense, head and rfi echoes. Default is " + ' '.join(str(n) for n in DEFAULT_MIX))
+    ap.add_argument("--snr", type=float, nargs=2, default=[20, 35], help="Range of the peak SNR of the echoes in dB. Default is 20 35")
+    ap.add_argument("--noise", type=float, default=0.02, help="Noise level, the standard deviation of the complex samples. Default is 0.02")
+    ap.add_argument("--speed", type=float, default=0, help="Replay speed as a multiple of real time. 0 runs as fast as possible without dropping blocks. Default is 0")
+    ap.add_argument("--cpus", type=str, default=None, help="CPUs to pin the whole acquisition to e.g. 0 for a single core. Default is no pinning")
+    ap.add_argument("--trigger", type=str, default='stft', help="Trigger engine. Default is stft")
+    ap.add_argument("--analysis_workers", type=int, default=None, help="Number of analysis worker processes. Default is that of meteor_radar.py")
+    ap.add_argument("--seed", type=int, default=0, help="Random seed of the recording. Default is 0")
+    ap.add_argument("--min_recall", type=float, default=0.0, help="Recall of the meteor echoes below which the benchmark fails. Default is 0")
+    ap.add_argument("--keep", action='store_true', help="Keep the recording and the acquisition data directory")
+    ap.add_argument("--acquisition_args", type=str, nargs=argparse.REMAINDER, default=[], help="Further arguments for meteor_radar.py")
+    args = vars(ap.parse_args())
+
+    rng = np.random.default_rng(args['seed'])
+    duration = args['duration']
+    echoes = make_echoes(duration, args['echoes'], args['mix'], args['snr'], 12.0, rng)
+
+    # The acquisition runs in a temporary home directory, so its data directory is there too
+    work_dir = tempfile.mkdtemp(prefix='echo_benchmark_')
+    recording = os.path.join(work_dir, 'synthetic.cf32')
+    print("Writing", duration, "s synthetic recording with", len(echoes), "echoes to", recording)
+    write_recording(recording, duration, echoes, args['noise'], rng)
+
+    command = [sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'meteor_radar.py'), '-f', str(CENTRE_FREQ), '--trigger', args['trigger'],
+               '--replay', recording, '--replay_speed', str(args['speed']), '--replay_freq', str(CENTRE_FREQ + FREQUENCY_OFFSET), '--replay_start', START_TIME.isoformat()]
+    if args['cpus'] : command += ['--streamer_cpus', args['cpus'], '--analysis_cpus', args['cpus'], '--save_cpus', args['cpus']]
+    if args['analysis_workers'] : command += ['--analysis_workers', str(args['analysis_workers'])]
+    command += args['acquisition_args']
+
+    environment = dict(os.environ, HOME=work_dir)
+    start_time = time.monotonic()
+    result = subprocess.run(command, env=environment, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+    elapsed = time.monotonic() - start_time
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    output = result.stdout
+
+    if 'Replay finished' not in output :
+        print(output)
+        print("The acquisition did not finish the replay")
+        sys.exit(1)
+
+    # Results of the replay reported by the acquisition
+    blocks_per_second = find_value(r'([\d.]+) blocks/s', output)
+    real_time = find_value(r'([\d.]+) times real time', output)
+    dropped_blocks = int(find_value(r'Dropped: (\d+)', output))
+    skipped_blocks = int(find_value(r'Skipped: (\d+)', output))
+    captures = ast.literal_eval(re.search(r'Captures: (\{.*\})', output).group(1))
+    dropped_saves = sum(captures[key] for key in ['dropped_oldest', 'dropped_lowest_snr', 'stats_only', 'overwritten', 'failed'])
+    triggers = int(find_value(r'Trigger latency: (\d+) triggers', output))
+
+    detections = read_detections(os.path.join(work_dir, 'radar_data', 'Logs') + '/')
+    found, false_detections = match_detections(echoes, detections)
+
+    print("Trigger engine:", args['trigger'], " CPUs:", args['cpus'] if args['cpus'] else 'any', " Speed:", args['speed'] if args['speed'] > 0 else 'unpaced')
+    print('Throughput: {0:.1f} blocks/s  {1:.1f} times real time  Wall: {2:.1f} s  CPU: {3:.1f} s'.format(blocks_per_second, real_time, elapsed, usage.ru_utime + usage.ru_stime))
+    print('Blocks dropped: {0}  skipped: {1}  Captures: {2}  Dropped saves: {3}'.format(dropped_blocks, skipped_blocks, captures['queued'], dropped_saves))
+    if triggers > 0 :
+        print('Trigger latency: {0} triggers  mean: {1:.1f} ms  p95: {2:.1f} ms  max: {3:.1f} ms'.format(
+            triggers, find_value(r'mean: ([\d.]+) ms', output), find_value(r'p95: ([\d.]+) ms', output), find_value(r'max: ([\d.]+) ms', output)))
+
+    for echo_type in ECHO_TYPES :
+        type_found = [is_found for echo, is_found in zip(echoes, found) if echo.echo_type == echo_type]
+        if len(type_found) == 0 : continue
+        label = 'Detected' if echo_type in METEOR_TYPES else 'Logged (should be rejected)'
+        print('{0:11s} Echoes: {1:3d}  {2}: {3:3d}'.format(echo_type, len(type_found), label, sum(type_found)))
+
+    meteor_found = [is_found for echo, is_found in zip(echoes, found) if echo.echo_type in METEOR_TYPES]
+    recall = sum(meteor_found) / len(meteor_found) if meteor_found else 1.0
+    print('Recall: {0:.2f}  Detections logged: {1}  False detections: {2}'.format(recall, len(detections), false_detections))
+
+    if args['keep'] : print("Recording and data directory kept in", work_dir)
+    else : shutil.rmtree(work_dir, ignore_errors=True)
+    sys.exit(0 if recall >= args['min_recall'] else 1)
@@ -1,6 +1,9 @@
 import glob
 import time
-from rtlsdr import *
+try:
+    from rtlsdr import *
+except ImportError:
+    RtlSdr = None       # Without pyrtlsdr only the replay of recorded samples is available
 import asyncio
 import numpy as np
 import datetime
@@ -8,12 +11,11 @@ import re
 # import matplotlib.pyplot as plt
 from matplotlib.mlab import specgram
 import scipy.signal as scipy_signal
-from scipy.signal import ShortTimeFFT
-from scipy.signal.windows import gaussian, hamming
+from scipy.signal.windows import gaussian
 import scipy.io.wavfile as wav
 
 from collections import deque
-from queue import Queue
+from queue import Queue, Full, Empty
 import os
 import syslog
 # import logging
@@ -21,16 +23,32 @@ import threading
 import signal
 import argparse
 from multiprocessing import Process, Queue as mpQueue
-from waterfall import Waterfall
+from sample_ring import SampleRing
+from channelizer import Channelizer
+from trigger_engines import TRIGGER_ENGINES, create_trigger_engine
+from spectral_plan import frequency_band, set_fft_workers, get_fft_workers
+from noise_floor import NoiseFloorModel, NOISE_TIME_CONSTANT
+from spectra_cache import SpectraCache
+from capture_files import save_smp, save_spg, load_spg, SMP_FORMATS, SPG_FORMATS
+from save_scheduler import SaveScheduler, OVERFLOW_POLICIES, SAVE_WRITERS, SAVE_QUEUE_LENGTH
+from cpu_layout import CpuLayout, AFFINITY_MODES, parse_cpus
+from replay_sdr import ReplaySdr
+from stage_profiler import StageProfiler, ProfileReporter, PROFILE_INTERVAL
+from metrics_exporter import MetricsExporter, METRICS_INTERVAL, current_rss
+from stream_monitor import StreamMonitor, STALL_TIMEOUT
+from control_socket import ControlServer, ControlCommand
+from analysis_settings import SAMPLE_RATE, SDR_BLOCK_SIZE, DECIMATION, FREQUENCY_OFFSET, DETECTION_FREQUENCY_BAND, NOISE_CALCULATION_BAND, ANALYSIS_OVERLAP, \
+    COMPRESSION_FREQUENCY_BAND, NUM_FFT, HOP, HISTORY_LENGTH, MAX_MEDIAN_NOISE_RATIO
 
 DATA_DIR =  os.path.expanduser('~/radar_data/')
 CAPTURES_DIR = DATA_DIR + 'Captures/'
 ARCHIVE_DIR = DATA_DIR + 'Archive/'
 LOG_DIR = DATA_DIR + 'Logs/'
 CONFIG_FILE = os.path.expanduser('~/.radar_config')
+CONTROL_SOCKET = DATA_DIR + 'control.sock'
 DISK_SPACE_TO_LEAVE = 1e9   # Spare bytes to leave on disk 1GB
 
-SAMPLES_LENGTH = 24                   # Length of the deque for recording samples data
+SAMPLES_LENGTH = 24                   # Number of sample blocks recorded for each detection
 SAMPLES_BEFORE_TRIGGER = 6            # Number of samples wanted before the trigger (2 = 1 second)
 # CENTRE_FREQUENCY = 92.9e6           # Radio 4
 # CENTRE_FREQUENCY = 100.3e6          # Radio 3
@@ -41,34 +59,55 @@ SAMPLES_BEFORE_TRIGGER = 6            # Number of samples wanted before the trig
 # CENTRE_FREQUENCY = 143.06160e6      # Narrow signal near Graves
 # CENTRE_FREQUENCY = 143.05e6         # GRAVES
 
-# RTL SDR settings - 225001 to 300000 and 900001 to 3200000
-SAMPLE_RATE = 300000       #    960000 (262144-causes noise near 143.05) 262144, 240000
+# RTL SDR settings. The sample rate, block size and decimation, and the analysis settings, are in analysis_settings.py
 SDR_GAIN = 50
-DECIMATION = 8             # Reduce audio sample rate from 300k to 37.5k
 
 # FFT Settings
-FREQUENCY_OFFSET = -2000   # Tuning frequency offset from centre (so signal appears as 2kHz audio on upper sideband)
-DETECTION_FREQUENCY_BAND = [-120,+120]    # Band for detection is +/- F Hz
-NOISE_CALCULATION_BAND = [-500,+500]    # Band for noise calculation is +/- F Hz
 OVERLAP = 0.75             # Overlap for saved FFT data (0.75 is 75%)
-ANALYSIS_OVERLAP = 0.5     # Overlap for detection analysis
-COMPRESSION_FREQUENCY_BAND = 1000   # Band for compression data saving is +/- 1000 Hz
 AUDIO_FREQUENCY_BANDPASS = [1500, 3000]   # Bandpass filter for audio around 2 kHz
-NUM_FFT = 2**15
-HOP=int(NUM_FFT*(1-ANALYSIS_OVERLAP))
 
 # Trigger condition settings
 TRIGGERS_REQUIRED = 1
-MAX_MEDIAN_NOISE_RATIO = 3
+REPORT_INTERVAL = 1000     # Number of sample blocks between logs of the analysis cost and the noise floor model state
+
+# Analysis worker settings
+ANALYSIS_WORKERS = 2       # Number of persistent processes for the PSD analysis of sample blocks
+FFT_WORKERS = 1            # Number of threads for each FFT
+BLOCKS_PER_WORKER = 2      # Number of sample blocks that may be waiting for each analysis worker
+RESULT_WAIT = 1.0          # Longest time in seconds the analyser waits for samples before checking for results
+STALL_CHECK_INTERVAL = 1.0 # Seconds between the checks for a stalled stream
+RESTART_WAIT = 0.01        # Seconds between the checks for the analysis workers to finish before the analysis is restarted
+MAX_CAPTURE_AHEAD = 60     # Seconds ahead that a capture may be requested
+
+devices = []
+save_scheduler = None
+diskspacechecker = None
+control_server = None
+profiler = StageProfiler()          # Disabled unless --profile is given
+profile_file = None
 
 # Handle process signals
 def signalHandler (signum, frame) :
-    # If we have a SIGUSR1 (kill -USR1 <pid>) signal, save current sample buffer
+    # If we have a SIGUSR1 (kill -USR1 <pid>) signal, save current sample buffer of each device.
+    # The capture is made by the sample analyser, not in the signal handler
     if signum == signal.SIGUSR1 :
         syslog.syslog(syslog.LOG_DEBUG, "SIGUSR1 caught")
-        sample_analyser.save_samples()
+        for device in devices :
+            if device.sample_analyser is not None : device.sample_analyser.commands.put(ControlCommand('capture'))
     else:
-        os._exit(0)
+        shutdown()
+
+# Stop the analysis workers and capture writers, remove the shared memory and exit
+def shutdown() :
+    if control_server is not None : control_server.stop()
+    for device in devices :
+        if device.sample_analyser is not None : device.sample_analyser.stop_analysis_workers()
+    if save_scheduler is not None : save_scheduler.stop()
+    for device in devices :
+        device.unlink()
+    profiler.report(profile_file)
+    profiler.unlink()
+    os._exit(0)
 
 # Create all necessary data directories for acquisition
 def make_directories() :
@@ -77,17 +116,10 @@ def make_directories() :
     os.makedirs(ARCHIVE_DIR, exist_ok=True)
     os.makedirs(LOG_DIR, exist_ok=True)
 
-# Class for containing sample data and time of sample
-class TimedSample():
-
-    def __init__(self, sample, sample_time) :
-        self.sample = sample
-        self.sample_time = sample_time
-
-
 class DiskSpaceChecker(threading.Thread):
     def __init__(self) :
         threading.Thread.__init__( self )
+        self.space_left = None      # Disk space left at the last check, for the metrics
 
     """ Check disk space every 30 mins, and remove oldest files if required. """
     def run(self):
@@ -96,6 +128,7 @@ class DiskSpaceChecker(threading.Thread):
             # Do nothing if enough space (e.g. >1 GB) left
             statvfs = os.statvfs(os.path.expanduser('~'))
             space_left = statvfs.f_frsize * statvfs.f_bavail
+            self.space_left = space_left
             syslog.syslog(syslog.LOG_DEBUG, "Disk space checker, space left: " + str(space_left))
             if space_left > DISK_SPACE_TO_LEAVE :
                 time.sleep(1800)
@@ -112,6 +145,7 @@ class DiskSpaceChecker(threading.Thread):
                 statvfs = os.statvfs(os.path.expanduser('~'))
                 space_left = statvfs.f_frsize * statvfs.f_bavail
                 # percent_available = (statvfs.f_frsize * statvfs.f_bavail) / (statvfs.f_frsize * statvfs.f_blocks)  # % disk space available
+                self.space_left = space_left
                 if space_left > DISK_SPACE_TO_LEAVE or len(radio_files) == 0 : break
                 try:
                     file_for_removal = radio_files.pop(0)
@@ -125,8 +159,10 @@ class DiskSpaceChecker(threading.Thread):
 # Class for logging detections to RMOB file
 class RMBLogger():
 
-    def __init__(self):
+    def __init__(self, log_dir=LOG_DIR, tag=''):
 
+        self.log_dir = log_dir
+        self.tag = tag
         self.id = ""
         self.Long = 0.0
         self.Lat = 0.0
@@ -156,17 +192,17 @@ class RMBLogger():
     # Write to RMB format R<date>_<location>.csv file as:
     # Ver,Y,M,D,h,m,s,Bri,Dur,freq,ID,Long,Lat,Alt,Tz
     def log_data(self,obs_time,Bri,Dur,freq) :
-        filename = "R" + obs_time.strftime("%Y%m%d_") + self.id + ".csv"
+        filename = "R" + obs_time.strftime("%Y%m%d_") + self.id + self.tag + ".csv"
         try:
-            rmb_file = open(LOG_DIR + filename, "r")
+            rmb_file = open(self.log_dir + filename, "r")
             rmb_file.close()
         except:
-            rmb_file = open(LOG_DIR + filename, "a")
+            rmb_file = open(self.log_dir + filename, "a")
             rmb_file.write("Ver,Y,M,D,h,m,s,Bri,Dur,freq,ID,Long,Lat,Alt,Tz\n")
             rmb_file.close()
 
         try:
-            rmb_file = open(LOG_DIR + filename, "a")
+            rmb_file = open(self.log_dir + filename, "a")
             rmb_string = '{0:s},{1:s},{2:.2f},{3:.2f},{4:.2f},{5:s},{6:.5f},{7:.5f},{8:.1f},{9:d}\n'.format(self.Ver, obs_time.strftime("%Y,%m,%d,%H,%M,%S.%f")[:-3], Bri, Dur, freq, self.id, self.Long, self.Lat, self.Alt, self.Tz)
             syslog.syslog(syslog.LOG_DEBUG, "Writing to RMB file " + filename + " " + rmb_string)
             rmb_file.write(rmb_string)
@@ -177,8 +213,10 @@ class RMBLogger():
 
 # Class for logging detections to monthly csv file
 class MonthlyCsvLogger():
-    def __init__(self):
+    def __init__(self, log_dir=LOG_DIR, tag=''):
 
+        self.log_dir = log_dir
+        self.tag = tag
         self.id = ""
         self.Lat = 0.0
         self.Long = 0.0
@@ -209,11 +247,11 @@ class MonthlyCsvLogger():
     def log_data(self, obs_time, centre_freq, frequency, signal, noise, duration, max_snr) :
 
         try:
-            filename = obs_time.strftime('%Y-%m.csv')
-            csv_file = open(LOG_DIR + filename, "r")
+            filename = obs_time.strftime('%Y-%m') + self.tag + '.csv'
+            csv_file = open(self.log_dir + filename, "r")
             csv_file.close()
         except:
-            csv_file = open(LOG_DIR + filename, "a")
+            csv_file = open(self.log_dir + filename, "a")
             csv_file.write("user_ID,date,time,signal,noise,frequency,durationc,durations,lat,long,source,timesync,snratio,doppler_estimate\n")
             csv_file.close()
 
@@ -226,8 +264,8 @@ class MonthlyCsvLogger():
             output_line = "%s,%s,%s,%.3f,%.3f,%s,%s,%.2f,%.2f,%.2f,%s,%s,%.2f,%s\n" % (self.id, date, time, signal, noise, offset_frequency, '0', duration, self.Lat, self.Long, self.tx_source, self.time_sync, max_snr, doppler_estimate)
             if verbose : print("csv output:", output_line)
 
-            filename = obs_time.strftime('%Y-%m.csv')
-            csv_file = open(LOG_DIR + filename, "a")
+            filename = obs_time.strftime('%Y-%m') + self.tag + '.csv'
+            csv_file = open(self.log_dir + filename, "a")
             csv_file.write(output_line)
             csv_file.close()
         except Exception as e :
@@ -245,7 +283,14 @@ class CaptureStatistics() :
         self.snr_threshold = snr_threshold
         self.centre_freq = centre_freq
         self.meteor_detections = []
-        self.noise_calculation_band = np.where((f*1e6 > (self.centre_freq + noise_calculation_band[0])) & (f*1e6 <= (self.centre_freq + noise_calculation_band[1])))
+        self.noise_calculation_band = frequency_band(f*1e6, self.centre_freq + noise_calculation_band[0], self.centre_freq + noise_calculation_band[1])
+
+
+    # Create the capture statistics from a saved SPG file in either format
+    @classmethod
+    def from_spg(cls, filename, obs_time, snr_threshold, centre_freq) :
+        Pxx, f, bins = load_spg(filename)
+        return cls(Pxx, f, bins, obs_time, snr_threshold, centre_freq)
 
 
     def calculate(self) :
@@ -302,8 +347,9 @@ class CaptureStatistics() :
 
         # Narrow the frequency band for the calculations
         self.centre_freq = centre_freq
-        self.noise_calculation_band = np.where((self.f*1e6 > (self.centre_freq + noise_calculation_band[0])) & (self.f*1e6 <= (self.centre_freq + noise_calculation_band[1])))
-        self.detection_band = np.where((self.f*1e6 > (self.centre_freq + detection_frequency_band[0])) & (self.f*1e6 <= (self.centre_freq + detection_frequency_band[1])))
+        f_hz = self.f*1e6
+        self.noise_calculation_band = frequency_band(f_hz, self.centre_freq + noise_calculation_band[0], self.centre_freq + noise_calculation_band[1])
+        self.detection_band = frequency_band(f_hz, self.centre_freq + detection_frequency_band[0], self.centre_freq + detection_frequency_band[1])
         self.Pxx = self.Pxx[self.noise_calculation_band]
         self.f = self.f[self.noise_calculation_band]
 
@@ -316,50 +362,38 @@ class CaptureStatistics() :
         self.snr = self.log_sigmax - self.log_mn
         self.min_detection_duration = self.bins[1] - self.bins[0]
 
-        readings_gt_thresh = np.array(np.argwhere(self.Pxx > self.raw_median * self.snr_threshold))
-        readings_gt_thresh = readings_gt_thresh[readings_gt_thresh[:, 1].argsort()]
-
-        if len(readings_gt_thresh) == 0 :
+        # Find the time columns with a reading above the threshold, and split them into detections where there is a gap of more than one second
+        above_threshold = self.Pxx > self.raw_median * self.snr_threshold
+        column_max = np.max(self.Pxx, axis=0)
+        columns = np.flatnonzero(np.any(above_threshold, axis=0))
+        if len(columns) == 0 :
             return self.meteor_detections
 
-        first_time = self.bins[readings_gt_thresh[0][1]]
-        prev_time = first_time
-        new_detection = True
-
-
-        for reading in readings_gt_thresh :
-            det_time = self.bins[reading[1]]
-            det_freq = self.f[reading[0]]
-            power = self.Pxx[reading[0],reading[1]]
+        times = self.bins[columns]
+        starts = np.concatenate(([0], np.flatnonzero(np.diff(times) > 1.0) + 1))
+        ends = np.append(starts[1:], len(columns)) - 1
 
-            if new_detection :
-                new_detection = False
-                det_start_time = det_time
-                real_detection_time = self.obs_time + datetime.timedelta(seconds=det_start_time)
-                max_power = self.Pxx[reading[0],reading[1]]
-                initial_frequency = det_freq
+        # The peak power of each detection, and the initial frequency as the lowest frequency above the threshold at its start
+        max_power = np.maximum.reduceat(column_max[columns], starts)
+        initial_rows = np.argmax(above_threshold[:, columns[starts]], axis=0)
+        durations = times[ends] - times[starts] + self.min_detection_duration
+        max_snrs = 10 * np.log10(max_power) - self.log_mn
 
-            # If there is a one second gap in the signal register a completed detection and set the start time for a new one
-            if det_time - prev_time > 1.0 :
-                duration = prev_time - det_start_time + self.min_detection_duration
-                max_snr = 10 * np.log10(max_power) - self.log_mn
-                self.meteor_detections.append(MeteorDetection(real_detection_time, duration, initial_frequency, max_snr))
+        for det_start_time, duration, initial_row, max_snr in zip(times[starts], durations, initial_rows, max_snrs) :
+            real_detection_time = self.obs_time + datetime.timedelta(seconds=det_start_time)
+            self.meteor_detections.append(MeteorDetection(real_detection_time, duration, self.f[initial_row], max_snr))
 
-                det_start_time = det_time
-                real_detection_time = self.obs_time + datetime.timedelta(seconds=det_start_time)
-                max_power = self.Pxx[reading[0],reading[1]]
-                initial_frequency = det_freq
-
-            # Less than 1 second gap, so check max power
-            if power > max_power : max_power = power
-
-            prev_time = det_time
+        return self.meteor_detections
 
-        duration = prev_time - det_start_time + self.min_detection_duration
-        max_snr = 10 * np.log10(max_power) - self.log_mn
-        self.meteor_detections.append(MeteorDetection(real_detection_time, duration, initial_frequency, max_snr))
 
-        return self.meteor_detections
+    # The meteor detection that is the detection found by calculate(), the one overlapping it in time, to within a time step,
+    # that is nearest to it in frequency. None if no meteor detection overlaps it
+    def primary_detection(self) :
+        step = datetime.timedelta(seconds=self.min_detection_duration)
+        detection_end = self.detection_time + datetime.timedelta(seconds=self.detection_duration)
+        overlapping = [detection for detection in self.meteor_detections
+                       if detection.start_time - step <= detection_end and self.detection_time <= detection.start_time + datetime.timedelta(seconds=detection.duration) + step]
+        return min(overlapping, key=lambda detection: abs(detection.initial_frequency - self.detection_freq), default=None)
 
 
 # Class for recording meteor detections data
@@ -373,164 +407,557 @@ class MeteorDetection() :
         print("Meteor detection: Time", self.start_time, "duration", self.duration, "initial frequency", self.initial_frequency, "max SNR", self.max_snr)
 
 
-# Sample analyser. Threaded class for taking data from the sample queue for analysis
+# Trigger state and detection logs of a target frequency. The first target logs to the log directory, and each
+# other target to a subdirectory named by its frequency, so the RMOB and monthly csv reports can be made for each.
+# The log file names have the tag of the SDR device
+class TargetTrigger():
+    def __init__(self, index, centre_freq, num_targets=1, device_tag='') :
+        self.index = index
+        self.centre_freq = centre_freq
+        self.label = '' if num_targets == 1 else ' Target: ' + str(int(centre_freq))
+
+        self.noise_deque = deque(maxlen=8)
+        self.median_noise = 10.0
+        self.trigger_count = 0
+        self.trigger_wait_counter = 0
+        self.trigger_snr = 0
+        self.noise_floor = None
+        self.triggers = 0               # Detections triggered, and those cancelled due to high noise, for the metrics
+        self.cancelled_triggers = 0
+        self.last_capture = None        # Start and end times of the last capture, whose meteors are not logged again by the next
+
+        self.log_dir = LOG_DIR if index == 0 else LOG_DIR + str(int(centre_freq)) + '/'
+        os.makedirs(self.log_dir, exist_ok=True)
+        self.rmb_logger = RMBLogger(self.log_dir, device_tag)
+        self.csv_logger = MonthlyCsvLogger(self.log_dir, device_tag)
+
+
+# Tag for the file names of an SDR device, from its serial number or index. The first device has no tag, so a single device has the original file names
+def device_tag(index, device_id) :
+    if index == 0 : return ''
+    return '-' + ('D' + str(int(device_id)) if is_device_index(device_id) else ''.join(c for c in device_id if c.isalnum()))
+
+
+# Check whether a device is given by its index rather than its serial number. RTL-SDR serial numbers have 8 digits by default
+def is_device_index(device_id) :
+    return device_id.isdigit() and len(device_id) <= 2
+
+
+# SDR device and its acquisition pipeline: the sample ring and queue and the sample analyser. The capture writers,
+# the disk space checker and the log directories are shared by all the devices.
+# A replay SDR may be given instead of a device. When the replay is not paced no blocks are dropped or skipped,
+# the streaming waits for the analysis and the saves instead
+class SdrDevice():
+    def __init__(self, index, device_id, ring_length, replay=None) :
+        self.index = index
+        self.device_id = device_id      # Serial number or index of the device, None for the first device found
+        self.name = 'default' if device_id is None else device_id
+        self.tag = device_tag(index, device_id)
+        self.sdr = None
+        self.sample_analyser = None
+        self.replay = replay
+        self.lossless = replay is not None and not replay.paced
+        if replay is not None : self.name = 'replay'
+
+        # Monitor of the continuity of the sample stream against the wall clock. A replay is not received in real time, so it has none
+        self.monitor = StreamMonitor(SAMPLE_RATE, LOG_DIR, self.tag, self.name) if replay is None else None
+
+        # Shared memory ring of sample blocks for analysis and for saving on trigger, and the queue of blocks for the analyser
+        self.sample_ring = SampleRing(ring_length, SDR_BLOCK_SIZE // DECIMATION, SAMPLE_RATE / DECIMATION)
+        self.sample_queue = Queue(maxsize=10)
+
+        # Monotonic time that the block in each slot of the ring arrived, for the trigger latency
+        self.arrival_times = np.zeros(ring_length)
+
+        # Blocks received from the device, and blocks dropped because the analyser had not taken the earlier blocks
+        self.counters = {'received': 0, 'dropped': 0}
+
+
+    # Open the device
+    def open(self) :
+        if self.replay is not None : self.sdr = self.replay
+        elif self.device_id is None : self.sdr = RtlSdr()
+        elif is_device_index(self.device_id) : self.sdr = RtlSdr(device_index=int(self.device_id))
+        else: self.sdr = RtlSdr(serial_number=self.device_id)
+
+
+    # Time that the last block was received. For a replay this is the time of the block in the recording
+    def receive_time(self) :
+        return self.replay.receive_time if self.replay is not None else None
+
+
+    # Number of blocks received that have not yet been analysed, skipped or dropped
+    def pending_blocks(self) :
+        analyser = self.sample_analyser
+        return self.counters['received'] - self.counters['dropped'] - analyser.skipped_blocks - analyser.analysed_blocks
+
+
+    # Remove the shared memory of the device
+    def unlink(self) :
+        if self.sample_analyser is not None and self.sample_analyser.spectra_cache is not None : self.sample_analyser.spectra_cache.unlink()
+        self.sample_ring.unlink()
+
+
+# Save a capture of one of the devices - run in a capture writer process. The capture is logged with the detection settings it was made with
+def write_device_capture(device_index, settings, *job) :
+    apply_detection_settings(settings)
+    return devices[device_index].sample_analyser.write_capture(*job)
+
+
+# Log the detection statistics of a capture of one of the devices without saving it
+def log_device_capture(device_index, settings, *job) :
+    apply_detection_settings(settings)
+    devices[device_index].sample_analyser.log_capture_only(*job)
+
+
+# Detection settings that can be changed through the control socket
+def detection_settings() :
+    return {'snr_threshold': snr_threshold, 'detection_band': list(detection_frequency_band), 'noise_band': list(noise_calculation_band)}
+
+
+# Use detection settings in this process
+def apply_detection_settings(settings) :
+    global snr_threshold, detection_frequency_band, noise_calculation_band
+    snr_threshold = settings['snr_threshold']
+    detection_frequency_band = settings['detection_band']
+    noise_calculation_band = settings['noise_band']
+
+
+# Prepare a capture writer process, moving it from the analysis CPUs to the save CPUs
+def setup_writer() :
+    cpu_layout.apply('save')
+
+
+# Sample analyser. Threaded class for taking data from the sample queue of an SDR device for analysis.
+# The first of the target frequencies is the centre frequency that the SDR is tuned to.
+# The capture writers are shared by the analysers of all the devices, and are started when every analyser has set up
+# its frequency bands and spectra cache, so the writer processes have those of all the devices
 class SampleAnalyser(threading.Thread):
-    def __init__(self, centre_freq):
+    def __init__(self, device, centre_freqs, save_scheduler, setup_barrier, num_analysis_workers=ANALYSIS_WORKERS, trigger_engine_name='stft', noise_time_constant=NOISE_TIME_CONSTANT):
         # Initialise the thread
         threading.Thread.__init__(self)
 
 
         # Initialise variables
-        self.noise_deque = deque(maxlen=8)
         self.fmax3_deque = deque(maxlen=16)      # Deque for storing 3 frequencies with most signal
-        self.median_noise = 10.0
         self.ave_noise = 10.0
 
-        self.trigger_count = 0
-        self.trigger_wait_counter = 0
-
         self.fmax3_count = 0
 
-        self.analysis_thread = None
-        self.save_process1 = None
-        self.save_process2 = None
+        self.num_analysis_workers = num_analysis_workers
+        self.trigger_engine_name = trigger_engine_name
+        self.trigger_engine = None
+        self.spectral_plan = None
+        self.spectra_cache = None
+        self.result_ring_sequence = None
+        self.noise_time_constant = noise_time_constant
+        self.use_noise_floor = False
+        self.analysis_cpu_time = 0.0
+        self.analysed_blocks = 0
+        self.skipped_blocks = 0
+        self.trigger_latencies = deque(maxlen=1000)   # Time in seconds from the arrival of a block to the detection it triggered
+        self.commands = Queue()                       # Commands from the control socket and signals
+        self.pending_captures = []                    # End block sequences of requested captures waiting for their samples
+        self.restart_command = None                   # Command waiting for the analysis to be restarted with new settings
+        self.settings = detection_settings()          # Detection settings of this analyser, changed through the control socket
+        self.analysis_workers = []
+        self.block_queue = mpQueue(maxsize=num_analysis_workers*BLOCKS_PER_WORKER)
+        self.psd_queue = mpQueue()
+        self.save_scheduler = save_scheduler
+        self.setup_barrier = setup_barrier
+        self.device = device
 
         self.sdr_freq = 0
         self.sdr_freq_mhz = 0
         self.sample_time = 0
+        self.stream_start_time = None
         self.samples_per_second = 0
-        self.centre_freq = centre_freq
+        self.centre_freq = centre_freqs[0]
+        self.sample_ring = device.sample_ring
         self.save_raw_samples = save_raw_samples
         self.do_save_audio = save_audio
-        self.decimate_before_saving = decimate_before_saving
 
-        self.rmb_logger = RMBLogger()
-        self.csv_logger = MonthlyCsvLogger()
+        # Trigger state and logs of each target frequency
+        self.targets = [TargetTrigger(index, freq, len(centre_freqs), device.tag) for index, freq in enumerate(centre_freqs)]
 
         self.captures_dir = DATA_DIR
 
 
     def run(self):
-        global sdr
+        sdr = self.device.sdr
 
-        psd_queue = mpQueue(maxsize=4)
+        # The analyser thread runs on the analysis CPUs, and the analysis workers and capture writers it starts inherit them
+        cpu_layout.apply('analysis')
 
-        # Get the first set of samples
-        samples = sample_queue.get()
+        # Get the first set of samples. These set up the analysis and are not analysed, so they are counted as skipped
+        first_sequence = self.device.sample_queue.get()
+        samples = self.sample_ring.block(first_sequence)
+        self.skipped_blocks += 1
 
         # Initialise SDR frequency centre variables
         self.sdr_freq = sdr.center_freq
         self.sdr_freq_mhz = sdr.center_freq/1e6
         self.sdr_sample_rate = sdr.sample_rate
 
+        # The sample blocks in the ring have been decimated by the channelizer
+        self.decimated_sample_rate = self.sdr_sample_rate / DECIMATION
         samples_length = len(samples)
-        self.sample_time = samples_length/self.sdr_sample_rate
+        self.sample_time = samples_length/self.decimated_sample_rate
+
+        # Time of the first sample of the stream, for the times of the analysis frames from the sample count
+        self.stream_start_time = self.sample_ring.sample_time(0)
         self.samples_per_second = samples_length/self.sample_time
-        self.decimated_sample_rate = self.sdr_sample_rate / DECIMATION
 
-        print("Samples length:", samples_length, "Sample rate:", self.sdr_sample_rate)
+        print("SDR device:", self.device.name)
+        print("Samples length:", samples_length, "Sample rate:", self.sdr_sample_rate, "Decimated sample rate:", self.decimated_sample_rate)
         print("Time for each sample", self.sample_time)
         print("SDR tuning frequency:", sdr.center_freq)
         print("SDR gain:", sdr.gain)
         print("Samples type:", samples.dtype)
         print("No FFT's:", int(NUM_FFT))
         print("No overlaps:", int(ANALYSIS_OVERLAP*NUM_FFT))
+        print("FFT workers:", get_fft_workers())
+        print("CPU layout:", cpu_layout.describe())
+
+        # Create the trigger engine for the frequency bands of all the targets, and do a first PSD
+        self.create_analysis()
+
+        # Cache of the spectra of the compression band of each target for each analysed block, for the capture statistics
+        p0, p1 = self.spectral_plan.full_frames(samples_length + HISTORY_LENGTH)
+        self.spectra_cache = SpectraCache(self.sample_ring.num_blocks, self.trigger_engine.cache_bins, p1 - p0)
+        Pxx = self.trigger_engine.spectrogram(samples)
+        f = self.trigger_engine.f
 
-        # Do a first PSD to get frequency bands
-        # decimated_samples = scipy_signal.decimate(samples, DECIMATION)
-        # Pxx, f, bins = specgram(decimated_samples, NFFT=int(NUM_FFT/DECIMATION), Fs=self.decimated_sample_rate/1e6, noverlap=int(OVERLAP*(NUM_FFT/DECIMATION)))
-        # Pxx, f, bins = specgram(samples, NFFT=int(NUM_FFT), Fs=self.sdr_sample_rate/1e6, noverlap=int(ANALYSIS_OVERLAP*NUM_FFT))
-        window = hamming(NUM_FFT, sym=True)  # symmetric Gaussian window
-        sft = ShortTimeFFT(window, hop=HOP, fs=self.sdr_sample_rate, mfft=NUM_FFT, fft_mode='centered')
-        Pxx = sft.spectrogram(samples)
-        # bins = np.arange(0, Px.shape[1])
-        f = sft.f
-        f = f/1e6 + self.sdr_freq_mhz
- 
-        self.noise_calculation_band = np.where((f*1e6 > (self.centre_freq + noise_calculation_band[0])) & (f*1e6 <= (self.centre_freq + noise_calculation_band[1])))
-        self.detection_band = np.where((f*1e6 > (self.centre_freq + detection_frequency_band[0])) & (f*1e6 <= (self.centre_freq + detection_frequency_band[1])))
         print("Sampling frequency band", f[0], f[-1])
-        print("Noise calculation frequency band", f[self.noise_calculation_band])
-        print("Detection frequency band", f[self.detection_band])
+        for engine_target in self.trigger_engine.targets :
+            print("Target frequency:", engine_target.centre_freq)
+            print("Noise calculation frequency band", f[engine_target.noise_calculation_band])
+            print("Detection frequency band", f[engine_target.detection_band])
         print("Spectrogram shape for detection", Pxx.shape)
+        print("Trigger engine:", self.trigger_engine_name)
+        if self.use_noise_floor :
+            print("Noise floor time constant:", self.noise_time_constant, "Adapt rate:", self.targets[0].noise_floor.adapt_rate)
+        else:
+            print("Noise floor from block medians")
 
+        # Start the analysis workers and the capture writers now that the frequency bands are known
+        self.start_analysis_workers()
+        print("Analysis workers:", self.num_analysis_workers)
 
-        # Get samples from the queue as they arrive, analyse them and check for a detection trigger
-        while True :
-            # print("Queue lengths", sample_queue.qsize(), psd_queue.qsize())
-            samples = sample_queue.get()
+        # The last analyser to be set up starts the shared capture writers
+        self.setup_barrier.wait()
+        print("Capture writers:", self.save_scheduler.num_writers, "Save queue length:", self.save_scheduler.queue_length, "Overflow policy:", self.save_scheduler.overflow_policy)
 
-            # Do the PSD analysis in a thread. If the queue is full then we must skip to the next set of samples
-            if not psd_queue.full() :
-                # self.analyse_psd(samples, fcentre, psd_queue)
-                self.analysis_thread = Process(target = self.analyse_psd, args = (np.copy(samples), psd_queue))
-                self.analysis_thread.start()
-
-            # Get the PSD results as they become available
-            while not psd_queue.empty() :
-                psd_results = psd_queue.get()
-                self.check_trigger(psd_results)
+        block_sequence = 0
+        next_result_sequence = 0
+        pending_results = {}
 
+        # Get samples from the queue as they arrive, analyse them and check for a detection trigger
+        while True :
+            # print("Queue lengths", self.device.sample_queue.qsize(), self.block_queue.qsize())
+            # If no samples arrive the results and saves are still checked, so the last results of a replay are not left waiting.
+            # While the analysis is waiting to restart with new settings no samples are taken, so the workers finish the blocks they have
+            if self.restart_command is None :
+                profile_start = profiler.start()
+                try:
+                    ring_sequence = self.device.sample_queue.get(timeout=RESULT_WAIT)
+                except Empty:
+                    ring_sequence = None
+                profiler.record('queue_wait', profile_start)
+            else:
+                ring_sequence = None
+                time.sleep(RESTART_WAIT)
+
+            # Pass the sample block to the analysis workers. If the workers are busy then we must skip to the next set of samples,
+            # unless the samples are being replayed without loss
+            if ring_sequence is None :
+                pass
+            elif self.device.lossless or not self.block_queue.full() :
+                self.block_queue.put((block_sequence, ring_sequence))
+                block_sequence += 1
+            else:
+                self.skipped_blocks += 1
+
+            # Pass any pending captures to the writers as they become free
+            self.save_scheduler.poll()
+
+            # Get the PSD results as they become available, and check them in the order the samples were received
+            while not self.psd_queue.empty() :
+                result_sequence, result_ring_sequence, psd_results, cpu_time = self.psd_queue.get()
+                pending_results[result_sequence] = (result_ring_sequence, psd_results)
+                self.analysis_cpu_time += cpu_time
+
+            while next_result_sequence in pending_results :
+                self.result_ring_sequence, psd_results = pending_results.pop(next_result_sequence)
+                next_result_sequence += 1
+                if psd_results is None :
+                    self.skipped_blocks += 1
+                    syslog.syslog(syslog.LOG_DEBUG, "SDR device: " + self.device.name + " Sample block overwritten while it was analysed, skipped")
+                    continue
+
+                profile_start = profiler.start()
+                if self.use_noise_floor :
+                    self.check_noise_floor_trigger(psd_results)
+                else :
+                    for target, target_results in zip(self.targets, psd_results) :
+                        self.check_trigger(target_results, target)
+                profiler.record('check_trigger', profile_start)
+
+                self.analysed_blocks += 1
+                if self.analysed_blocks % REPORT_INTERVAL == 0 : self.report_analysis()
+
+            # Run the commands from the control socket and signals between the blocks, and save any requested captures that now have
+            # their samples. The analysis restarts with new settings once the workers have analysed all the blocks given to them
+            self.run_commands()
+            self.save_pending_captures()
+            if self.restart_command is not None and next_result_sequence == block_sequence : self.restart_analysis()
+
+
+    # Create the trigger engine for the frequency bands of all the targets, and a noise floor model for each target unless
+    # the noise is calculated from the medians of each block.
+    # The engine's spectral plan is shared with the save processes, so the STFT and bands are only set up once
+    def create_analysis(self) :
+        self.trigger_engine = create_trigger_engine(self.trigger_engine_name, self.decimated_sample_rate, self.sdr_freq, [target.centre_freq for target in self.targets],
+                                                    self.settings['detection_band'], self.settings['noise_band'], NUM_FFT, HOP, self.settings['snr_threshold'],
+                                                    [-COMPRESSION_FREQUENCY_BAND, COMPRESSION_FREQUENCY_BAND])
+        self.spectral_plan = self.trigger_engine.plan
+        self.noise_calculation_band = self.trigger_engine.noise_calculation_band
+        self.detection_band = self.trigger_engine.detection_band
+
+        if self.noise_time_constant > 0 and self.trigger_engine.uses_noise_floor :
+            self.use_noise_floor = True
+            num_bins = self.trigger_engine.trigger_rows.stop - self.trigger_engine.trigger_rows.start
+            for target, engine_target in zip(self.targets, self.trigger_engine.targets) :
+                target.noise_floor = NoiseFloorModel(num_bins, engine_target.noise_rows, engine_target.detection_rows, engine_target.detection_freqs,
+                                                     self.sample_time, self.settings['snr_threshold'], self.noise_time_constant)
+
+
+    # Run the commands waiting from the control socket and signals
+    def run_commands(self) :
+        while not self.commands.empty() :
+            command = self.commands.get_nowait()
+            if command.name == 'capture' : command.finish(self.request_capture(command.arguments.get('time')))
+            elif command.name == 'settings' : self.change_settings(command)
+
+
+    # Save a capture on request, of the most recent samples or of the samples around a time. The capture around a time has the
+    # same samples before and after it as a triggered capture, and waits for them to be analysed if they have not all arrived
+    def request_capture(self, capture_time=None) :
+        if capture_time is None :
+            self.save_samples()
+            return {'status': 'ok', 'capture': 'saved'}
+
+        sample_count = (capture_time.timestamp() - self.sample_ring.anchor_time[0]) * self.sample_ring.sample_rate
+        end_sequence = int(sample_count // self.sample_ring.block_length) + SAMPLES_LENGTH - SAMPLES_BEFORE_TRIGGER
+        if end_sequence <= 0 or not self.sample_ring.is_available(max(0, min(end_sequence, self.sample_ring.next_sequence) - SAMPLES_LENGTH)) :
+            return {'status': 'error', 'message': 'The samples for ' + str(capture_time) + ' are no longer held'}
+        if capture_time - self.sample_ring.sample_time(self.sample_ring.sample_count) > datetime.timedelta(seconds=MAX_CAPTURE_AHEAD) :
+            return {'status': 'error', 'message': 'The capture time ' + str(capture_time) + ' is more than ' + str(MAX_CAPTURE_AHEAD) + ' s ahead'}
+
+        syslog.syslog(syslog.LOG_DEBUG, "Capture requested for " + str(capture_time))
+        self.pending_captures.append(end_sequence)
+        self.save_pending_captures()
+        return {'status': 'ok', 'capture': 'saved' if end_sequence not in self.pending_captures else 'waiting for samples'}
+
+
+    # Save the requested captures whose samples have all been analysed
+    def save_pending_captures(self) :
+        if self.result_ring_sequence is None : return
+        for end_sequence in [end_sequence for end_sequence in self.pending_captures if end_sequence <= self.result_ring_sequence + 1] :
+            self.pending_captures.remove(end_sequence)
+            self.save_samples(end_sequence=end_sequence)
+
+
+    # Change the detection settings. A new SNR threshold is used at once, unless the trigger engine needs it, and new bands
+    # need a new trigger engine, so the analysis is restarted. The new settings are compared with those of this analyser, as
+    # the analysers of the devices run the command independently
+    def change_settings(self, command) :
+        settings = command.arguments
+        restart = settings['detection_band'] != self.settings['detection_band'] or settings['noise_band'] != self.settings['noise_band'] or self.trigger_engine_name == 'cfar'
+        self.settings = settings
+        message = "Detection settings changed: " + str(settings)
+        print(datetime.datetime.now(), message)
+        syslog.syslog(syslog.LOG_DEBUG, message)
+
+        if restart :
+            self.restart_command = command
+            return
+        for target in self.targets :
+            if target.noise_floor is not None : target.noise_floor.snr_threshold = settings['snr_threshold']
+        command.finish({'status': 'ok', 'settings': settings})
+
+
+    # Restart the analysis workers with a trigger engine and noise floor models for new settings
+    def restart_analysis(self) :
+        self.stop_analysis_workers()
+        self.create_analysis()
+        self.start_analysis_workers()
+        for engine_target in self.trigger_engine.targets :
+            syslog.syslog(syslog.LOG_DEBUG, "Analysis restarted. Target frequency: " + str(engine_target.centre_freq) + " Noise calculation frequency band: " +
+                          str(self.trigger_engine.f[engine_target.noise_calculation_band][[0, -1]]) + " Detection frequency band: " + str(self.trigger_engine.f[engine_target.detection_band][[0, -1]]))
+        self.restart_command.finish({'status': 'ok', 'settings': self.restart_command.arguments})
+        self.restart_command = None
+
+
+    # Start the pool of analysis worker processes
+    def start_analysis_workers(self) :
+        for worker_index in range(self.num_analysis_workers) :
+            worker = Process(target=self.analysis_worker, args=(self.block_queue, self.psd_queue), daemon=True)
+            worker.start()
+            self.analysis_workers.append(worker)
+
+
+    # Stop the analysis worker processes, terminating any that do not stop in time
+    def stop_analysis_workers(self) :
+        for worker in self.analysis_workers :
+            try: self.block_queue.put_nowait(None)
+            except: pass
+
+        for worker in self.analysis_workers :
+            worker.join(timeout=2)
+            if worker.is_alive() : worker.terminate()
+        self.analysis_workers = []
+
+
+    # Analysis worker process. Analyse each block of samples from the block queue until told to stop
+    def analysis_worker(self, block_queue, psd_queue) :
+        # Shutdown is handled by the parent process
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        signal.signal(signal.SIGUSR1, signal.SIG_IGN)
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+
+        # The worker analyses each block in its own workspace, so no arrays are allocated for the analysis
+        workspace = self.trigger_engine.create_workspace(self.sample_ring.block_length + HISTORY_LENGTH)
+        wrap_samples = np.empty(self.sample_ring.block_length + HISTORY_LENGTH, dtype=np.complex64)     # Block with history at the wrap of the ring
 
-    # Check FFT data for a detection, and save the samples if a detection is triggered
-    def check_trigger(self, psd_results) :
-        mn, sigmedian, sigmax, peak_freq, ratio_median = psd_results
-        self.median_noise = sigmedian
+        while True :
+            block = block_queue.get()
+            if block is None : break
+
+            # The CPU time of the analysis is returned with the results for the per block cost
+            block_sequence, ring_sequence = block
+            start_time = time.process_time()
+            samples, first_sample = self.sample_ring.block_with_history(ring_sequence, HISTORY_LENGTH, wrap_samples)
+            psd_results = self.analyse_psd(samples, first_sample, ring_sequence, workspace)
+
+            # The results of samples that the streamer wrote over while they were analysed are rejected.
+            # The results are pickled by the queue after put returns, so arrays in the workspace are copied first
+            first_block = first_sample // self.sample_ring.block_length
+            if not self.sample_ring.is_intact(first_block, ring_sequence - first_block + 1) : psd_results = None
+            elif self.use_noise_floor : psd_results = tuple(np.copy(result) if isinstance(result, np.ndarray) else result for result in psd_results)
+            psd_queue.put((block_sequence, ring_sequence, psd_results, time.process_time() - start_time))
+
+
+    # Check the per bin power of a block against the noise floor model of each target for a detection, then update the model.
+    # The noise floor of a target is held while a detection is in progress
+    def check_noise_floor_trigger(self, bin_results) :
+        bin_power, band_max, ratio_median = bin_results
+        for target in self.targets :
+            if target.noise_floor.blocks == 0 : target.noise_floor.update(bin_power)
+
+            self.check_trigger(target.noise_floor.trigger_statistics(band_max, ratio_median), target)
+            target.noise_floor.update(bin_power, hold=target.trigger_count > 0)
+
+
+    # Log the analysis CPU time per block, the throughput and drop counts of the device and the state of the noise floor model
+    def report_analysis(self) :
+        cost = 'Trigger engine: {0}  Blocks: {1}  CPU per block: {2:7.3f} ms'.format(self.trigger_engine_name, self.analysed_blocks, 1000*self.analysis_cpu_time/self.analysed_blocks)
+        syslog.syslog(syslog.LOG_DEBUG, cost)
+        if verbose : print(datetime.datetime.now(), cost)
+
+        # Throughput of the device in decimated samples per second since the stream started
+        counters = self.device.counters
+        elapsed = (datetime.datetime.now() - self.stream_start_time).total_seconds()
+        throughput = counters['received'] * self.sample_ring.block_length / elapsed if elapsed > 0 else 0
+        device_report = 'SDR device: {0}  Received: {1}  Dropped: {2}  Skipped: {3}  Analysed: {4}  Throughput: {5:8.0f} samples/s'.format(
+            self.device.name, counters['received'], counters['dropped'], self.skipped_blocks, self.analysed_blocks, throughput)
+        syslog.syslog(syslog.LOG_DEBUG, device_report)
+        if verbose : print(datetime.datetime.now(), device_report)
+
+        for target in self.targets :
+            if target.noise_floor is None : continue
+            state = target.noise_floor.state()
+            syslog.syslog(syslog.LOG_DEBUG, "Noise floor model:" + target.label + " " + str(state))
+            if verbose : print(datetime.datetime.now(), "Noise floor model:" + target.label, state)
+
+        syslog.syslog(syslog.LOG_DEBUG, "Capture saves: " + str(self.save_scheduler.counters))
+        if verbose : print(datetime.datetime.now(), "Capture saves:", self.save_scheduler.counters)
+
+
+    # Check FFT data of a target for a detection, and save the samples if a detection is triggered
+    def check_trigger(self, psd_results, target) :
+        mn, sigmedian, sigmax, peak_freq, ratio_median = psd_results[:5]
+        target.median_noise = sigmedian
 
         # Use the median noise for the SNR calculation
-        snr = sigmax/self.median_noise
+        snr = sigmax/target.median_noise
 
-        stats = ' Mean:{0:8.4f}  Median:{1:8.4f}  Max:{2:10.4f}  PeakF:{3:12.6f}  SNR:{4:10.2f}'.format(mn, sigmedian, sigmax, peak_freq, snr)
+        stats = ' Mean:{0:8.4f}  Median:{1:8.4f}  Max:{2:10.4f}  PeakF:{3:12.6f}  SNR:{4:10.2f}'.format(mn, sigmedian, sigmax, peak_freq, snr) + target.label
         if verbose : print(datetime.datetime.now(), stats)
 
         # If the signal level is high enough above the noise level, trigger a detection and log it
-        trigger = snr > snr_threshold
+        trigger = snr > self.settings['snr_threshold']
         if trigger :
-            print("Triggered at", datetime.datetime.now())
-            if self.trigger_count == 0 :
+            print("Triggered at", datetime.datetime.now(), target.label)
+            target.trigger_snr = max(target.trigger_snr, snr)
+            if target.trigger_count == 0 :
+                self.trigger_latencies.append(time.monotonic() - self.device.arrival_times[self.result_ring_sequence % self.sample_ring.num_blocks])
+                target.triggers += 1
                 syslog.syslog(syslog.LOG_DEBUG, "Radio detection triggered at " + str(datetime.datetime.now()) + stats)
                 syslog.syslog(syslog.LOG_DEBUG, "Median noise ratio: " + str(ratio_median))
+                if len(psd_results) > 5 and psd_results[5] is not None :
+                    extent = psd_results[5]
+                    syslog.syslog(syslog.LOG_DEBUG, "Detection extent: " + str(self.stream_time(extent['start'])) + " to " + str(self.stream_time(extent['end'])) +
+                                  " Frequency: " + str(extent['low_freq']) + " to " + str(extent['high_freq']) + " Cells: " + str(extent['cells']))
 
                 if ratio_median > MAX_MEDIAN_NOISE_RATIO :
                     syslog.syslog(syslog.LOG_DEBUG, "Detection cancelled due to high noise")
+                    target.cancelled_triggers += 1
                     trigger = False
-                    self.trigger_count = -1
+                    target.trigger_count = -1
 
-            self.trigger_count += 1
-            print("Trigger count:", self.trigger_count)
+            target.trigger_count += 1
+            print("Trigger count:", target.trigger_count)
 
         else:
             # Compute rolling average noise
-            self.noise_deque.append(mn)
+            target.noise_deque.append(mn)
             # self.ave_noise = np.average(self.noise_deque)
 
         # If we have had a detection, wait for further samples before saving the detection in a thread.
-        if self.trigger_count >= TRIGGERS_REQUIRED :
-            self.trigger_wait_counter += 1
-            # print("Trigger waiting for samples:", self.trigger_wait_counter)
-            if self.trigger_wait_counter >= SAMPLES_LENGTH-SAMPLES_BEFORE_TRIGGER :
-                # Don't save any more sample data until any previous saves have completed
-                # if self.save_process is None or not self.save_process.is_alive() :
-                self.save_samples()
-                self.trigger_count = 0
-                self.trigger_wait_counter = 0
+        if target.trigger_count >= TRIGGERS_REQUIRED :
+            target.trigger_wait_counter += 1
+            # print("Trigger waiting for samples:", target.trigger_wait_counter)
+            if target.trigger_wait_counter >= SAMPLES_LENGTH-SAMPLES_BEFORE_TRIGGER :
+                # The capture is queued for the writers, and may be dropped by the save scheduler if too many are waiting
+                self.save_samples(target.trigger_snr, self.result_ring_sequence + 1, target.index)
+                target.trigger_count = 0
+                target.trigger_wait_counter = 0
+                target.trigger_snr = 0
 
         # Otherwise reset the trigger count
         else :
-            if not trigger: self.trigger_count = 0
-
-
-    # Convert sample data to FFT, restrict to narrow freq band and save
-    def save_samples(self) :
-        timed_sample_snapshot = timed_sample_deque.copy()
-        all_samples = []
-
-        # Subtract sample time to give actual obs_time of start of 1st sample
-        obs_time = timed_sample_snapshot[0].sample_time - datetime.timedelta(seconds=self.sample_time)
-        for timed_sample in timed_sample_snapshot :
-            all_samples.append(timed_sample.sample)
-
-        samples_forspecgram = np.asarray(all_samples).flatten()
+            if not trigger:
+                target.trigger_count = 0
+                target.trigger_snr = 0
+
+
+    # Queue the sample data up to a block sequence number to be saved for a target, by default the most recent sample data of the first target.
+    # Captures saved on request have no trigger SNR, so are kept in preference to others
+    def save_samples(self, snr=float('inf'), end_sequence=None, target_index=0) :
+        # The capture is the blocks in the sample ring up to the end sequence. The save processes read the samples from the ring
+        if end_sequence is None : end_sequence = self.sample_ring.next_sequence
+        first_sequence = max(0, end_sequence - SAMPLES_LENGTH)
+        num_blocks = end_sequence - first_sequence
+        capture = (first_sequence, num_blocks)
+        if num_blocks == 0 : return
+
+        # Time of the first sample of the capture, from the sample count. A capture may overlap the previous capture of the target,
+        # whose meteors have already been logged
+        obs_time = self.sample_ring.sample_time(first_sequence * self.sample_ring.block_length)
+        target = self.targets[target_index]
+        logged_capture = target.last_capture
+        target.last_capture = (obs_time, self.sample_ring.sample_time(end_sequence * self.sample_ring.block_length))
 
         print("Saving sample data")
 
@@ -540,115 +967,124 @@ class SampleAnalyser(threading.Thread):
             os.makedirs(self.captures_dir, exist_ok=True)
             pass
 
-        # If set for raw samples, only save the raw sample data
-        if self.save_raw_samples :
-            # Set the raw sample saving process off in one of 2 available subprocesses
-            if self.save_process1 is None or not self.save_process1.is_alive() :
-                self.save_process1 = Process(target=self.save_raw_sample_data, args=(samples_forspecgram, self.sdr_freq, self.centre_freq, self.sdr_sample_rate, obs_time))
-                self.save_process1.start()
-            elif self.save_process2 is None or not self.save_process2.is_alive() :
-                self.save_process2 = Process(target=self.save_raw_sample_data, args=(samples_forspecgram, self.sdr_freq, self.centre_freq, self.sdr_sample_rate, obs_time))
-                self.save_process2.start()
+        self.save_scheduler.submit((self.device.index, self.settings, capture, obs_time, self.captures_dir, target_index, logged_capture), snr)
 
 
-        # Otherwise, save FFT spectrogram
+    # Save a capture of a target - run in a capture writer process. Returns 'written', or 'overwritten' if the samples are no longer in the ring
+    # or were written over while they were saved. The capture files are named with the frequency of the target
+    def write_capture(self, capture, obs_time, captures_dir, target_index=0, logged_capture=None) :
+        if not self.sample_ring.is_available(capture[0]) :
+            return 'overwritten'
+        self.captures_dir = captures_dir
+        target = self.targets[target_index]
+
+        # If set for raw samples, only save the raw sample data, otherwise save FFT spectrogram
+        if self.save_raw_samples :
+            intact = self.save_raw_sample_data(capture, self.sdr_freq, target.centre_freq, self.decimated_sample_rate, obs_time, target, logged_capture)
         else:
-            # Set the FFT saving process off in one of 2 available subprocesses
-            if self.save_process1 is None or not self.save_process1.is_alive() :
-                self.save_process1 = Process(target=self.save_fft, args=(samples_forspecgram, self.sdr_freq, self.centre_freq, self.sdr_sample_rate, obs_time))
-                self.save_process1.start()
-            elif self.save_process2 is None or not self.save_process2.is_alive() :
-                self.save_process2 = Process(target=self.save_fft, args=(samples_forspecgram, self.sdr_freq, self.centre_freq, self.sdr_sample_rate, obs_time))
-                self.save_process2.start()
+            intact = self.save_fft(capture, self.sdr_freq, target.centre_freq, self.decimated_sample_rate, obs_time, target, logged_capture)
+        if not intact : return 'overwritten'
 
         if self.do_save_audio :
             print("Saving audio")
-            self.audio_process = Process(target=self.save_audio, args=(samples_forspecgram, self.sdr_freq, self.centre_freq, self.sdr_sample_rate, obs_time))
-            self.audio_process.start()
+            self.save_audio(capture, self.sdr_freq, target.centre_freq, self.decimated_sample_rate, obs_time)
+        return 'written'
 
 
-    # Function to save the raw sample data as an SMP file
-    def save_raw_sample_data(self, raw_samples, sda_centre_freq, centre_freq, sample_rate, obs_time) :
+    # Log the detection statistics of a capture of a target without saving it
+    def log_capture_only(self, capture, obs_time, captures_dir, target_index=0, logged_capture=None) :
+        target = self.targets[target_index]
+        Pxx, f, bins = self.capture_spectrogram(capture, target.centre_freq, target_index=target_index)
+        self.log_capture_stats(Pxx, f, bins, obs_time, target, logged_capture)
+
+
+    # Spectrogram of a capture, restricted to a band around the required centre frequency, the frequency of a target.
+    # The spectra are taken from the spectra cache if all the blocks were analysed, otherwise the STFT of the samples is calculated
+    def capture_spectrogram(self, capture, centre_freq, samples=None, target_index=0) :
+        freq_slice = self.spectral_plan.band(centre_freq-COMPRESSION_FREQUENCY_BAND, centre_freq+COMPRESSION_FREQUENCY_BAND, include_low=True)
+
+        Pxx = self.spectra_cache.capture(*capture, self.trigger_engine.targets[target_index].cache_spectra_rows)
+        if Pxx is None :
+            if samples is None : samples = self.get_capture_samples(capture)
+            Pxx = self.spectral_plan.spectrogram(samples)[freq_slice]
 
-        # Decimate to reduce sample rate from 300 kHz to 37.5 kHz
-        decimated_samples = scipy_signal.decimate(raw_samples, DECIMATION)
+        return Pxx, self.spectral_plan.f[freq_slice], self.spectral_plan.bins(Pxx.shape[1])
 
-        # Save the decimated raw samples
-        sample_filename = self.captures_dir + '/SMP_' + str(int(centre_freq)) + obs_time.strftime('_%Y%m%d_%H%M%S_%f.npz')
+
+    # Get the samples for a capture from the sample ring
+    def get_capture_samples(self, capture) :
+        first_sequence, num_blocks = capture
+        return self.sample_ring.capture(first_sequence, num_blocks)
+
+
+    # Check that none of the blocks of a capture were written over in the sample ring while they were being saved. Returns True if none were
+    def check_capture_samples(self, capture) :
+        first_sequence, num_blocks = capture
+        if self.sample_ring.is_intact(first_sequence, num_blocks) : return True
+        syslog.syslog(syslog.LOG_DEBUG, "Sample data overwritten while saving capture")
+        return False
+
+
+    # Function to save the raw sample data as an SMP file
+    def save_raw_sample_data(self, capture, sda_centre_freq, centre_freq, sample_rate, obs_time, target, logged_capture=None) :
+        # The samples in the ring have already been decimated to 37.5 kHz by the channelizer
+        first_sequence, num_blocks = capture
+
+        # Save the decimated raw samples, directly from the views of the sample ring
+        sample_filename = self.captures_dir + '/SMP' + self.device.tag + '_' + str(int(centre_freq)) + obs_time.strftime('_%Y%m%d_%H%M%S_%f.npz')
         syslog.syslog(syslog.LOG_DEBUG, "Saving " + sample_filename)
         print("Saving", sample_filename)
-        np.savez(sample_filename, obs_time=str(obs_time), centre_freq=centre_freq, sample_rate=self.decimated_sample_rate, samples=np.array(decimated_samples).astype("complex64"))
+        profile_start = profiler.start()
+        save_smp(sample_filename, self.sample_ring.capture_views(first_sequence, num_blocks), obs_time, centre_freq, sample_rate, smp_format, smp_compress)
+        profiler.record('savez', profile_start)
         print("\a")
 
         # Log the data
-        window = hamming(NUM_FFT, sym=True)  # symmetric Gaussian window
-        sft = ShortTimeFFT(window, hop=HOP, fs=self.sdr_sample_rate, mfft=NUM_FFT, fft_mode='centered')
-        Pxx = sft.spectrogram(raw_samples)
-
-        T_x, N = HOP / sample_rate, Pxx.shape[1]
-        bins = np.arange(N) * T_x
+        Pxx, f, bins = self.capture_spectrogram(capture, centre_freq, target_index=target.index)
 
-        f = sft.f
-        f = f/1e6 + self.sdr_freq_mhz
-
-        # Restrict the band for saving to a band around the required centre frequency
-        freq_slice = np.where((f >= (centre_freq-COMPRESSION_FREQUENCY_BAND)/1e6) & (f <= (centre_freq+COMPRESSION_FREQUENCY_BAND)/1e6))
-        f = f[freq_slice]
-        Pxx = Pxx[freq_slice,:][0]
+        # A file of samples that were written over while it was saved is removed
+        if not self.check_capture_samples(capture) :
+            os.remove(sample_filename)
+            return False
 
         # Log the capture stats
-        self.log_capture_stats(Pxx, f, bins, obs_time)
-
+        self.log_capture_stats(Pxx, f, bins, obs_time, target, logged_capture)
+        return True
 
 
-    # Function to save the sample data as a spectrogram file - run in a multiprocess
-    def save_fft(self, samples_forspecgram, sda_centre_freq, centre_freq, sample_rate, obs_time) :
 
-        # Create the specgram
-        if self.decimate_before_saving :
-            decimated_samples = scipy_signal.decimate(samples_forspecgram, DECIMATION)
-            # Pxx, f, bins = specgram(decimated_samples, NFFT=int(NUM_FFT/DECIMATION), Fs=self.decimated_sample_rate/1e6, noverlap=int(OVERLAP*(NUM_FFT/DECIMATION)))
-            window = hamming(int(NUM_FFT/DECIMATION), sym=True)  # symmetric Gaussian window
-            sft = ShortTimeFFT(window, hop=HOP, fs=self.sdr_sample_rate, mfft=int(NUM_FFT/DECIMATION), fft_mode='centered')
-            Pxx = sft.spectrogram(decimated_samples)
-            f = sft.f
-
-        else:
-            window = hamming(NUM_FFT, sym=True)  # symmetric Gaussian window
-            sft = ShortTimeFFT(window, hop=HOP, fs=self.sdr_sample_rate, mfft=NUM_FFT, fft_mode='centered')
-            Pxx = sft.spectrogram(samples_forspecgram)
-            f = sft.f
+    # Function to save the sample data as a spectrogram file - run in a capture writer process
+    def save_fft(self, capture, sda_centre_freq, centre_freq, sample_rate, obs_time, target, logged_capture=None) :
+        samples_forspecgram = self.get_capture_samples(capture)
 
-        f = f/1e6 + self.sdr_freq_mhz
-        
-        T_x, N = HOP / sample_rate, Pxx.shape[1]
-        bins = np.arange(N) * T_x
+        # Create the specgram from the decimated samples, restricted to a band around the required centre frequency
+        Pxx, f, bins = self.capture_spectrogram(capture, centre_freq, samples_forspecgram, target.index)
 
-        # Restrict the band for saving to a band around the required centre frequency
-        freq_slice = np.where((f >= (centre_freq-COMPRESSION_FREQUENCY_BAND)/1e6) & (f <= (centre_freq+COMPRESSION_FREQUENCY_BAND)/1e6))
-        f = f[freq_slice]
-        Pxx = Pxx[freq_slice,:][0]
+        # A spectrogram of samples that were written over is not saved
+        if not self.check_capture_samples(capture) : return False
 
         # Log the capture stats
-        self.log_capture_stats(Pxx, f, bins, obs_time)
+        self.log_capture_stats(Pxx, f, bins, obs_time, target, logged_capture)
         # Correct time=0 at trigger time
         # time_before_trigger = (SAMPLES_BEFORE_TRIGGER/SAMPLES_LENGTH) * (bins[-1] - bins[0])
         # bins -= time_before_trigger
 
         # Save the data
-        specgram_filename = self.captures_dir + '/SPG_' + str(int(centre_freq)) + obs_time.strftime('_%Y%m%d_%H%M%S_%f.npz')
+        specgram_filename = self.captures_dir + '/SPG' + self.device.tag + '_' + str(int(centre_freq)) + obs_time.strftime('_%Y%m%d_%H%M%S_%f.npz')
         syslog.syslog(syslog.LOG_DEBUG, "Saving " + specgram_filename)
         print("Saving", specgram_filename)
-        np.savez(specgram_filename, Pxx=Pxx, f=f, bins=bins)
+        profile_start = profiler.start()
+        save_spg(specgram_filename, Pxx, f, bins, spg_format)
+        profiler.record('savez', profile_start)
         print("\a")
+        return True
 
 
-    # Function to save the sample data as a wav audio file - run in a multiprocess
-    def save_audio(self, samples_foraudio, sda_centre_freq, centre_freq, sample_rate, obs_time) :
-
-        # Decimate to reduce sample rate from 300 kHz to 37.5 kHz
-        x1 = scipy_signal.decimate(samples_foraudio, DECIMATION)
-        sample_rate = int(sample_rate / DECIMATION)
+    # Function to save the sample data as a wav audio file - run in a capture writer process
+    def save_audio(self, capture, sda_centre_freq, centre_freq, sample_rate, obs_time) :
+        # The samples in the ring have already been decimated to 37.5 kHz by the channelizer
+        first_sequence, num_blocks = capture
+        views = self.sample_ring.capture_views(first_sequence, num_blocks)
 
         # Create a bandpass filter for the audio signal
         #sos = scipy_signal.butter(10, AUDIO_FREQUENCY_BANDPASS, 'bandpass', fs=sample_rate, output='sos')
@@ -656,13 +1092,17 @@ class SampleAnalyser(threading.Thread):
 
         # Save to file as 16-bit signed single-channel audio samples
         # Note that we can throw away the imaginary part of the IQ sample data for USB
-        wav_filename = self.captures_dir + '/AUD_' + str(int(centre_freq)) + obs_time.strftime('_%Y%m%d_%H%M%S_%f.wav')
+        wav_filename = self.captures_dir + '/AUD' + self.device.tag + '_' + str(int(centre_freq)) + obs_time.strftime('_%Y%m%d_%H%M%S_%f.wav')
         syslog.syslog(syslog.LOG_DEBUG, "Saving " + wav_filename)
         print("Saving", wav_filename)
 
-        # Convert to 16-bit PCM format (WAV format requirement)
-        audio_real = np.real(x1).astype(np.float32)
-        audio_data = (audio_real * 32767).astype(np.int16)
+        # Convert to 16-bit PCM format (WAV format requirement), directly from the views of the sample ring
+        audio_data = np.empty(sum(len(view) for view in views), dtype=np.int16)
+        position = 0
+        for view in views :
+            audio_data[position:position + len(view)] = view.real * 32767
+            position += len(view)
+        self.check_capture_samples(capture)
 
         # Save as WAV file
         wav.write(wav_filename, int(sample_rate), audio_data)
@@ -670,81 +1110,73 @@ class SampleAnalyser(threading.Thread):
         print("WAV audio file saved successfully: ", wav_filename)
 
 
-    # Log the detection statistics
-    def log_capture_stats(self, Pxx, f, bins, obs_time) :
+    # Log the detection statistics of a target to its logs. The meteors that start within the previous capture of the target, given
+    # by its start and end times, were logged with that capture
+    def log_capture_stats(self, Pxx, f, bins, obs_time, target, logged_capture=None) :
+        profile_start = profiler.start()
+        centre_freq = target.centre_freq
 
         # Calculate the detection statistics from the PSD data
-        capture_statistics = CaptureStatistics(Pxx, f, bins, obs_time, snr_threshold, self.centre_freq)
+        capture_statistics = CaptureStatistics(Pxx, f, bins, obs_time, snr_threshold, centre_freq)
         capture_statistics.calculate()
 
         # Log to syslog
         stats_string = 'Mean:{0:10.4f}  Max:{1:10.4f}  Duration:{2:7.2f}  Frequency:{3:12.6f}  MaxSNR:{4:7.2f} dB'.format(capture_statistics.log_mn, capture_statistics.log_sigmax, capture_statistics.detection_duration, capture_statistics.detection_freq, capture_statistics.snr)
-        syslog.syslog(syslog.LOG_DEBUG, "Radio detection stats log " + capture_statistics.detection_time.strftime("%d/%m/%Y %H:%M:%S.%f")[:-3] + " " + stats_string)
+        syslog.syslog(syslog.LOG_DEBUG, "Radio detection stats log " + capture_statistics.detection_time.strftime("%d/%m/%Y %H:%M:%S.%f")[:-3] + " " + stats_string + target.label)
 
         # Log to RMB .csv file
-        self.rmb_logger.log_data(capture_statistics.detection_time, capture_statistics.snr, capture_statistics.detection_duration, (capture_statistics.detection_freq*1e6) - centre_freq)
+        target.rmb_logger.log_data(capture_statistics.detection_time, capture_statistics.snr, capture_statistics.detection_duration, (capture_statistics.detection_freq*1e6) - centre_freq)
 
         # Produce the log for the monthly csv reports
-        self.csv_logger.log_data(capture_statistics.detection_time, self.centre_freq, capture_statistics.detection_freq*1e6, capture_statistics.log_sigmax, capture_statistics.log_mn, capture_statistics.detection_duration, capture_statistics.snr)
-        # capture_statistics.get_detections()
+        target.csv_logger.log_data(capture_statistics.detection_time, centre_freq, capture_statistics.detection_freq*1e6, capture_statistics.log_sigmax, capture_statistics.log_mn, capture_statistics.detection_duration, capture_statistics.snr)
 
+        # Log each meteor in the capture. The detection logged above is the meteor that overlaps it in time nearest to it in frequency,
+        # so only the other meteors, and not those logged with the previous capture, are added to the RMB and csv logs
+        meteor_detections = capture_statistics.get_detections(centre_freq)
+        primary_detection = capture_statistics.primary_detection()
+        for index, detection in enumerate(meteor_detections) :
+            detection_string = 'Duration:{0:7.2f}  Frequency:{1:12.6f}  MaxSNR:{2:7.2f} dB'.format(detection.duration, detection.initial_frequency, detection.max_snr)
+            syslog.syslog(syslog.LOG_DEBUG, "Meteor detection {0}/{1} ".format(index + 1, len(meteor_detections)) + detection.start_time.strftime("%d/%m/%Y %H:%M:%S.%f")[:-3] + " " + detection_string + target.label)
+            if detection is primary_detection : continue
+            if logged_capture is not None and logged_capture[0] <= detection.start_time <= logged_capture[1] : continue
+            target.rmb_logger.log_data(detection.start_time, detection.max_snr, detection.duration, (detection.initial_frequency*1e6) - centre_freq)
+            target.csv_logger.log_data(detection.start_time, centre_freq, detection.initial_frequency*1e6, detection.max_snr + capture_statistics.log_mn, capture_statistics.log_mn, detection.duration, detection.max_snr)
 
-    # Perform a PSD analysis on the raw samples data
-    def analyse_psd(self, samples, psd_queue) :
-        # Do the PSD
-        # NOTE: Decimation before taking the specgram is slower than doing the specgram on the raw sample data
-        # decimated_samples = scipy_signal.decimate(samples, DECIMATION)
-        # Pxx, f, bins = specgram(decimated_samples, NFFT=int(NUM_FFT/DECIMATION), Fs=self.decimated_sample_rate/1e6, noverlap=int(OVERLAP*(NUM_FFT/DECIMATION)))
-        # Pxx, f, bins = specgram(samples, NFFT=int(NUM_FFT), Fs=self.sdr_sample_rate/1e6, noverlap=int(ANALYSIS_OVERLAP*NUM_FFT))
-        window = hamming(NUM_FFT, sym=True)  # symmetric Gaussian window
-        sft = ShortTimeFFT(window, hop=HOP, fs=self.sdr_sample_rate, mfft=NUM_FFT, fft_mode='centered')
-        Pxx = sft.spectrogram(samples)
-        # bins = np.arange(0, Px.shape[1])
-        # f = np.arange(0, Pxx.shape[0], dtype=float)
-        f = sft.f
-        f = f/1e6 + self.sdr_freq_mhz
-
-        # Add this to add processed specgram to waterfall queue for waterfall display
-        # try:
-        #     waterfall_queue.put_nowait((Pxx, f))
-        # except: pass
-
-        f = f[self.detection_band]
+        profiler.record('log_capture_stats', profile_start)
 
-        # Calculate the mean and median (noise) level over the larger noise calculation band
-        nx = np.float16(Pxx[self.noise_calculation_band])
-        mn = np.mean(nx)
-        sigmedian = np.median(nx)
 
-        # Calculate the signal level stats over the detection band
-        x = np.float16(Pxx[self.detection_band])
-        sigmax = np.max(x)
-        maxpos = np.argmax(np.max(x, axis=1))
-        peak_freq = f[maxpos]
-        
-        # Get the median power level for each time step
-        time_medians = np.median(Pxx, axis=0)
-        median_median = np.median(time_medians)
-        max_median = np.max(time_medians)
-        ratio_median = max_median/median_median
-        if ratio_median > MAX_MEDIAN_NOISE_RATIO :
-            syslog.syslog(syslog.LOG_DEBUG, "Noise ratio max/median: " + str(ratio_median))
-        #np.any(time_medians > threshold)
+    # Time of a point in the sample stream, from its time in seconds since the first sample
+    def stream_time(self, seconds) :
+        return self.stream_start_time + datetime.timedelta(seconds=seconds)
 
-        # self.find3f(x)
 
-        # Added 20/7/2025. Median noise calculation change to try to improve filtering of false detections
-        # Get the time column of the max signal
-        max_index_flat = np.argmax(nx)
-        row_idx, col_idx = np.unravel_index(max_index_flat, nx.shape)
-        # print("Location of max signal (shape,row,col) is", nx.shape, row_idx, col_idx)
+    # Perform a PSD analysis on the raw samples data
+    def analyse_psd(self, samples, first_sample=0, ring_sequence=None, workspace=None) :
+        if workspace is None : workspace = self.trigger_engine.create_workspace(len(samples))
+
+        # Do the PSD on the samples decimated by the channelizer, once for all the targets, and keep the spectra of the compression
+        # band of each target for the capture statistics
+        profile_start = profiler.start()
+        Pxx, time_medians = self.trigger_engine.band_power(samples, workspace)
+        if ring_sequence is not None : self.spectra_cache.put(ring_sequence, self.trigger_engine.cache_spectra(Pxx))
+        profiler.record('stft', profile_start)
+
+        # Calculate the statistics for the trigger. With the noise floor model only the power of each bin is needed, which
+        # serves all the targets, and the statistics of each target are calculated in check_noise_floor_trigger.
+        # Otherwise the statistics of each target are calculated from its bands of the same band power
+        profile_start = profiler.start()
+        if self.use_noise_floor :
+            psd_results = self.trigger_engine.bin_statistics(Pxx, time_medians, workspace)
+            ratio_median = psd_results[2]
+        else :
+            psd_results = self.trigger_engine.target_statistics(Pxx, time_medians, len(samples), first_sample, workspace)
+            ratio_median = psd_results[0][4]
+        profiler.record('statistics', profile_start)
 
-        # Use the single time column of the max signal to calculate the median noise value over the noise calculation frequency band
-        column = nx[:, col_idx]
-        sigmedian = np.median(column)
-        # sigmax = np.max(column)
+        if ratio_median > MAX_MEDIAN_NOISE_RATIO :
+            syslog.syslog(syslog.LOG_DEBUG, "Noise ratio max/median: " + str(ratio_median))
 
-        psd_queue.put((mn, sigmedian, sigmax, peak_freq, ratio_median))
+        return psd_results
 
 
     # Find 3 frequencies with most signal
@@ -778,10 +1210,8 @@ class SampleAnalyser(threading.Thread):
                             print("Overlap:", self.fmax3_deque[-2], self.fmax3_deque[-1])
 
 
-# Main sample streaming loop run async
-async def streaming():
-
-    # configure device
+# Configure an SDR for the acquisition
+def configure_sdr(sdr) :
     # sdr = RtlSdr()
     sdr.sample_rate = SAMPLE_RATE
     sdr.center_freq = centre_freq + FREQUENCY_OFFSET       # Tuning frequency for SDR
@@ -790,26 +1220,213 @@ async def streaming():
     else: sdr.gain = float(sdr_gain)
     # sdr.freq_correction = 0.0      # PPM
 
-    # Loop forever taking samples
-    async for samples in sdr.stream():
-        # Get the time stamp and store the sample data temporarily
-        time_stamp = datetime.datetime.now()
-        timed_sample_deque.append(TimedSample(samples, time_stamp))
 
-        # Add the sample data to the queue for the sample analyser
-        sample_queue.put(samples)
+# Main sample streaming loop of an SDR device run async. If the stream stalls it is restarted
+async def streaming(device):
+    # configure device
+    configure_sdr(device.sdr)
+
+    # Channelizer to decimate the sample stream once for all of the consumers
+    channelizer = Channelizer(device.sdr.sample_rate, DECIMATION)
+
+    while True :
+        stream_task = asyncio.ensure_future(stream_blocks(device, channelizer))
+        if not await watch_stream(device, stream_task) : break
+        await restart_stream(device, stream_task)
+
+        # The samples after the restart do not follow on from those before, so they are not filtered with the old history
+        channelizer.reset()
+        if device.monitor is not None : device.monitor.restarted(time.time())
+
+    # to stop streaming:
+    await device.sdr.stop()
+
+    # done
+    device.sdr.close()
 
-        # Add the sample data to the waterfall queue for the waterfall display
+
+# Wait for the stream of a device to end, checking that it has not stalled. Returns True if the stream stalled
+async def watch_stream(device, stream_task) :
+    while True :
+        done, pending = await asyncio.wait([stream_task], timeout=STALL_CHECK_INTERVAL)
+        if done :
+            stream_task.result()
+            return False
+        if device.monitor is not None and device.monitor.check_stall(time.time()) : return True
+
+
+# Restart the stalled stream of a device. The device is closed and opened again, until it opens
+async def restart_stream(device, stream_task) :
+    stream_task.cancel()
+    try:
+        await asyncio.wait_for(device.sdr.stop(), timeout=STALL_TIMEOUT)
+        device.sdr.close()
+    except Exception as e :
+        syslog.syslog(syslog.LOG_DEBUG, "Unable to stop the stalled stream: " + str(e))
+
+    while True :
+        try:
+            device.open()
+            configure_sdr(device.sdr)
+            syslog.syslog(syslog.LOG_DEBUG, "SDR device: " + device.name + " stream restarted")
+            return
+        except Exception as e :
+            syslog.syslog(syslog.LOG_DEBUG, "Unable to open SDR device " + device.name + ": " + str(e))
+            await asyncio.sleep(STALL_TIMEOUT)
+
+
+# Take the blocks of samples from the stream of a device until it ends
+async def stream_blocks(device, channelizer) :
+    usb_start = profiler.start()
+    async for samples in device.sdr.stream(SDR_BLOCK_SIZE):
+        profiler.record('usb_wait', usb_start)
+
+        # Check the samples received against the wall clock. If samples were lost the time of the block is taken from the wall clock
+        if device.monitor is not None :
+            receive_time = time.time()
+            if device.monitor.block_received(len(samples), receive_time) : device.sample_ring.set_time(datetime.datetime.fromtimestamp(receive_time))
+
+        # Decimate the samples and store the decimated sample data in the sample ring. The ring times the samples from the sample count
+        profile_start = profiler.start()
+        samples = channelizer.process(samples)
+        profiler.record('decimation', profile_start)
+        ring_sequence = device.sample_ring.put(samples, device.receive_time())
+        device.arrival_times[ring_sequence % device.sample_ring.num_blocks] = time.monotonic()
+        device.counters['received'] += 1
+
+        # A replay without loss waits for the analyser and for the capture writers, so no captures are overwritten in the ring
+        if device.lossless :
+            while device.sample_queue.full() or save_scheduler.backlog() > save_scheduler.num_writers :
+                save_scheduler.poll()
+                await asyncio.sleep(0.001)
+
+        # Add the sequence number of the sample block to the queue for the sample analyser. The devices share the
+        # event loop, so a block is dropped rather than waiting if the analyser is behind
+        try:
+            device.sample_queue.put_nowait(ring_sequence)
+        except Full:
+            device.counters['dropped'] += 1
+
+        # Add the sample data of the first device to the waterfall queue for the waterfall display
+        usb_start = profiler.start()
+        if device.index > 0 : continue
         try:
             if waterfall_queue.full() : waterfall_queue.get_nowait()
             waterfall_queue.put_nowait(samples)
         except: pass
 
-    # to stop streaming:
-    await sdr.stop()
 
-    # done
-    sdr.close()
+# Stream the samples of all the SDR devices
+async def stream_devices():
+
+    # The streamer has its own CPUs, so the USB reads do not compete with the FFTs
+    cpu_layout.apply('streamer')
+
+    await asyncio.gather(*(streaming(device) for device in devices))
+
+    # When replaying, the streams end when the replay has finished
+    if any(device.replay is not None for device in devices) : finish_replay()
+
+
+# Collect the metrics of the acquisition for the metrics exporter, for each device and each target of a device
+def collect_metrics() :
+    device_labels = [{'device': device.name} for device in devices]
+    analysers = [device.sample_analyser for device in devices]
+    target_labels = [({'device': device.name, 'target': str(int(target.centre_freq))}, target) for device in devices if device.sample_analyser is not None for target in device.sample_analyser.targets]
+    metrics = [
+        ('meteor_radar_blocks_received_total', 'counter', 'Sample blocks received from the SDR', [(labels, device.counters['received']) for labels, device in zip(device_labels, devices)]),
+        ('meteor_radar_blocks_dropped_total', 'counter', 'Sample blocks dropped because the sample queue was full', [(labels, device.counters['dropped']) for labels, device in zip(device_labels, devices)]),
+        ('meteor_radar_blocks_analysed_total', 'counter', 'Sample blocks analysed', [(labels, analyser.analysed_blocks) for labels, analyser in zip(device_labels, analysers) if analyser is not None]),
+        ('meteor_radar_blocks_skipped_total', 'counter', 'Sample blocks skipped because the analysis workers were busy', [(labels, analyser.skipped_blocks) for labels, analyser in zip(device_labels, analysers) if analyser is not None]),
+        ('meteor_radar_sample_queue_depth', 'gauge', 'Sample blocks waiting for the sample analyser', [(labels, device.sample_queue.qsize()) for labels, device in zip(device_labels, devices)]),
+        ('meteor_radar_triggers_total', 'counter', 'Detections triggered', [(labels, target.triggers) for labels, target in target_labels]),
+        ('meteor_radar_triggers_cancelled_total', 'counter', 'Detections cancelled because the median noise ratio was above ' + str(MAX_MEDIAN_NOISE_RATIO), [(labels, target.cancelled_triggers) for labels, target in target_labels]),
+        ('meteor_radar_median_noise', 'gauge', 'Median noise power of the last block analysed', [(labels, target.median_noise) for labels, target in target_labels]),
+        ('meteor_radar_captures_total', 'counter', 'Captures by what happened to them in the save scheduler', [({'result': result}, count) for result, count in save_scheduler.counters.items()]),
+        ('meteor_radar_stream_dropouts_total', 'counter', 'Dropouts of the sample stream, from gaps in the samples or stalls', [(labels, device.monitor.dropouts) for labels, device in zip(device_labels, devices) if device.monitor is not None]),
+        ('meteor_radar_stream_lost_seconds_total', 'counter', 'Seconds of samples lost in dropouts of the sample stream', [(labels, device.monitor.lost_seconds) for labels, device in zip(device_labels, devices) if device.monitor is not None]),
+        ('meteor_radar_sample_rate_error_ppm', 'gauge', 'Error of the sample rate against the wall clock', [(labels, device.monitor.rate_error) for labels, device in zip(device_labels, devices) if device.monitor is not None]),
+        ('meteor_radar_resident_memory_bytes', 'gauge', 'Resident set size of the acquisition process', [({}, current_rss())]),
+    ]
+    if diskspacechecker is not None and diskspacechecker.space_left is not None :
+        metrics.append(('meteor_radar_disk_space_left_bytes', 'gauge', 'Disk space left at the last check of the disk space checker', [({}, diskspacechecker.space_left)]))
+    return metrics
+
+
+# Status of the acquisition for the control socket. The settings are those of the first analyser, and each device has its own
+def control_status() :
+    analysers = [device.sample_analyser for device in devices if device.sample_analyser is not None]
+    status = {'status': 'ok', 'settings': analysers[0].settings if len(analysers) > 0 else detection_settings(), 'captures': dict(save_scheduler.counters), 'devices': []}
+    for device in devices :
+        device_status = {'name': device.name, 'received': device.counters['received'], 'dropped': device.counters['dropped'], 'sample_queue': device.sample_queue.qsize()}
+        analyser = device.sample_analyser
+        if analyser is not None :
+            device_status.update({'settings': analyser.settings, 'skipped': analyser.skipped_blocks, 'analysed': analyser.analysed_blocks, 'pending_captures': len(analyser.pending_captures)})
+            device_status['targets'] = [{'frequency': target.centre_freq, 'median_noise': float(target.median_noise), 'triggers': target.triggers, 'cancelled_triggers': target.cancelled_triggers}
+                                        for target in analyser.targets]
+        if device.monitor is not None : device_status.update({'dropouts': device.monitor.dropouts, 'lost_seconds': device.monitor.lost_seconds})
+        status['devices'].append(device_status)
+    return status
+
+
+# Check a band from the control socket. The bands must lie within the compression band, which is the band of the capture statistics
+def check_band(band) :
+    band = [int(value) for value in band]
+    if len(band) != 2 or band[0] >= band[1] or max(abs(value) for value in band) > COMPRESSION_FREQUENCY_BAND :
+        raise ValueError("A band must be two frequencies in Hz from low to high within +/-" + str(COMPRESSION_FREQUENCY_BAND))
+    return band
+
+
+# Handle a request from the control socket. The commands are run by the sample analysers, and the reply is that of the first analyser
+def handle_control_request(request) :
+    command = request.get('command')
+    if command == 'status' : return control_status()
+
+    if command == 'capture' :
+        arguments = {'time': datetime.datetime.fromisoformat(request['time']) if request.get('time') else None}
+        analysers = [device.sample_analyser for device in devices if request.get('device') is None or device.index == request['device']]
+        commands = [ControlCommand('capture', arguments) for analyser in analysers]
+    elif command == 'set' :
+        analysers = [device.sample_analyser for device in devices]
+        settings = dict(analysers[0].settings) if len(analysers) > 0 else detection_settings()
+        if 'snr_threshold' in request :
+            settings['snr_threshold'] = float(request['snr_threshold'])
+            if settings['snr_threshold'] <= 0 : raise ValueError("The SNR threshold must be positive")
+        if 'detection_band' in request : settings['detection_band'] = check_band(request['detection_band'])
+        if 'noise_band' in request : settings['noise_band'] = check_band(request['noise_band'])
+        commands = [ControlCommand('settings', dict(settings)) for analyser in analysers]
+    else :
+        return {'status': 'error', 'message': 'Unknown command ' + str(command)}
+
+    if len(analysers) == 0 : return {'status': 'error', 'message': 'No such device'}
+    for analyser, control_command in zip(analysers, commands) :
+        analyser.commands.put(control_command)
+    replies = [control_command.wait() for control_command in commands]
+    return replies[0] if len(replies) == 1 else dict(replies[0], devices=replies)
+
+
+# Wait for the analysis and the saves of the replayed samples to finish, report the processing rate and stop
+def finish_replay() :
+    while any(device.pending_blocks() > 0 for device in devices) or save_scheduler.backlog() > 0 :
+        save_scheduler.poll()
+        time.sleep(0.1)
+
+    for device in devices :
+        replay = device.replay
+        elapsed = time.monotonic() - replay.started
+        block_time = SDR_BLOCK_SIZE / replay.sample_rate
+        report = 'Replay finished: {0} blocks in {1:.1f} s  {2:.1f} blocks/s  {3:.1f} times real time  Dropped: {4}  Skipped: {5}  Captures: {6}'.format(
+            replay.blocks, elapsed, replay.blocks / elapsed, replay.blocks * block_time / elapsed, device.counters['dropped'], device.sample_analyser.skipped_blocks, save_scheduler.counters)
+        print(report)
+        syslog.syslog(syslog.LOG_DEBUG, report)
+
+        # Time from the arrival of each triggering block to its trigger. Without pacing this includes the time the block waited for the analysis
+        latencies = 1000 * np.array(device.sample_analyser.trigger_latencies)
+        if len(latencies) > 0 :
+            report = 'Trigger latency: {0} triggers  mean: {1:.1f} ms  p95: {2:.1f} ms  max: {3:.1f} ms'.format(len(latencies), np.mean(latencies), np.percentile(latencies, 95), np.max(latencies))
+            print(report)
+            syslog.syslog(syslog.LOG_DEBUG, report)
+    shutdown()
 
 
 # Main program
@@ -823,32 +1440,76 @@ if __name__ == "__main__":
 
     # construct the argument parser and parse the arguments
     ap = argparse.ArgumentParser()
-    ap.add_argument("-f", "--frequency", type=float, default=143.05e6, help="Centre frequency. Default is GRAVES (143.05 MHz)")
+    ap.add_argument("-f", "--frequency", type=float, nargs='+', default=[143.05e6], help="Centre frequency, or several target frequencies within the decimated band. The SDR is tuned for the first. Default is GRAVES (143.05 MHz)")
+    ap.add_argument("--devices", type=str, nargs='+', default=None, help="SDR devices to open, by index (e.g. 0 1) or serial number (e.g. 00000001 00000002), each with its own analysis. Default is the first device found")
+    ap.add_argument("--replay", type=str, nargs='+', default=None, help="Replay recorded samples instead of using an SDR device: SMP*.npz captures, raw 8 bit rtl_sdr .cu8/.bin files, complex64 .cf32/.raw files or .npy arrays")
+    ap.add_argument("--replay_speed", type=float, default=1.0, help="Replay speed as a multiple of real time. 0 replays as fast as possible, without dropping any blocks. Default is 1")
+    ap.add_argument("--replay_rate", type=float, default=SAMPLE_RATE, help="Sample rate of the raw replay files. Default is " + str(SAMPLE_RATE))
+    ap.add_argument("--replay_freq", type=float, default=None, help="Tuning frequency of the raw replay files. Default is the tuning frequency for the first target")
+    ap.add_argument("--replay_start", type=datetime.datetime.fromisoformat, default=None, help="Time of the first sample of the raw replay files e.g. 2025-01-01T00:00:00. Default is the time the replay starts")
     ap.add_argument("-g", "--gain", type=str, default=str(SDR_GAIN), help="SDR tuner gain (0-50, auto). Default is 50")
     ap.add_argument("-s", "--snr_threshold", type=float, default=45, help="SNR threshold. Default is 45 (~16 dB)")
     ap.add_argument("-r", "--raw", action='store_true', default=True, help="Store raw sample data - default")
     ap.add_argument("--fft", action='store_true', help="Store data as FFT")
     ap.add_argument("-a", "--audio", action='store_true', help="Enable saving of audio wav file")
-    ap.add_argument("-d", "--decimate", action='store_true', help="Decimate data for spectrogram before saving")
+    ap.add_argument("--smp_format", type=str, choices=SMP_FORMATS, default='complex64', help="Sample format of the SMP files. int16 and int8 store scaled integer IQ samples, in a half or a quarter of the space. Default is complex64")
+    ap.add_argument("--smp_compress", action='store_true', help="Compress the SMP files with fast lossless compression")
+    ap.add_argument("--spg_format", type=str, choices=SPG_FORMATS, default='uint8', help="Format of the SPG files saved with --fft. uint8 and float16 store the compressed spectrogram in dB. float64 is the original format. Default is uint8")
+    ap.add_argument("-d", "--decimate", action='store_true', help="Decimate data for spectrogram before saving. Sample data is now always decimated by the channelizer")
     ap.add_argument("-c", "--capturetodated", action='store_true', help="Store captures to dated directories e.g. ~/radar_data/Archive/20250328")
     ap.add_argument("-w", "--waterfall", action='store_true', help="Display waterfall graph")
     ap.add_argument("-v", "--verbose", action='store_true', help="Verbose output")
     ap.add_argument("--detectionband", nargs=2, type=int, default=DETECTION_FREQUENCY_BAND, help="Frequency band for detection in Hz. Default is " + str(DETECTION_FREQUENCY_BAND) + " e.g. -120 120")
     ap.add_argument("--noiseband", nargs=2, type=int, default=NOISE_CALCULATION_BAND, help="Frequency band for noise calculation in Hz. Default is " + str(NOISE_CALCULATION_BAND) + " e.g. -500 500")
+    ap.add_argument("--analysis_workers", type=int, default=ANALYSIS_WORKERS, help="Number of analysis worker processes. Default is " + str(ANALYSIS_WORKERS))
+    ap.add_argument("--noise_adapt", type=float, default=NOISE_TIME_CONSTANT, help="Time constant in seconds for the noise floor to adapt to changes in the noise. 0 calculates the noise from the medians of each block. Default is " + str(NOISE_TIME_CONSTANT))
+    ap.add_argument("--save_writers", type=int, default=SAVE_WRITERS, help="Number of capture writer processes. Default is " + str(SAVE_WRITERS))
+    ap.add_argument("--save_queue", type=int, default=SAVE_QUEUE_LENGTH, help="Number of captures that may be waiting for a writer. Default is " + str(SAVE_QUEUE_LENGTH))
+    ap.add_argument("--save_overflow", type=str, choices=OVERFLOW_POLICIES, default='oldest', help="What to do with a new capture when the save queue is full. oldest drops the oldest waiting capture, lowest_snr drops the capture with the lowest SNR, stats logs the new capture statistics without saving it. Default is oldest")
+    ap.add_argument("--fft_workers", type=int, default=FFT_WORKERS, help="Number of threads for each FFT. Default is " + str(FFT_WORKERS))
+    ap.add_argument("--affinity", type=str, choices=AFFINITY_MODES, default='none', help="CPU affinity. auto gives the streamer its own CPU, the capture writers the last CPU and the analysis the rest. Default is none")
+    ap.add_argument("--streamer_cpus", type=parse_cpus, default=None, help="CPUs for the streamer e.g. 0. Replaces the auto layout for the streamer")
+    ap.add_argument("--analysis_cpus", type=parse_cpus, default=None, help="CPUs for the analysis e.g. 1-2. Replaces the auto layout for the analysis")
+    ap.add_argument("--save_cpus", type=parse_cpus, default=None, help="CPUs for the capture writers e.g. 3. Replaces the auto layout for the writers")
+    ap.add_argument("--profile", action='store_true', help="Profile the wall and CPU time of each stage of the acquisition, and log the percentiles periodically")
+    ap.add_argument("--profile_file", type=str, default=None, help="File to append the profile summaries to. Default is syslog")
+    ap.add_argument("--profile_interval", type=float, default=PROFILE_INTERVAL, help="Seconds between the profile summaries. Default is " + str(PROFILE_INTERVAL))
+    ap.add_argument("--metrics_file", type=str, default=None, help="Prometheus text file to write the acquisition metrics to e.g. /var/lib/node_exporter/textfile_collector/meteor_radar.prom")
+    ap.add_argument("--metrics_port", type=int, default=None, help="Port of an HTTP server on localhost for the acquisition metrics e.g. 9105")
+    ap.add_argument("--metrics_interval", type=float, default=METRICS_INTERVAL, help="Seconds between writes of the metrics file. Default is " + str(METRICS_INTERVAL))
+    ap.add_argument("--control_socket", type=str, default=CONTROL_SOCKET, help="Unix socket for captures on request, changes of the detection settings and status. Default is " + CONTROL_SOCKET)
+    ap.add_argument("--trigger", type=str, choices=TRIGGER_ENGINES, default='stft', help="Trigger engine. stft computes the full spectrogram, dft computes only the band bins with a zoom FFT, cfar uses a CFAR detector with the noise level calculated around each time-frequency cell. Default is stft")
     args = vars(ap.parse_args())
 
-    centre_freq = args['frequency']
+    centre_freqs = args['frequency']
+    centre_freq = centre_freqs[0]
     sdr_gain = args['gain']
     snr_threshold = args['snr_threshold']
     save_raw_samples = args['raw']
     save_fft_samples = args['fft']
     save_audio = args['audio']
-    decimate_before_saving = args['decimate']
+    smp_format = args['smp_format']
+    smp_compress = args['smp_compress']
+    spg_format = args['spg_format']
     capturetodated = args['capturetodated']
     display_waterfall = args['waterfall']
     verbose = args['verbose']
     detection_frequency_band = args['detectionband']
     noise_calculation_band = args['noiseband']
+    num_analysis_workers = max(1, args['analysis_workers'])
+    trigger_engine_name = args['trigger']
+    noise_time_constant = max(0, args['noise_adapt'])
+    save_writers = max(1, args['save_writers'])
+    save_queue_length = max(1, args['save_queue'])
+    save_overflow = args['save_overflow']
+    set_fft_workers(args['fft_workers'])
+    cpu_layout = CpuLayout(args['affinity'], args['streamer_cpus'], args['analysis_cpus'], args['save_cpus'])
+    profile_file = args['profile_file']
+
+    # The profiler is created before the analysis workers and capture writers are started, so they share its histograms
+    if args['profile'] :
+        profiler = StageProfiler(True)
+        ProfileReporter(profiler, profile_file, args['profile_interval']).start()
 
     if save_fft_samples :
         save_raw_samples = False
@@ -856,7 +1517,14 @@ if __name__ == "__main__":
     # Set up the logging
     # logging.basicConfig(filename=LOG_FILE, format='%(asctime)s %(message)s', datefmt='%m/%d/%Y %I:%M:%S %p', level=logging.INFO)
 
+    # Each target must be within the decimated band around the SDR tuning frequency, including its compression band
+    max_offset = SAMPLE_RATE / DECIMATION / 2 - COMPRESSION_FREQUENCY_BAND
+    for freq in centre_freqs :
+        if abs(freq - (centre_freq + FREQUENCY_OFFSET)) > max_offset :
+            ap.error("Target frequency " + str(freq) + " is more than " + str(max_offset) + " Hz from the SDR tuning frequency " + str(centre_freq + FREQUENCY_OFFSET))
+
     print("Detection frequency:", centre_freq)
+    if len(centre_freqs) > 1 : print("Target frequencies:", centre_freqs)
     print("SNR threshold:", snr_threshold)
     if save_raw_samples :
         print("Saving raw sample data")
@@ -866,30 +1534,47 @@ if __name__ == "__main__":
     # Make the data directories
     make_directories()
 
-    # Deque for samples data for saving on trigger
-    timed_sample_deque = deque(maxlen=SAMPLES_LENGTH)
-
-    # Create the queue for the samples for analysis
-    sample_queue = Queue(maxsize=10)
+    # Shared memory ring of sample blocks for each device. It holds the capture being triggered, the captures waiting
+    # to be saved and those being written, so none are overwritten before they are saved
+    ring_length = SAMPLES_LENGTH * (2 + save_queue_length + save_writers)
+    if args['replay'] :
+        replay = ReplaySdr(args['replay'], max(0, args['replay_speed']), args['replay_rate'], args['replay_freq'], args['replay_start'])
+        devices = [SdrDevice(0, None, ring_length, replay)]
+    else:
+        if RtlSdr is None : ap.error("pyrtlsdr is not installed, so only --replay is available")
+        device_ids = args['devices'] if args['devices'] else [None]
+        devices = [SdrDevice(index, device_id, ring_length) for index, device_id in enumerate(device_ids)]
 
     # Create the queue for the waterfall display
     waterfall_queue = mpQueue(maxsize=1)
 
-    # Create the SDR instance
-    sdr = RtlSdr()
+    # Create the capture writers shared by all the devices, started when all the sample analysers are set up
+    save_scheduler = SaveScheduler(write_device_capture, log_device_capture, save_writers, save_queue_length, save_overflow, setup_writer)
+    setup_barrier = threading.Barrier(len(devices), action=save_scheduler.start)
 
-    # Start the sample analyser
-    sample_analyser = SampleAnalyser(centre_freq)
-    sample_analyser.start()
+    # Open the SDR devices and start a sample analyser for each
+    for device in devices :
+        device.open()
+        device.sample_analyser = SampleAnalyser(device, centre_freqs, save_scheduler, setup_barrier, num_analysis_workers, trigger_engine_name, noise_time_constant)
+        device.sample_analyser.start()
 
     # Start the disk space checker
     diskspacechecker = DiskSpaceChecker()
     diskspacechecker.start()
 
+    # Start the control socket
+    control_server = ControlServer(handle_control_request, args['control_socket'])
+    control_server.start()
+
+    # Start the metrics exporter
+    if args['metrics_file'] or args['metrics_port'] :
+        MetricsExporter(collect_metrics, args['metrics_file'], args['metrics_port'], args['metrics_interval']).start()
+
     # Start the waterfall display
     if  display_waterfall :
-        p = Waterfall(centre_freq + FREQUENCY_OFFSET, SAMPLE_RATE, waterfall_queue)
+        from waterfall import Waterfall
+        p = Waterfall(centre_freq + FREQUENCY_OFFSET, SAMPLE_RATE / DECIMATION, waterfall_queue)
         p.start()
 
     # Start the sample collection
-    asyncio.run(streaming())
+    asyncio.run(stream_devices())
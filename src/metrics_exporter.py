@@ -0,0 +1,104 @@
+# Metrics exporter for the acquisition
+#
+# Makes the health of a running acquisition visible to Prometheus, either as a text file for the node exporter
+# textfile collector, or on a small HTTP server on localhost, or both. The metrics are collected by a function
+# given to the exporter, which returns a list of metrics as (name, type, help, samples), where samples is a
+# list of (labels, value) and labels is a dict of label names and values.
+#
+# The text file is written every interval to a temporary file and renamed, so the collector never reads a
+# partly written file. The HTTP server collects the metrics afresh for each request.
+
+import os
+import syslog
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+METRICS_INTERVAL = 15           # Seconds between writes of the metrics file
+METRICS_HOST = '127.0.0.1'      # The HTTP server is only reachable from the station itself
+
+
+# Current resident set size of this process in bytes
+def current_rss() :
+    try:
+        with open('/proc/self/statm') as statm :
+            return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except OSError:
+        return 0
+
+
+# Format metrics in the Prometheus text exposition format
+def format_metrics(metrics) :
+    lines = []
+    for name, metric_type, help_text, samples in metrics :
+        lines.append('# HELP ' + name + ' ' + help_text)
+        lines.append('# TYPE ' + name + ' ' + metric_type)
+        for labels, value in samples :
+            label_text = ','.join(key + '="' + str(label).replace('\\', '\\\\').replace('"', '\\"') + '"' for key, label in labels.items())
+            lines.append(name + ('{' + label_text + '}' if label_text else '') + ' ' + repr(float(value)))
+    return '\n'.join(lines) + '\n'
+
+
+class MetricsExporter(threading.Thread):
+
+    def __init__(self, collect, filename=None, port=None, interval=METRICS_INTERVAL) :
+        threading.Thread.__init__(self, daemon=True)
+        self.collect = collect
+        self.filename = filename
+        self.port = port
+        self.interval = interval
+        self.server = None
+
+
+    # Get the current metrics as text
+    def metrics_text(self) :
+        return format_metrics(self.collect())
+
+
+    # Write the metrics file, replacing the previous one in one step
+    def write_file(self) :
+        temp_filename = self.filename + '.tmp'
+        try:
+            with open(temp_filename, 'w') as metrics_file :
+                metrics_file.write(self.metrics_text())
+            os.replace(temp_filename, self.filename)
+        except Exception as e :
+            syslog.syslog(syslog.LOG_DEBUG, "Unable to write the metrics file: " + str(e))
+
+
+    # Start the HTTP server on localhost in its own thread
+    def start_server(self) :
+        exporter = self
+
+        class MetricsHandler(BaseHTTPRequestHandler):
+            def do_GET(self) :
+                if self.path not in ['/', '/metrics'] :
+                    self.send_error(404)
+                    return
+                body = exporter.metrics_text().encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            # Requests are not logged, the scrapes would fill the output
+            def log_message(self, format, *args) :
+                pass
+
+        try:
+            self.server = ThreadingHTTPServer((METRICS_HOST, self.port), MetricsHandler)
+        except OSError as e :
+            print("Unable to start the metrics server:", e)
+            syslog.syslog(syslog.LOG_DEBUG, "Unable to start the metrics server: " + str(e))
+            return
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+
+    def run(self) :
+        if self.port is not None : self.start_server()
+        if self.filename is None : return
+
+        while True :
+            self.write_file()
+            time.sleep(self.interval)
@@ -11,6 +11,24 @@ from calendar import monthrange
 DATA_DIR =  os.path.expanduser('~/radar_data/')
 LOG_DIR = DATA_DIR + 'Logs/'
 CONFIG_FILE = os.path.expanduser('~/.radar_config')
+INCOMPLETE_MINUTES = 6      # Minutes of dropouts in an hour for it to be incomplete (10%)
+
+
+# Get the minutes lost in each hour of a month from the dropout logs of the acquisition, as a dict of (day, hour): minutes
+def get_dropout_minutes(log_dir, year, month) :
+    lost_minutes = {}
+    for filename in sorted(glob.glob(log_dir + 'Dropouts_' + str(year) + '-%02d' % month + '*.csv')) :
+        dropouts = pd.read_csv(filename, parse_dates=['start', 'end'])
+        for start, end in zip(dropouts['start'], dropouts['end']) :
+            # Split each dropout into the hours it covers
+            while start < end :
+                hour_end = start.replace(minute=0, second=0, microsecond=0) + datetime.timedelta(hours=1)
+                part_end = min(end, hour_end)
+                if start.year == year and start.month == month :
+                    lost_minutes[(start.day, start.hour)] = lost_minutes.get((start.day, start.hour), 0) + (part_end - start).total_seconds() / 60
+                start = part_end
+    return lost_minutes
+
 
 # Main program
 if __name__ == "__main__":
@@ -22,6 +40,7 @@ if __name__ == "__main__":
     ap.add_argument("-o", "--observer", type=str, default="Observer", help="Observer's name")
     ap.add_argument("-d", "--directory", type=str, default=LOG_DIR, help="Directory to output RMOB files. Default is " + LOG_DIR)
     ap.add_argument("-f", "--footer", type=str, default=None, help="Footer file for appending to end of RMOB <observer_name>_mmyyyrmob.TXT file")
+    ap.add_argument("-i", "--incomplete", type=float, default=INCOMPLETE_MINUTES, help="Minutes of stream dropouts in an hour for the hour to be marked incomplete (???). Default is " + str(INCOMPLETE_MINUTES))
 
     args = vars(ap.parse_args())
 
@@ -31,6 +50,7 @@ if __name__ == "__main__":
     observer_name = args['observer']
     output_dir = args['directory'] + '/'
     footer_file_name = args['footer']
+    incomplete_minutes = args['incomplete']
 
     config_file_name = CONFIG_FILE
     country = ""
@@ -83,6 +103,12 @@ if __name__ == "__main__":
     data_for_mesh = np.reshape(data_for_mesh, (len(days), len(hours)))
     # print(data_for_mesh)
 
+    # Find the hours with too much of the acquisition lost in dropouts of the sample stream
+    lost_minutes = get_dropout_minutes(log_dir, year, month)
+    incomplete_hours = set(day_hour for day_hour, minutes in lost_minutes.items() if minutes > incomplete_minutes)
+    for day, hour in sorted(lost_minutes) :
+        print("Dropouts on day %d hour %02d: %.1f minutes%s" % (day, hour, lost_minutes[(day, hour)], " - incomplete" if (day, hour) in incomplete_hours else ""))
+
 
     ###############################################
     # Output in RMOB-YYMM.DAT 3 column format yyyymmddhh,hh,meteor-count
@@ -93,6 +119,7 @@ if __name__ == "__main__":
     
     for day in days :
         for hour in hours :
+            if (day, hour) in incomplete_hours : continue
             try: 
                 file.write("%02d%02d%02d%02d,%02d,%d\n" % (year, month, day, hour, hour, data_for_mesh[day-days[0],hour]))
                 # print("%02d%02d%02d%02d,%02d,%d" % (year, month, day, hour, hour, data_for_mesh[day-1,hour]))
@@ -122,6 +149,7 @@ if __name__ == "__main__":
             # If there are missing days, or no data on some days, set "???""
             if index in missing_days or index > monthrange(year, month)[1] : out_line += "??? |"
             elif datetime.datetime(year, month, index, hour) > datetime.datetime.now() : out_line += "??? |"
+            elif (index, hour) in incomplete_hours : out_line += "??? |"
 
             else:
                 try: 
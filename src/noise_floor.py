@@ -0,0 +1,73 @@
+# Streaming noise floor model for the detection trigger
+#
+# Keeps an exponentially weighted moving average of the power in each frequency bin of the noise and detection
+# bands, updated with the mean power of each bin over each block of samples. The trigger SNR of each detection
+# bin is then a single divide of the maximum power in the block by the noise floor of the bin, with no sorting
+# of the block data. Bins that are above the trigger threshold are not used to update the noise floor, and the
+# noise floor is held while a detection is in progress, so meteor signals do not raise it.
+
+import numpy as np
+
+NOISE_TIME_CONSTANT = 30.0      # Default time constant of the noise floor average in seconds
+MEDIAN_TO_MEAN = np.log(2)      # The power of Gaussian noise in a bin is exponentially distributed, so the median is ln 2 times the mean
+
+
+class NoiseFloorModel():
+
+    def __init__(self, num_bins, noise_rows, detection_rows, detection_freqs, block_time, snr_threshold, time_constant=NOISE_TIME_CONSTANT) :
+        self.noise_rows = noise_rows
+        self.detection_rows = detection_rows
+        self.detection_freqs = detection_freqs
+        self.snr_threshold = snr_threshold
+        self.time_constant = time_constant
+
+        # Fraction of the difference between the block power and the noise floor added to the noise floor for each block
+        self.adapt_rate = min(1.0, block_time / time_constant)
+
+        self.noise_floor = np.zeros(num_bins)
+        self.blocks = 0
+        self.held_blocks = 0
+        self.rejected_bins = 0
+
+
+    # Update the noise floor with the mean power of each bin for a block. Nothing is updated if hold is set
+    def update(self, bin_power, hold=False) :
+        if hold :
+            self.held_blocks += 1
+            return
+
+        # Until a time constant of blocks has been seen use the average of all the blocks so the model settles quickly
+        self.blocks += 1
+        rate = max(self.adapt_rate, 1.0/self.blocks)
+        if self.blocks == 1 :
+            self.noise_floor[:] = bin_power
+            return
+
+        quiet = bin_power <= self.noise_floor * self.snr_threshold
+        self.rejected_bins += int(len(quiet) - np.count_nonzero(quiet))
+        self.noise_floor[quiet] += rate * (bin_power[quiet] - self.noise_floor[quiet])
+
+
+    # Get the trigger statistics (mn, sigmedian, sigmax, peak_freq, ratio_median) for a block from the maximum power of each bin.
+    # The median noise is the median power of the noise floor at the peak frequency
+    def trigger_statistics(self, band_max, ratio_median) :
+        detection_max = band_max[self.detection_rows]
+        median_noise = self.noise_floor[self.detection_rows] * MEDIAN_TO_MEAN
+        snr = detection_max / median_noise
+        peak = np.argmax(snr)
+
+        mn = np.mean(self.noise_floor[self.noise_rows])
+        return mn, median_noise[peak], detection_max[peak], self.detection_freqs[peak], ratio_median
+
+
+    # Current state of the model for diagnostics
+    def state(self) :
+        noise_floor = self.noise_floor[self.noise_rows]
+        return {'time_constant': self.time_constant,
+                'adapt_rate': self.adapt_rate,
+                'blocks': self.blocks,
+                'held_blocks': self.held_blocks,
+                'rejected_bins': self.rejected_bins,
+                'noise_floor_mean': float(np.mean(noise_floor)),
+                'noise_floor_min': float(np.min(noise_floor)),
+                'noise_floor_max': float(np.max(noise_floor))}
@@ -0,0 +1,166 @@
+# Replay SDR for running the detector without an SDR dongle
+#
+# Stands in for the RtlSdr object of the streaming loop, with the same sample_rate, center_freq and gain
+# attributes and async stream() generator, giving the samples of recorded files instead of those of the dongle:
+#
+# SMP*.npz      Capture files of decimated samples, with the centre frequency and sample rate held in the file
+# .cu8 .bin     Raw unsigned 8 bit IQ, as recorded by rtl_sdr
+# .cf32 .raw    Interleaved float32 IQ (complex64), such as long recordings from GNU Radio or SDR++
+# .npy          Arrays of complex samples
+#
+# The files are played one after the other as a single stream. The samples are resampled to the sample rate set
+# by the streaming loop, and shifted to the tuning frequency, so the channelizer and the whole analysis and save
+# pipeline run as they do with the dongle. SMP files are tuned FREQUENCY_OFFSET below their centre frequency,
+# and the raw files are taken to be at the given sample rate and tuning frequency.
+# Long recordings are memory mapped and resampled in chunks, with enough samples either side of each chunk
+# that there are no edge effects at the chunk boundaries.
+#
+# The blocks are paced at speed times real time, or given as fast as possible with a speed of 0. The time of
+# the samples is the start time given, or the time of the recording where it is known, otherwise the time the
+# replay started.
+
+import asyncio
+import datetime
+import math
+import os
+import time
+import numpy as np
+import scipy.signal as scipy_signal
+from capture_files import load_smp, DEFAULT_SAMPLE_RATE
+
+REPLAY_SAMPLE_RATE = 300000    # Default sample rate of the raw recordings, the sample rate of the SDR
+FREQUENCY_OFFSET = -2000       # SMP files are tuned 2 kHz below the centre frequency
+CHUNK_LENGTH = 2**20           # Number of file samples resampled at a time
+RESAMPLE_CONTEXT = 2**10       # Samples either side of each chunk for the resampling filter
+DEFAULT_BLOCK_SIZE = 128*1024
+
+
+# Recorded samples of a replay file, with their sample rate, tuning frequency and start time where known
+class ReplayFile():
+
+    def __init__(self, filename, sample_rate=REPLAY_SAMPLE_RATE, tuning_freq=None) :
+        self.filename = filename
+        self.sample_rate = sample_rate
+        self.tuning_freq = tuning_freq
+        self.start_time = None
+        basename = os.path.basename(filename)
+
+        if basename.endswith('.npz') :
+            self.samples, self.start_time, centre_freq, sample_rate = load_smp(filename)
+            if centre_freq is None : centre_freq = float(basename.split('_')[1])
+            self.sample_rate = sample_rate if sample_rate is not None else DEFAULT_SAMPLE_RATE
+            self.tuning_freq = centre_freq + FREQUENCY_OFFSET
+            self.raw = None
+        elif basename.endswith('.npy') :
+            self.samples = np.load(filename, mmap_mode='r')
+            self.raw = None
+        elif basename.endswith('.cu8') or basename.endswith('.bin') :
+            self.samples = None
+            self.raw = np.memmap(filename, dtype=np.uint8, mode='r')
+        else:
+            self.samples = np.memmap(filename, dtype=np.complex64, mode='r')
+            self.raw = None
+
+
+    # Number of samples in the file
+    def __len__(self) :
+        return len(self.raw) // 2 if self.raw is not None else len(self.samples)
+
+
+    # Read the samples from first to last as complex64
+    def read(self, first, last) :
+        if self.raw is None : return np.asarray(self.samples[first:last], dtype=np.complex64)
+
+        iq = self.raw[2 * first:2 * last].astype(np.float32)
+        iq -= 127.5
+        iq /= 127.5
+        return iq.view(np.complex64)
+
+
+    # Get the samples in chunks, resampled to a sample rate
+    def chunks(self, sample_rate) :
+        ratio = math.gcd(int(sample_rate), int(self.sample_rate))
+        up, down = int(sample_rate) // ratio, int(self.sample_rate) // ratio
+        chunk_length = CHUNK_LENGTH - CHUNK_LENGTH % down
+        context = RESAMPLE_CONTEXT * down
+
+        for start in range(0, len(self), chunk_length) :
+            stop = min(start + chunk_length, len(self))
+            if up == down :
+                yield self.read(start, stop)
+                continue
+
+            # Resample the chunk with the samples either side of it, and keep the output for the chunk
+            first = max(0, start - context)
+            last = min(len(self), stop + context)
+            resampled = scipy_signal.resample_poly(self.read(first, last), up, down).astype(np.complex64)
+            skip = (start - first) * up // down
+            yield resampled[skip:skip + -(-(stop - start) * up // down)]
+
+
+class ReplaySdr():
+
+    def __init__(self, filenames, speed=1.0, sample_rate=REPLAY_SAMPLE_RATE, tuning_freq=None, start_time=None) :
+        self.filenames = filenames
+        self.speed = speed
+        self.paced = speed > 0
+        self.raw_sample_rate = sample_rate
+        self.raw_tuning_freq = tuning_freq
+
+        # Settings made by the streaming loop, as for the dongle
+        self.sample_rate = sample_rate
+        self.center_freq = tuning_freq if tuning_freq is not None else 0
+        self.gain = 0
+
+        self.blocks = 0
+        self.receive_time = None       # Recording time of the end of the last block given
+        self.start_time = start_time   # Time of the first sample, from the first file that has one if not given
+        self.started = None            # Monotonic time that the stream started
+        self.elapsed = 0.0             # Time taken to give the blocks
+        self.stopped = False
+
+
+    # Give the samples of all the files as blocks of num_samples samples, paced at the replay speed
+    async def stream(self, num_samples=DEFAULT_BLOCK_SIZE, format='samples') :
+        self.stopped = False
+        block_time = num_samples / self.sample_rate
+        start = self.started = time.monotonic()
+        buffer = np.zeros(0, dtype=np.complex64)
+        mix_phase = 0.0
+
+        for filename in self.filenames :
+            replay_file = ReplayFile(filename, self.raw_sample_rate, self.raw_tuning_freq)
+            if self.start_time is None :
+                self.start_time = replay_file.start_time if replay_file.start_time is not None else datetime.datetime.now()
+            print("Replaying", filename)
+
+            # Shift the samples from the tuning frequency of the file to the tuning frequency that was set, keeping the phase continuous
+            mix_step = 0.0
+            if replay_file.tuning_freq is not None : mix_step = 2.0 * np.pi * (replay_file.tuning_freq - self.center_freq) / self.sample_rate
+
+            for samples in replay_file.chunks(self.sample_rate) :
+                if mix_step != 0 :
+                    samples = samples * np.exp(1j * (mix_phase + mix_step * np.arange(len(samples)))).astype(np.complex64)
+                    mix_phase = (mix_phase + mix_step * len(samples)) % (2.0 * np.pi)
+                buffer = np.concatenate((buffer, samples))
+
+                while len(buffer) >= num_samples :
+                    block, buffer = buffer[:num_samples], buffer[num_samples:]
+                    self.blocks += 1
+                    self.receive_time = self.start_time + datetime.timedelta(seconds=self.blocks * block_time)
+
+                    # Wait until the block would have been received at the replay speed, or just let the other tasks run
+                    if self.paced : await asyncio.sleep(max(0.0, start + self.blocks * block_time / self.speed - time.monotonic()))
+                    else : await asyncio.sleep(0)
+                    self.elapsed = time.monotonic() - start
+                    if self.stopped : return
+                    yield block
+
+
+    # Stop the stream
+    async def stop(self) :
+        self.stopped = True
+
+
+    def close(self) :
+        pass
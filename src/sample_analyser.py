@@ -7,6 +7,7 @@ import matplotlib.colors as colors
 from matplotlib.mlab import psd, specgram
 import scipy.interpolate as si
 import scipy.signal as signal
+from capture_files import load_smp
 
 OVERLAP = 0.75             # Overlap for sample file analysis
 NUM_FFT = 2**15
@@ -153,9 +154,7 @@ if __name__ == "__main__":
     inputFilename = args['file']
 
     print(inputFilename)
-    npz_data = np.load(inputFilename)
-
-    samples = npz_data['samples']
+    samples, obs_time, centre_freq, sample_rate = load_smp(inputFilename)
     sample_rate=int(SAMPLE_RATE/DECIMATION)
 
     print(type(samples[0]))
@@ -0,0 +1,143 @@
+# Shared memory ring buffer for the SDR sample blocks
+#
+# The streamer writes each block of samples into the next slot of the ring, and the analysis and save
+# processes read the blocks directly from shared memory using the block sequence number, so the sample
+# data does not have to be copied or pickled between processes.
+#
+# The ring keeps a count of all the samples written and the time of the first sample. The time of any
+# sample is calculated from its sample count, so no time stamp is needed for each block.
+#
+# The readers do not lock the ring, so a reader that falls a lap behind the streamer may read a slot while it
+# is being overwritten. Each slot has a sequence, as a seqlock: the streamer sets it to an odd value before it
+# writes a block into the slot and to the next even value after, both from the block sequence number. A reader
+# checks after reading a block that its slot still holds the completed write of that block, and rejects what it
+# read if not.
+
+import datetime
+import numpy as np
+from multiprocessing import shared_memory
+
+
+class SampleRing():
+
+    def __init__(self, num_blocks, block_length, sample_rate) :
+        self.num_blocks = num_blocks
+        self.block_length = block_length
+        self.sample_rate = sample_rate
+
+        # Shared memory layout is the complex64 sample blocks, the int64 count of samples written, the float64 time of the first sample
+        # and the int64 sequence of each slot
+        samples_size = num_blocks * block_length * np.dtype(np.complex64).itemsize
+        counter_size = np.dtype(np.int64).itemsize
+        time_size = np.dtype(np.float64).itemsize
+        self.shm = shared_memory.SharedMemory(create=True, size=samples_size + counter_size + time_size + num_blocks * np.dtype(np.int64).itemsize)
+
+        self.samples = np.ndarray((num_blocks, block_length), dtype=np.complex64, buffer=self.shm.buf)
+        self.flat_samples = self.samples.reshape(-1)
+        self.sample_counter = np.ndarray((1,), dtype=np.int64, buffer=self.shm.buf, offset=samples_size)
+        self.anchor_time = np.ndarray((1,), dtype=np.float64, buffer=self.shm.buf, offset=samples_size + counter_size)
+        self.slot_sequences = np.ndarray((num_blocks,), dtype=np.int64, buffer=self.shm.buf, offset=samples_size + counter_size + time_size)
+        self.samples[:] = 0
+        self.sample_counter[0] = 0
+        self.anchor_time[0] = 0
+        self.slot_sequences[:] = -1
+
+
+    # Number of samples written to the ring
+    @property
+    def sample_count(self) :
+        return int(self.sample_counter[0])
+
+
+    # Sequence number of the next block to be written
+    @property
+    def next_sequence(self) :
+        return self.sample_count // self.block_length
+
+
+    # Write a block of samples into the next slot and return its sequence number.
+    # The first block sets the time of the first sample, as the time it was received less the duration of the block
+    def put(self, samples, receive_time=None) :
+        block_sequence = self.next_sequence
+        if block_sequence == 0 :
+            if receive_time is None : receive_time = datetime.datetime.now()
+            self.anchor_time[0] = receive_time.timestamp() - self.block_length / self.sample_rate
+
+        slot = block_sequence % self.num_blocks
+        self.slot_sequences[slot] = 2 * block_sequence + 1
+        self.samples[slot] = samples
+        self.slot_sequences[slot] = 2 * block_sequence + 2
+        self.sample_counter[0] = self.sample_count + self.block_length
+        return block_sequence
+
+
+    # Set the time of the next block to be written from the time it will be received, after samples have been lost.
+    # The times of the blocks before it in the ring move by the time of the samples lost
+    def set_time(self, receive_time) :
+        self.anchor_time[0] = receive_time.timestamp() - (self.sample_count + self.block_length) / self.sample_rate
+
+
+    # Check that a block has been written and has not yet been overwritten
+    def is_available(self, block_sequence) :
+        return max(0, self.next_sequence - self.num_blocks) <= block_sequence < self.next_sequence
+
+
+    # Check, after reading a run of blocks, that the slot of each block still holds the completed write of that block, so
+    # none of the samples read were from a block written over them
+    def is_intact(self, first_sequence, num_blocks=1) :
+        return all(self.slot_sequences[block_sequence % self.num_blocks] == 2 * block_sequence + 2 for block_sequence in range(first_sequence, first_sequence + num_blocks))
+
+
+    # Get a view of the samples of a block
+    def block(self, block_sequence) :
+        return self.samples[block_sequence % self.num_blocks]
+
+
+    # Get the samples of a block preceded by the last history_length samples of the previous block, if it is still in the ring,
+    # and the sample count of the first sample. This is a view of the ring unless the previous block is at the end of it, when
+    # the samples are copied into out if it is given, or else into a new array
+    def block_with_history(self, block_sequence, history_length, out=None) :
+        first_sample = block_sequence * self.block_length
+        if history_length == 0 or not self.is_available(block_sequence - 1) :
+            return self.block(block_sequence), first_sample
+
+        slot = block_sequence % self.num_blocks
+        if slot > 0 :
+            samples = self.flat_samples[slot * self.block_length - history_length:(slot + 1) * self.block_length]
+        else:
+            if out is not None : out = out[:history_length + self.block_length]
+            samples = np.concatenate((self.samples[-1, -history_length:], self.samples[0]), out=out)
+        return samples, first_sample - history_length
+
+
+    # Get the time of a sample from its sample count
+    def sample_time(self, sample_count) :
+        return datetime.datetime.fromtimestamp(self.anchor_time[0] + sample_count / self.sample_rate)
+
+
+    # Get the time that a block was received, which is the time of the end of the block
+    def block_time(self, block_sequence) :
+        return self.sample_time((block_sequence + 1) * self.block_length)
+
+
+    # Get views of the samples for a run of blocks. This is one view, or two if the blocks wrap around the end of the ring
+    def capture_views(self, first_sequence, num_blocks) :
+        first_slot = first_sequence % self.num_blocks
+        if first_slot + num_blocks <= self.num_blocks :
+            return [self.flat_samples[first_slot * self.block_length:(first_slot + num_blocks) * self.block_length]]
+
+        wrapped_blocks = first_slot + num_blocks - self.num_blocks
+        return [self.flat_samples[first_slot * self.block_length:], self.flat_samples[:wrapped_blocks * self.block_length]]
+
+
+    # Get the samples for a run of blocks as a single array. This is a view of the ring unless the blocks wrap around the end of it
+    def capture(self, first_sequence, num_blocks) :
+        views = self.capture_views(first_sequence, num_blocks)
+        if len(views) == 1 : return views[0]
+        return np.concatenate(views)
+
+
+    # Remove the shared memory segment. Processes that still have it mapped keep their mapping until they exit
+    def unlink(self) :
+        try: self.shm.unlink()
+        except FileNotFoundError: pass
@@ -0,0 +1,142 @@
+# Save scheduler for the detection captures
+#
+# Captures waiting to be saved are held in a bounded queue of pending captures, and are passed to a pool of
+# persistent writer processes as the writers become free. When the queue is full a new capture is handled
+# by the overflow policy:
+#
+# oldest      Drop the oldest pending capture
+# lowest_snr  Drop the pending or new capture with the lowest trigger SNR
+# stats       Do not save the new capture, only log its detection statistics
+#
+# The numbers of captures queued, written and dropped are counted and logged. A setup function may be given to
+# prepare each writer process when it starts, such as setting its CPU affinity.
+# The scheduler may be shared by the sample analysers of several SDR devices, each submitting and polling from its
+# own thread, so the pending captures and the writer counts are changed under a lock.
+
+import signal
+import syslog
+import threading
+from collections import deque
+from multiprocessing import Process, Queue as mpQueue
+
+OVERFLOW_POLICIES = ['oldest', 'lowest_snr', 'stats']
+SAVE_WRITERS = 2            # Default number of writer processes
+SAVE_QUEUE_LENGTH = 4       # Default number of captures that may be waiting for a writer
+
+
+class SaveScheduler():
+
+    def __init__(self, write_capture, log_capture, num_writers=SAVE_WRITERS, queue_length=SAVE_QUEUE_LENGTH, overflow_policy='oldest', setup_writer=None) :
+        self.write_capture = write_capture      # Saves a capture in a writer process, returning 'written' or the reason it was not written
+        self.log_capture = log_capture          # Logs the statistics of a capture without saving it
+        self.setup_writer = setup_writer        # Called in each writer process when it starts
+        self.num_writers = num_writers
+        self.queue_length = queue_length
+        self.overflow_policy = overflow_policy
+
+        self.pending = deque()
+        self.job_queue = mpQueue()
+        self.done_queue = mpQueue()
+        self.writers = []
+        self.busy_writers = 0
+        self.lock = threading.RLock()
+
+        self.counters = {'queued': 0, 'written': 0, 'dropped_oldest': 0, 'dropped_lowest_snr': 0, 'stats_only': 0, 'overwritten': 0, 'failed': 0}
+
+
+    # Start the writer processes
+    def start(self) :
+        for writer_index in range(self.num_writers) :
+            writer = Process(target=self.writer, args=(self.job_queue, self.done_queue), daemon=True)
+            writer.start()
+            self.writers.append(writer)
+
+
+    # Stop the writer processes, allowing any saves in progress time to finish
+    def stop(self, timeout=5) :
+        for writer in self.writers :
+            try: self.job_queue.put_nowait(None)
+            except: pass
+
+        for writer in self.writers :
+            writer.join(timeout=timeout)
+            if writer.is_alive() : writer.terminate()
+
+
+    # Writer process. Save each capture from the job queue until told to stop
+    def writer(self, job_queue, done_queue) :
+        # Shutdown is handled by the parent process
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        signal.signal(signal.SIGUSR1, signal.SIG_IGN)
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        if self.setup_writer is not None : self.setup_writer()
+
+        while True :
+            job = job_queue.get()
+            if job is None : break
+
+            try:
+                result = self.write_capture(*job)
+            except Exception as e :
+                syslog.syslog(syslog.LOG_DEBUG, "Capture save failed: " + str(e))
+                result = 'failed'
+            done_queue.put(result)
+
+
+    # Add a capture to the queue of pending captures, applying the overflow policy if the queue is full
+    def submit(self, job, snr) :
+        with self.lock :
+            self.submit_job(job, snr)
+
+
+    # Add a capture to the queue of pending captures with the lock held
+    def submit_job(self, job, snr) :
+        self.poll()
+        self.counters['queued'] += 1
+
+        if len(self.pending) >= self.queue_length :
+            if self.overflow_policy == 'stats' :
+                self.counters['stats_only'] += 1
+                syslog.syslog(syslog.LOG_DEBUG, "Save queue full, logging capture statistics only " + str(self.counters))
+                self.log_capture(*job)
+                return
+
+            if self.overflow_policy == 'lowest_snr' :
+                lowest = min(range(len(self.pending)), key=lambda index : self.pending[index][0])
+                if self.pending[lowest][0] >= snr :
+                    self.counters['dropped_lowest_snr'] += 1
+                    syslog.syslog(syslog.LOG_DEBUG, "Save queue full, dropped new capture with lowest SNR " + str(self.counters))
+                    return
+                del self.pending[lowest]
+                self.counters['dropped_lowest_snr'] += 1
+            else:
+                self.pending.popleft()
+                self.counters['dropped_oldest'] += 1
+            syslog.syslog(syslog.LOG_DEBUG, "Save queue full, dropped pending capture " + str(self.counters))
+
+        self.pending.append((snr, job))
+        self.dispatch()
+
+
+    # Collect the results of finished saves and pass pending captures to free writers
+    def poll(self) :
+        with self.lock :
+            while not self.done_queue.empty() :
+                result = self.done_queue.get()
+                self.busy_writers -= 1
+                self.counters[result] = self.counters.get(result, 0) + 1
+                if result != 'written' : syslog.syslog(syslog.LOG_DEBUG, "Capture not written: " + result + " " + str(self.counters))
+            self.dispatch()
+
+
+    # Pass pending captures to free writers, oldest first
+    def dispatch(self) :
+        while self.pending and self.busy_writers < self.num_writers :
+            snr, job = self.pending.popleft()
+            self.job_queue.put(job)
+            self.busy_writers += 1
+
+
+    # Number of captures waiting for a writer or being saved
+    def backlog(self) :
+        return len(self.pending) + self.busy_writers
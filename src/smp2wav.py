@@ -4,6 +4,7 @@ import argparse
 import numpy as np
 import scipy.io.wavfile as wav
 import datetime
+from capture_files import load_smp
 
 
 # Main program
@@ -13,19 +14,14 @@ if __name__ == "__main__":
     # construct the argument parser and parse the arguments
     ap = argparse.ArgumentParser(description='Convert an SMP*.npz file to an audio wav file')
     ap.add_argument("smp_file", type=str, help="SMP .npz file")
+    ap.add_argument("--start", type=float, default=None, help="Start of the audio, in seconds from the start of the file")
+    ap.add_argument("--end", type=float, default=None, help="End of the audio, in seconds from the start of the file")
 
     args = vars(ap.parse_args())
 
     file_name = smp_file = args['smp_file']
 
-    npz_data = np.load(smp_file)
-    samples = npz_data['samples']
-    try:
-        centre_freq = npz_data['centre_freq']
-        sample_rate = npz_data['sample_rate']
-        obs_time = datetime.datetime.strptime(str(npz_data['obs_time']), "%Y-%m-%d %H:%M:%S.%f")
-    except Exception as e :
-        print(e)
+    samples, obs_time, centre_freq, sample_rate = load_smp(smp_file, args['start'], args['end'])
 
 
     # Save to file as 16-bit signed single-channel audio samples
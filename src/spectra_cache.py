@@ -0,0 +1,61 @@
+# Shared memory cache of the spectra of the sample blocks
+#
+# The analysis workers store the spectra of the cache band for each block they analyse, in the slot of the
+# cache with the same position as the block in the sample ring. A capture can then take the spectrogram of
+# its blocks from the cache instead of calculating the STFT of the capture samples again. Blocks that were
+# not analysed (or were analysed without the end of the previous block) are not in the cache.
+# When several target frequencies are watched, the cache bands of the targets follow each other in the spectra
+# of each block, and the spectrogram of a target is a range of rows of the cached spectra.
+
+import numpy as np
+from multiprocessing import shared_memory
+
+
+class SpectraCache():
+
+    def __init__(self, num_blocks, num_bins, frames_per_block) :
+        self.num_blocks = num_blocks
+        self.num_bins = num_bins
+        self.frames_per_block = frames_per_block
+
+        # Shared memory layout is the float64 spectra of each block, and the int64 sequence number of the block in each slot
+        spectra_size = num_blocks * num_bins * frames_per_block * np.dtype(np.float64).itemsize
+        self.shm = shared_memory.SharedMemory(create=True, size=spectra_size + num_blocks * np.dtype(np.int64).itemsize)
+
+        self.spectra = np.ndarray((num_blocks, num_bins, frames_per_block), dtype=np.float64, buffer=self.shm.buf)
+        self.sequences = np.ndarray((num_blocks,), dtype=np.int64, buffer=self.shm.buf, offset=spectra_size)
+        self.spectra[:] = 0
+        self.sequences[:] = -1
+
+
+    # Store the spectra of a block, given as an array or a list of arrays following each other in the bins.
+    # Spectra without the full number of frames are not stored
+    def put(self, block_sequence, spectra) :
+        if not isinstance(spectra, list) : spectra = [spectra]
+        if sum(len(part) for part in spectra) != self.num_bins or any(part.shape[1] != self.frames_per_block for part in spectra) : return
+        slot = block_sequence % self.num_blocks
+        self.sequences[slot] = -1
+        row = 0
+        for part in spectra :
+            self.spectra[slot, row:row + len(part)] = part
+            row += len(part)
+        self.sequences[slot] = block_sequence
+
+
+    # Get the spectrogram of a run of blocks, or None if any of the blocks are not in the cache. rows selects the bins of one target
+    def capture(self, first_sequence, num_blocks, rows=slice(None)) :
+        sequences = np.arange(first_sequence, first_sequence + num_blocks)
+        slots = sequences % self.num_blocks
+        if not np.array_equal(self.sequences[slots], sequences) : return None
+
+        Pxx = np.concatenate(self.spectra[slots, rows], axis=1)
+
+        # Check that none of the blocks were replaced while they were being copied
+        if not np.array_equal(self.sequences[slots], sequences) : return None
+        return Pxx
+
+
+    # Remove the shared memory segment. Processes that still have it mapped keep their mapping until they exit
+    def unlink(self) :
+        try: self.shm.unlink()
+        except FileNotFoundError: pass
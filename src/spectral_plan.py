@@ -0,0 +1,121 @@
+# Spectral plan for the short time FFTs of the sample data
+#
+# A plan holds the analysis window, the ShortTimeFFT configuration and the frequency axis for a sample rate,
+# FFT size, hop and tuning frequency, together with the frequency bands as contiguous slices of the frequency
+# axis. Plans are cached, so a plan is only built again when the sample rate, FFT size, hop or tuning frequency
+# changes.
+#
+# The FFTs use the number of threads set by set_fft_workers for the process, which is 1 unless it is changed.
+
+import numpy as np
+import scipy.fft
+from numpy.lib.stride_tricks import sliding_window_view
+from scipy.signal import ShortTimeFFT
+from scipy.signal.windows import hamming
+
+spectral_plans = {}
+fft_workers = 1
+
+
+# Set the number of threads for the FFTs of this process and the processes it starts
+def set_fft_workers(workers) :
+    global fft_workers
+    fft_workers = max(1, int(workers))
+
+
+# Number of threads for the FFTs
+def get_fft_workers() :
+    return fft_workers
+
+
+# Slice of an ascending frequency axis covering a frequency band. All frequencies are in Hz.
+# The band includes the upper frequency and, if include_low is set, the lower frequency
+def frequency_band(f_hz, low_freq, high_freq, include_low=False) :
+    start = np.searchsorted(f_hz, low_freq, side='left' if include_low else 'right')
+    stop = np.searchsorted(f_hz, high_freq, side='right')
+    return slice(int(start), int(stop))
+
+
+class SpectralPlan():
+
+    def __init__(self, sample_rate, num_fft, hop, tuning_freq=0.0) :
+        self.sample_rate = sample_rate
+        self.num_fft = num_fft
+        self.hop = hop
+        self.tuning_freq = tuning_freq
+
+        self.window = hamming(num_fft, sym=True)  # symmetric Gaussian window
+        self.sft = ShortTimeFFT(self.window, hop=hop, fs=sample_rate, mfft=num_fft, fft_mode='centered')
+
+        # Frequency axis in Hz, and in MHz as used for the saved spectrogram data
+        self.f_hz = self.sft.f + tuning_freq
+        self.f = self.f_hz / 1e6
+        self.f.flags.writeable = False
+
+        self.bands = {}
+
+
+    # Slice of the frequency axis for a band. Frequencies are in Hz
+    def band(self, low_freq, high_freq, include_low=False) :
+        key = (low_freq, high_freq, include_low)
+        if key not in self.bands :
+            self.bands[key] = frequency_band(self.f_hz, low_freq, high_freq, include_low)
+        return self.bands[key]
+
+
+    # Spectrogram of the samples
+    def spectrogram(self, samples) :
+        with scipy.fft.set_workers(fft_workers) :
+            return self.sft.spectrogram(samples)
+
+
+    # Range of frames whose window lies entirely within the samples
+    def full_frames(self, num_samples) :
+        return self.sft.lower_border_end[1], self.sft.upper_border_begin(num_samples)[1]
+
+
+    # Spectrogram of only the frames whose window lies entirely within the samples, with no zero padding at the edges
+    def frame_spectrogram(self, samples) :
+        p0, p1 = self.full_frames(len(samples))
+        with scipy.fft.set_workers(fft_workers) :
+            return self.sft.spectrogram(samples, p0=p0, p1=p1)
+
+
+    # Sample at the start of the first frame of frame_spectrogram
+    def first_frame_sample(self) :
+        return self.sft.lower_border_end[1] * self.hop - self.sft.m_num_mid
+
+
+    # View of the samples of each of the frames of frame_spectrogram, without the window applied.
+    # The view of contiguous samples is made directly on their buffer, which leaves nothing for the garbage collector
+    def frame_view(self, samples) :
+        p0, p1 = self.full_frames(len(samples))
+        first_sample = self.first_frame_sample()
+        if not samples.flags.c_contiguous :
+            return sliding_window_view(samples, self.num_fft)[first_sample::self.hop][:p1 - p0]
+        return np.ndarray((p1 - p0, self.num_fft), dtype=samples.dtype, buffer=samples, offset=first_sample * samples.itemsize,
+                          strides=(self.hop * samples.itemsize, samples.itemsize))
+
+
+    # Time in seconds of the centre of each frame of frame_spectrogram, from the sample count of the first sample
+    def frame_times(self, num_samples, first_sample=0) :
+        p0, p1 = self.full_frames(num_samples)
+        return (first_sample + np.arange(p0, p1) * self.hop) / self.sample_rate
+
+
+    # Time in seconds of the centre of one frame of frame_spectrogram, from the sample count of the first sample
+    def frame_time(self, frame, first_sample=0) :
+        return (first_sample + (self.sft.lower_border_end[1] + frame) * self.hop) / self.sample_rate
+
+
+    # Time of each spectrogram time step in seconds
+    def bins(self, num_time_steps) :
+        return np.arange(num_time_steps) * (self.hop / self.sample_rate)
+
+
+# Get the spectral plan for a sample rate, FFT size, hop and tuning frequency
+def get_spectral_plan(sample_rate, num_fft, hop, tuning_freq=0.0) :
+    key = (float(sample_rate), int(num_fft), int(hop), float(tuning_freq))
+    if key not in spectral_plans :
+        spectral_plans[key] = SpectralPlan(*key)
+    return spectral_plans[key]
@@ -0,0 +1,132 @@
+# Per stage timing profiler for the acquisition
+#
+# Records the wall time and the CPU time of each stage of the acquisition in fixed size histograms, so the
+# profiler uses the same memory however long it runs. The stages are:
+#
+# usb_wait           Wait for the next block from the SDR in the streaming loop
+# decimation         Channelizer decimation of each block
+# queue_wait         Wait of the sample analyser for the next block on the sample queue
+# stft               Band power (STFT or DFT) of each block in the analysis workers
+# statistics         Medians and trigger statistics of each block in the analysis workers
+# check_trigger      Trigger checks of each block in the sample analyser
+# savez              Writing each SMP or SPG capture file in the capture writers
+# log_capture_stats  Detection statistics and logs of each capture in the capture writers
+#
+# The histograms are in shared memory, so the analysis workers and capture writers started after the profiler
+# record into the same histograms. The histogram bins are spaced logarithmically, 10 to a decade from 1 us to
+# 100 s, and the percentiles are reported as the upper edge of the bin that holds them.
+# When the profiler is disabled start() returns None and record() returns at once, so the cost is a call each.
+
+import multiprocessing
+import syslog
+import threading
+import time
+import numpy as np
+from multiprocessing import shared_memory
+
+STAGES = ['usb_wait', 'decimation', 'queue_wait', 'stft', 'statistics', 'check_trigger', 'savez', 'log_capture_stats']
+HISTOGRAM_EDGES = np.logspace(-6, 2, 81)     # Bin edges in seconds, 10 bins per decade from 1 us to 100 s
+PERCENTILES = [50, 95, 99]
+PROFILE_INTERVAL = 60                         # Seconds between the profile summaries
+
+
+class StageProfiler():
+
+    def __init__(self, enabled=False, stages=STAGES) :
+        self.enabled = enabled
+        self.stages = {stage : index for index, stage in enumerate(stages)}
+        self.shm = None
+        if not enabled : return
+
+        # Counts of the wall and CPU times of each stage, with a bin below and above the edges
+        shape = (len(stages), 2, len(HISTOGRAM_EDGES) + 1)
+        self.shm = shared_memory.SharedMemory(create=True, size=int(np.prod(shape)) * np.dtype(np.int64).itemsize)
+        self.counts = np.ndarray(shape, dtype=np.int64, buffer=self.shm.buf)
+        self.counts[:] = 0
+        self.reported_counts = np.zeros(shape, dtype=np.int64)
+        self.lock = multiprocessing.Lock()
+
+
+    # Start timing a stage. Returns the wall and CPU times of the calling thread, or None if the profiler is disabled
+    def start(self) :
+        if not self.enabled : return None
+        return time.perf_counter(), time.thread_time()
+
+
+    # Record the time of a stage since it was started
+    def record(self, stage, start) :
+        if start is None : return
+        self.add(stage, time.perf_counter() - start[0], time.thread_time() - start[1])
+
+
+    # Add a wall time and a CPU time in seconds to the histograms of a stage
+    def add(self, stage, wall_time, cpu_time) :
+        index = self.stages[stage]
+        wall_bin, cpu_bin = np.searchsorted(HISTOGRAM_EDGES, (wall_time, cpu_time))
+        with self.lock :
+            self.counts[index, 0, wall_bin] += 1
+            self.counts[index, 1, cpu_bin] += 1
+
+
+    # Percentiles in milliseconds of a histogram, as the upper edges of the bins that hold them
+    def percentiles(self, counts) :
+        cumulative = np.cumsum(counts)
+        bins = np.searchsorted(cumulative, np.array(PERCENTILES) / 100 * cumulative[-1])
+        return 1000 * HISTOGRAM_EDGES[np.minimum(bins, len(HISTOGRAM_EDGES) - 1)]
+
+
+    # Summary of the times of each stage since the last summary, one line for each stage that has run
+    def summary(self) :
+        with self.lock :
+            counts = self.counts - self.reported_counts
+            self.reported_counts[:] = self.counts
+
+        lines = []
+        for stage, index in self.stages.items() :
+            count = np.sum(counts[index, 0])
+            if count == 0 : continue
+            wall = self.percentiles(counts[index, 0])
+            cpu = self.percentiles(counts[index, 1])
+            lines.append('Profile {0:18s} n:{1:7d}  wall p50:{2:9.3f} p95:{3:9.3f} p99:{4:9.3f} ms  cpu p50:{5:9.3f} p95:{6:9.3f} p99:{7:9.3f} ms'.format(stage, count, *wall, *cpu))
+        return lines
+
+
+    # Write the summary to a file, or to syslog if no file is given
+    def report(self, filename=None) :
+        if not self.enabled : return
+        lines = self.summary()
+        if len(lines) == 0 : return
+
+        if filename is None :
+            for line in lines : syslog.syslog(syslog.LOG_DEBUG, line)
+            return
+
+        try:
+            with open(filename, 'a') as profile_file :
+                profile_file.write(time.strftime('%Y-%m-%d %H:%M:%S') + '\n')
+                profile_file.write('\n'.join(lines) + '\n')
+        except Exception as e :
+            syslog.syslog(syslog.LOG_DEBUG, "Unable to write the profile: " + str(e))
+
+
+    # Remove the shared memory of the histograms
+    def unlink(self) :
+        if self.shm is None : return
+        try: self.shm.unlink()
+        except FileNotFoundError: pass
+
+
+# Thread writing the profile summary every interval
+class ProfileReporter(threading.Thread):
+
+    def __init__(self, profiler, filename=None, interval=PROFILE_INTERVAL) :
+        threading.Thread.__init__(self, daemon=True)
+        self.profiler = profiler
+        self.filename = filename
+        self.interval = interval
+
+
+    def run(self) :
+        while True :
+            time.sleep(self.interval)
+            self.profiler.report(self.filename)
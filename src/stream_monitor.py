@@ -0,0 +1,140 @@
+# Stream continuity monitor for the SDR sample stream
+#
+# The times of the samples are calculated from the count of samples received since the first block, which is
+# only right if no samples are lost. The monitor compares the samples received with the wall clock:
+#
+# lag       The time each block is received less the time of its last sample from the sample count. The
+#           lag jitters with the USB transfers, so the monitor follows its lowest recent value, the baseline
+# gap       A jump in the lag of more than GAP_THRESHOLD above the baseline, samples lost to a USB overrun or
+#           a stall. The time of the next block is then taken from the wall clock again
+# stall     No block for STALL_TIMEOUT seconds. The streaming loop restarts the stream, and again every STALL_TIMEOUT
+#           seconds after each restart until a block arrives
+# drift     The change of the baseline over RATE_WINDOW seconds, the error of the sample rate in ppm, logged
+#           if more than RATE_TOLERANCE
+#
+# Each dropout interval is logged to syslog and to the monthly dropout log Dropouts_<YYYY-MM><tag>.csv in the
+# log directory, which monthly_rmob.py reads to mark the incomplete hours.
+
+import datetime
+import os
+import syslog
+
+GAP_THRESHOLD = 1.0         # Seconds of missing samples that are a dropout, more than the USB jitter
+STALL_TIMEOUT = 5.0         # Seconds without a block before the stream is restarted
+BASELINE_RISE = 0.01        # Fraction of a rise in the lag that the baseline follows each block
+RATE_WINDOW = 300           # Seconds over which the sample rate drift is measured
+RATE_TOLERANCE = 200        # Sample rate error in ppm that is logged
+
+
+# Monthly log of the dropout intervals of a device
+class DropoutLogger():
+
+    def __init__(self, log_dir, tag='') :
+        self.log_dir = log_dir
+        self.tag = tag
+
+
+    def log_dropout(self, start, end, reason) :
+        filename = self.log_dir + 'Dropouts_' + start.strftime('%Y-%m') + self.tag + '.csv'
+        try:
+            new_file = not os.path.exists(filename)
+            with open(filename, 'a') as dropout_file :
+                if new_file : dropout_file.write("start,end,duration,reason\n")
+                dropout_file.write('{0},{1},{2:.3f},{3}\n'.format(start.isoformat(), end.isoformat(), (end - start).total_seconds(), reason))
+        except Exception as e :
+            syslog.syslog(syslog.LOG_DEBUG, str(e))
+
+
+class StreamMonitor():
+
+    def __init__(self, sample_rate, log_dir, tag='', name='default') :
+        self.sample_rate = sample_rate
+        self.name = name
+        self.dropout_logger = DropoutLogger(log_dir, tag)
+
+        self.anchor_time = None         # Wall time of the first sample counted since the last dropout
+        self.sample_count = 0           # Samples received since the anchor
+        self.baseline = 0.0
+        self.last_block_time = None     # Wall time of the last block, or of the last restart of the stream
+        self.stalled = False
+        self.window_start = None        # Wall time and baseline at the start of the rate drift window
+        self.window_baseline = 0.0
+
+        # Counts for the metrics
+        self.dropouts = 0
+        self.lost_seconds = 0.0
+        self.rate_error = 0.0           # Last measured sample rate error in ppm
+
+
+    # Check a block of samples received at a wall time (a timestamp). Returns True if samples were lost before
+    # the block, so the time of the block must be taken from the wall clock
+    def block_received(self, num_samples, receive_time) :
+        self.last_block_time = receive_time
+        if self.anchor_time is None :
+            self.start(num_samples, receive_time)
+            return False
+
+        self.sample_count += num_samples
+        lag = receive_time - (self.anchor_time + self.sample_count / self.sample_rate)
+
+        if lag - self.baseline > GAP_THRESHOLD :
+            reason = 'stall' if self.stalled else 'gap'
+            self.record_dropout(receive_time - (lag - self.baseline) - num_samples / self.sample_rate, receive_time - num_samples / self.sample_rate, reason)
+            self.start(num_samples, receive_time)
+            return True
+
+        # The baseline drops to the lowest lag at once and rises slowly, so it follows the drift of the sample rate but not the jitter
+        self.baseline = lag if lag < self.baseline else self.baseline + BASELINE_RISE * (lag - self.baseline)
+        self.stalled = False
+        self.check_rate(receive_time)
+        return False
+
+
+    # Start counting samples again from a block received at a wall time
+    def start(self, num_samples, receive_time) :
+        self.anchor_time = receive_time - num_samples / self.sample_rate
+        self.sample_count = num_samples
+        self.baseline = 0.0
+        self.stalled = False
+        self.window_start = receive_time
+        self.window_baseline = 0.0
+
+
+    # Check the change in the baseline over the rate window for drift of the sample rate
+    def check_rate(self, receive_time) :
+        elapsed = receive_time - self.window_start
+        if elapsed < RATE_WINDOW : return
+
+        self.rate_error = 1e6 * (self.baseline - self.window_baseline) / elapsed
+        if abs(self.rate_error) > RATE_TOLERANCE :
+            syslog.syslog(syslog.LOG_DEBUG, 'SDR device: {0}  Sample rate drift: {1:.0f} ppm'.format(self.name, self.rate_error))
+        self.window_start = receive_time
+        self.window_baseline = self.baseline
+
+
+    # Check whether the stream has stalled at a wall time. Returns True once for each STALL_TIMEOUT without a block, so a
+    # restarted stream that delivers nothing is restarted again
+    def check_stall(self, now) :
+        if self.last_block_time is None or now - self.last_block_time < STALL_TIMEOUT : return False
+        self.stalled = True
+        message = 'SDR device: {0}  Stream stalled, no samples for {1:.1f} s, restarting the stream'.format(self.name, now - self.last_block_time)
+        print(datetime.datetime.now(), message)
+        syslog.syslog(syslog.LOG_DEBUG, message)
+        self.last_block_time = now
+        return True
+
+
+    # The stream has been restarted at a wall time. The stall timeout starts again, and the stall is still the reason of the dropout
+    def restarted(self, now) :
+        self.last_block_time = now
+
+
+    # Log a dropout interval between two wall times
+    def record_dropout(self, start, end, reason) :
+        self.dropouts += 1
+        self.lost_seconds += end - start
+        start, end = datetime.datetime.fromtimestamp(start), datetime.datetime.fromtimestamp(end)
+        message = 'SDR device: {0}  Dropout ({1}) from {2} to {3}, {4:.3f} s of samples lost'.format(self.name, reason, start, end, (end - start).total_seconds())
+        print(datetime.datetime.now(), message)
+        syslog.syslog(syslog.LOG_DEBUG, message)
+        self.dropout_logger.log_dropout(start, end, reason)
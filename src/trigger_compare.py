@@ -0,0 +1,91 @@
+# Trigger engine comparison
+#
+# Runs the trigger engines over the blocks of SMP sample files, and compares the trigger decisions of each
+# engine with the full STFT engine, together with the CPU time taken per block.
+
+import argparse
+import glob
+import os
+import time
+import numpy as np
+from trigger_engines import TRIGGER_ENGINES, create_trigger_engine
+from capture_files import load_smp
+from analysis_settings import BLOCK_LENGTH, DECIMATED_SAMPLE_RATE, FREQUENCY_OFFSET, DETECTION_FREQUENCY_BAND, NOISE_CALCULATION_BAND, COMPRESSION_FREQUENCY_BAND, \
+    NUM_FFT, HOP, HISTORY_LENGTH, MAX_MEDIAN_NOISE_RATIO
+
+
+# Trigger decision for a block, as made by SampleAnalyser.check_trigger
+def trigger_decision(psd_results, snr_threshold) :
+    mn, sigmedian, sigmax, peak_freq, ratio_median = psd_results[:5]
+    return sigmax/sigmedian > snr_threshold and ratio_median <= MAX_MEDIAN_NOISE_RATIO
+
+
+# Read the samples and the capture details from an SMP file
+def read_smp_file(filename) :
+    samples, obs_time, centre_freq, sample_rate = load_smp(filename)
+    if centre_freq is None : centre_freq = float(os.path.basename(filename).split('_')[1])
+    if sample_rate is None : sample_rate = DECIMATED_SAMPLE_RATE
+    return samples.astype(np.complex64, copy=False), centre_freq, sample_rate
+
+
+# Main program
+if __name__ == "__main__":
+
+    ap = argparse.ArgumentParser(description='Compare the trigger decisions and CPU time of the trigger engines on SMP sample files')
+    ap.add_argument("file", type=str, nargs='+', help="SMP*.npz files or directories of files")
+    ap.add_argument("-s", "--snr_threshold", type=float, default=45, help="SNR threshold. Default is 45 (~16 dB)")
+    ap.add_argument("--detectionband", nargs=2, type=int, default=DETECTION_FREQUENCY_BAND, help="Frequency band for detection in Hz. Default is " + str(DETECTION_FREQUENCY_BAND))
+    ap.add_argument("--noiseband", nargs=2, type=int, default=NOISE_CALCULATION_BAND, help="Frequency band for noise calculation in Hz. Default is " + str(NOISE_CALCULATION_BAND))
+    ap.add_argument("-v", "--verbose", action='store_true', help="Print the statistics for every block")
+    args = vars(ap.parse_args())
+
+    snr_threshold = args['snr_threshold']
+    verbose = args['verbose']
+
+    filenames = []
+    for file_or_dir in args['file'] :
+        if os.path.isdir(file_or_dir) : filenames += sorted(glob.glob(file_or_dir + '/**/SMP*.npz', recursive=True))
+        else: filenames.append(file_or_dir)
+
+    total_blocks = 0
+    cpu_time = {name : 0.0 for name in TRIGGER_ENGINES}
+    triggers = {name : 0 for name in TRIGGER_ENGINES}
+    mismatches = {name : 0 for name in TRIGGER_ENGINES}
+
+    for filename in filenames :
+        samples, centre_freq, sample_rate = read_smp_file(filename)
+        engines = {name : create_trigger_engine(name, sample_rate, centre_freq + FREQUENCY_OFFSET, centre_freq, args['detectionband'], args['noiseband'], NUM_FFT, HOP, snr_threshold,
+                                         cache_band=[-COMPRESSION_FREQUENCY_BAND, COMPRESSION_FREQUENCY_BAND]) for name in TRIGGER_ENGINES}
+        workspaces = {name : engine.create_workspace(BLOCK_LENGTH + HISTORY_LENGTH) for name, engine in engines.items()}
+
+        file_mismatches = 0
+        for block_start in range(0, len(samples) - BLOCK_LENGTH + 1, BLOCK_LENGTH) :
+            first_sample = max(0, block_start - HISTORY_LENGTH)
+            block = samples[first_sample:block_start + BLOCK_LENGTH]
+            decisions = {}
+            for name, engine in engines.items() :
+                start_time = time.process_time()
+                with np.errstate(all='ignore') :
+                    psd_results = engine.analyse(block, first_sample, workspaces[name])
+                cpu_time[name] += time.process_time() - start_time
+                decisions[name] = trigger_decision(psd_results, snr_threshold)
+                if decisions[name] : triggers[name] += 1
+                if verbose : print(name, block_start // BLOCK_LENGTH, psd_results, decisions[name])
+
+            for name in TRIGGER_ENGINES :
+                if decisions[name] != decisions['stft'] :
+                    mismatches[name] += 1
+                    file_mismatches += 1
+            total_blocks += 1
+
+        print(os.path.basename(filename), "trigger decision mismatches:", file_mismatches)
+
+    if total_blocks == 0 :
+        print("No sample blocks found")
+        os._exit(0)
+
+    print("\nBlocks analysed:", total_blocks)
+    for name in TRIGGER_ENGINES :
+        cpu_per_block = 1000 * cpu_time[name] / total_blocks
+        saving = 100 * (1 - cpu_time[name] / cpu_time['stft']) if cpu_time['stft'] > 0 else 0
+        print('{0:6s} Triggers:{1:6d}  Mismatches:{2:6d}  CPU per block:{3:8.3f} ms  CPU saved:{4:6.1f} %'.format(name, triggers[name], mismatches[name], cpu_per_block, saving))
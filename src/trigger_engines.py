@@ -0,0 +1,476 @@
+# Trigger engines for the detection analysis of each block of samples
+#
+# Each engine analyses a block of decimated samples and returns the statistics tuple
+# (mn, sigmedian, sigmax, peak_freq, ratio_median) that is checked by SampleAnalyser.check_trigger, or the
+# per bin power of the block (bin_power, band_max, ratio_median) for the noise floor model.
+#
+# An engine may watch several target frequencies within the decimated band, each with its own noise calculation
+# and detection bands. The band power covers the bands of all the targets, so it is computed once for each block
+# whatever the number of targets. The per bin statistics are for the whole band, so serve all the targets, and the
+# trigger statistics of each target are calculated from views of the same band power.
+#
+# The blocks are analysed as a continuous stream of frames. Each block is preceded by the last num_fft - hop
+# samples of the previous block, and only the frames whose window lies entirely within the samples are
+# computed, so the frames straddling the block boundaries are computed once and there are no padded frames.
+#
+# If a cache band is given, the band power also covers it, so the spectra of the cache band can be kept for
+# the capture statistics without computing the STFT again. The statistics are only of the trigger rows of the
+# band power, the rows of the noise calculation and detection bands, so the cache band adds nothing to them.
+#
+# The analysis is done in float32 in the buffers of an AnalysisWorkspace. An analysis worker passes the same
+# workspace for each block, so no arrays are allocated. Without a workspace a new one is made for the block.
+#
+# stft  Full short time FFT of the block, keeping only the noise and detection bands (the original analysis)
+# dft   Zoom FFT evaluating only the band bins, from the samples decimated by a band pass filter around them
+# cfar  Cell averaging CFAR detector over the time-frequency cells of the short time FFT, with the noise level
+#       estimated locally around each cell. This also returns the time and frequency extent of the detection
+
+import numpy as np
+import scipy.fft
+from scipy.signal import firwin, kaiserord
+from spectral_plan import get_spectral_plan, get_fft_workers
+from noise_floor import MEDIAN_TO_MEAN
+from analysis_workspace import AnalysisWorkspace, ZoomWorkspace, CfarWorkspace
+
+TRIGGER_ENGINES = ['stft', 'dft', 'cfar']
+NUM_PROBE_BINS = 64        # Number of bins spread across the whole band for the median power of each time step in the dft engine
+ZOOM_ATTENUATION = 60      # Stop band attenuation in dB of the decimation filter of the dft engine
+CFAR_THRESHOLD = 45        # Default SNR threshold of the cfar detection mask
+CFAR_TRAINING = (24, 2)    # Half size of the cfar training window in (frequency bins, time steps)
+CFAR_GUARD = (4, 1)        # Half size of the cfar guard window, excluded from the training cells
+
+
+# Calculate the block statistics from the noise band and detection band power, and the median power of each time step.
+# The workspace holds the intermediate results
+def block_statistics(noise_band_power, detection_band_power, detection_freqs, time_medians, workspace) :
+
+    # Calculate the mean and median (noise) level over the larger noise calculation band
+    mn = np.mean(noise_band_power)
+
+    # Calculate the signal level stats over the detection band
+    detection_max = np.max(detection_band_power, axis=1, out=workspace.detection_max[:len(detection_band_power)])
+    maxpos = np.argmax(detection_max)
+    sigmax = detection_max[maxpos]
+    peak_freq = detection_freqs[maxpos]
+
+    # Get the ratio of the maximum to the median of the median power levels for each time step
+    median_median = workspace.median(time_medians)
+    max_median = np.max(time_medians)
+    ratio_median = max_median/median_median
+
+    # Added 20/7/2025. Median noise calculation change to try to improve filtering of false detections
+    # Get the time column of the max signal
+    max_index_flat = np.argmax(noise_band_power)
+    row_idx, col_idx = np.unravel_index(max_index_flat, noise_band_power.shape)
+
+    # Use the single time column of the max signal to calculate the median noise value over the noise calculation frequency band
+    sigmedian = workspace.median(noise_band_power[:, col_idx])
+
+    return mn, sigmedian, sigmax, peak_freq, ratio_median
+
+
+# Sum of each cell of a 2d array and its neighbours within +/- half_rows and +/- half_cols, from the cumulative sums of the array.
+# Cells outside the array are not included
+def box_sum(x, half_rows, half_cols) :
+    rows, cols = x.shape
+    integral = np.zeros((rows + 1, cols + 1))
+    integral[1:, 1:] = np.cumsum(np.cumsum(x, axis=0), axis=1)
+
+    r0 = np.clip(np.arange(rows) - half_rows, 0, rows)[:, None]
+    r1 = np.clip(np.arange(rows) + half_rows + 1, 0, rows)[:, None]
+    c0 = np.clip(np.arange(cols) - half_cols, 0, cols)[None, :]
+    c1 = np.clip(np.arange(cols) + half_cols + 1, 0, cols)[None, :]
+    return integral[r1, c1] - integral[r0, c1] - integral[r1, c0] + integral[r0, c0]
+
+
+# Runs of the bins of an FFT, which is not centred, holding num_bins consecutive bins from first_bin (in bins from
+# zero frequency). The bins are one or two runs of (FFT bins, band rows)
+def fft_runs(first_bin, num_bins, num_fft) :
+    fft_start = first_bin % num_fft
+    if fft_start + num_bins <= num_fft :
+        return [(slice(fft_start, fft_start + num_bins), slice(0, num_bins))]
+    wrapped = fft_start + num_bins - num_fft
+    return [(slice(fft_start, num_fft), slice(0, num_bins - wrapped)), (slice(0, wrapped), slice(num_bins - wrapped, num_bins))]
+
+
+# Noise calculation, detection and cache bands of a target frequency, and their rows within the band power of the engine
+class TriggerTarget():
+
+    def __init__(self, plan, centre_freq, detection_band, noise_band, cache_band=None) :
+        self.centre_freq = centre_freq
+        self.noise_calculation_band = plan.band(centre_freq + noise_band[0], centre_freq + noise_band[1])
+        self.detection_band = plan.band(centre_freq + detection_band[0], centre_freq + detection_band[1])
+        self.detection_freqs = plan.f[self.detection_band]
+
+        # The trigger bands, and the cache band which is kept out of them. The cache band includes its lower frequency, as the band saved with the captures
+        self.bands = [self.noise_calculation_band, self.detection_band]
+        self.cache_band = None
+        if cache_band is not None :
+            self.cache_band = plan.band(centre_freq + cache_band[0], centre_freq + cache_band[1], include_low=True)
+
+
+    # Set the position of the trigger bands within the trigger rows starting at first_trigger_bin, of the cache band within the
+    # band power starting at first_bin, and of the cache band within the cached spectra
+    def set_rows(self, first_trigger_bin, first_bin, first_cache_row=0) :
+        self.noise_rows = slice(self.noise_calculation_band.start - first_trigger_bin, self.noise_calculation_band.stop - first_trigger_bin)
+        self.detection_rows = slice(self.detection_band.start - first_trigger_bin, self.detection_band.stop - first_trigger_bin)
+        self.cache_rows = None
+        self.cache_spectra_rows = None
+        if self.cache_band is not None :
+            self.cache_rows = slice(self.cache_band.start - first_bin, self.cache_band.stop - first_bin)
+            self.cache_spectra_rows = slice(first_cache_row, first_cache_row + self.cache_band.stop - self.cache_band.start)
+
+
+# Trigger engine using the full short time FFT of each block
+class StftTriggerEngine():
+
+    uses_noise_floor = True
+
+    def __init__(self, sample_rate, tuning_freq, centre_freq, detection_band, noise_band, num_fft, hop, cache_band=None) :
+        self.sample_rate = sample_rate
+        self.num_fft = num_fft
+        self.hop = hop
+        self.plan = get_spectral_plan(sample_rate, num_fft, hop, tuning_freq)
+
+        # Frequencies in MHz, and the bands around each target frequency. centre_freq is a frequency or a list of frequencies
+        self.f = self.plan.f
+        self.targets = [TriggerTarget(self.plan, freq, detection_band, noise_band, cache_band) for freq in np.atleast_1d(centre_freq)]
+
+        # Range of bins covering the trigger and cache bands of all the targets, the trigger rows within it covering the
+        # trigger bands, and the position of each band. The cache bands of the targets follow each other in the cached spectra
+        first_trigger_bin = min(band.start for target in self.targets for band in target.bands)
+        last_trigger_bin = max(band.stop for target in self.targets for band in target.bands)
+        cache_bands = [target.cache_band for target in self.targets if target.cache_band is not None]
+        first_bin = min([first_trigger_bin] + [band.start for band in cache_bands])
+        last_bin = max([last_trigger_bin] + [band.stop for band in cache_bands])
+        self.band_bins = slice(first_bin, last_bin)
+        self.trigger_rows = slice(first_trigger_bin - first_bin, last_trigger_bin - first_bin)
+        self.cache_bins = 0
+        for target in self.targets :
+            target.set_rows(first_trigger_bin, first_bin, self.cache_bins)
+            if target.cache_band is not None : self.cache_bins += target.cache_band.stop - target.cache_band.start
+
+        # The bands of the first target, for the analysis of a single frequency
+        target = self.targets[0]
+        self.noise_calculation_band = target.noise_calculation_band
+        self.detection_band = target.detection_band
+        self.detection_freqs = target.detection_freqs
+        self.cache_band = target.cache_band
+        self.noise_rows = target.noise_rows
+        self.detection_rows = target.detection_rows
+        self.cache_rows = target.cache_rows
+        self.num_detection_bins = max(target.detection_band.stop - target.detection_band.start for target in self.targets)
+
+        # The FFT output is not centred, so the band bins are one or two runs of FFT bins
+        self.band_runs = fft_runs(first_bin - num_fft//2, last_bin - first_bin, num_fft)
+
+        self.window = self.plan.window.astype(np.complex64)
+
+
+    # Create a workspace for the analysis of blocks of up to max_samples samples
+    def create_workspace(self, max_samples) :
+        return AnalysisWorkspace(len(self.plan.frame_view(np.zeros(max_samples, dtype=np.complex64))), self.num_fft, self.num_fft,
+                                 self.band_bins.stop - self.band_bins.start, self.num_detection_bins)
+
+
+    # Spectrogram of the full frames of a block of samples
+    def spectrogram(self, samples) :
+        return self.plan.frame_spectrogram(samples)
+
+
+    # Power of a block of samples in the band bins for each time step, and the median power of each time step.
+    # The frames are windowed and transformed in place in the workspace
+    def band_power(self, samples, workspace=None) :
+        if workspace is None : workspace = self.create_workspace(len(samples))
+        frame_view = self.plan.frame_view(samples)
+        frames = workspace.frames[:len(frame_view)]
+        np.multiply(frame_view, self.window, out=frames)
+        spectrum = scipy.fft.fft(frames, axis=1, overwrite_x=True, workers=get_fft_workers())
+
+        power = workspace.power[:len(frames)]
+        np.abs(spectrum, out=power)
+        np.square(power, out=power)
+
+        Pxx = workspace.band_power(len(frames))
+        for fft_bins, rows in self.band_runs :
+            np.copyto(Pxx[rows], power[:, fft_bins].T)
+        return Pxx, workspace.row_medians(power, workspace.time_medians[:len(frames)])
+
+
+    # Trigger statistics of a target, by default the first, from the band power of a block of num_samples samples.
+    # first_sample is the sample count of the first sample
+    def statistics(self, Pxx, time_medians, num_samples, first_sample=0, workspace=None, target=None) :
+        if workspace is None : workspace = self.create_workspace(num_samples)
+        if target is None : target = self.targets[0]
+        trigger_power = Pxx[self.trigger_rows]
+        return block_statistics(trigger_power[target.noise_rows], trigger_power[target.detection_rows], target.detection_freqs, time_medians, workspace)
+
+
+    # Trigger statistics of each target from the band power of a block
+    def target_statistics(self, Pxx, time_medians, num_samples, first_sample=0, workspace=None) :
+        if workspace is None : workspace = self.create_workspace(num_samples)
+        return [self.statistics(Pxx, time_medians, num_samples, first_sample, workspace, target) for target in self.targets]
+
+
+    # The mean and maximum power of each bin of the trigger rows and the ratio of the maximum to the median of the median
+    # power levels for each time step, from the band power of a block in the workspace. These serve all the targets
+    def bin_statistics(self, Pxx, time_medians, workspace) :
+        trigger_power = Pxx[self.trigger_rows]
+
+        # The mean is the sum divided in place, as np.mean casts the count into a buffer the size of the output
+        bin_mean = np.sum(trigger_power, axis=1, out=workspace.bin_mean[:len(trigger_power)])
+        np.divide(bin_mean, trigger_power.shape[1], out=bin_mean)
+        band_max = np.max(trigger_power, axis=1, out=workspace.band_max[:len(trigger_power)])
+        return bin_mean, band_max, np.max(time_medians)/workspace.median(time_medians)
+
+
+    # Spectra of the cache bands of all the targets, as views of the band power, to be stored in the spectra cache
+    def cache_spectra(self, Pxx) :
+        return [Pxx[target.cache_rows] for target in self.targets if target.cache_rows is not None]
+
+
+    # Analyse a block of samples, returning the trigger statistics
+    def analyse(self, samples, first_sample=0, workspace=None) :
+        if workspace is None : workspace = self.create_workspace(len(samples))
+        Pxx, time_medians = self.band_power(samples, workspace)
+        return self.statistics(Pxx, time_medians, len(samples), first_sample, workspace)
+
+
+    # Analyse a block of samples, returning the per bin statistics for the noise floor model
+    def analyse_bins(self, samples, first_sample=0, workspace=None) :
+        if workspace is None : workspace = self.create_workspace(len(samples))
+        Pxx, time_medians = self.band_power(samples, workspace)
+        return self.bin_statistics(Pxx, time_medians, workspace)
+
+
+# Trigger engine evaluating only the band bins with a zoom FFT
+#
+# The samples are decimated by a band pass filter centred on the band bins, so the band bins alias to the bins of
+# a short FFT of the decimated frames. The decimation is the largest for which the band bins fill no more than half
+# of the decimated band, so their aliases fall in the stop band of the filter. The cache band widens the band bins,
+# so it halves the decimation, which costs little as the filter has the same number of rows of phases. The filter is applied as a polyphase
+# filter, a matrix product of the rows of decimation samples with the filter phases, summed along the diagonals.
+# The decimated frames are the frames of the STFT engine, windowed by every decimation'th sample of the window, so
+# the band power matches the STFT to within the pass band ripple of the filter.
+# The full band is not computed, so the median power of each time step is estimated from a set of probe bins spread
+# evenly across the whole band. These are exact bins of the STFT, the FFT of the windowed frames folded to
+# NUM_PROBE_BINS samples.
+class DftTriggerEngine(StftTriggerEngine):
+
+    def __init__(self, sample_rate, tuning_freq, centre_freq, detection_band, noise_band, num_fft, hop, cache_band=None) :
+        super().__init__(sample_rate, tuning_freq, centre_freq, detection_band, noise_band, num_fft, hop, cache_band)
+        first_bin = self.band_bins.start
+        num_band_bins = self.band_bins.stop - self.band_bins.start
+
+        # Largest decimation of the frames for which the band bins fill no more than half of the decimated band
+        self.decimation = 1
+        while hop % (2*self.decimation) == 0 and num_band_bins <= num_fft // (4*self.decimation) : self.decimation *= 2
+        self.zoom_fft = num_fft // self.decimation
+        self.zoom_runs = fft_runs(first_bin - num_fft//2, num_band_bins, self.zoom_fft)
+
+        # Low pass filter with the transition band between the band bins and their first aliases, shifted to the
+        # centre of the band bins. Its taps are split into rows of decimation phases, 2 * half_rows + 1 rows in all
+        self.half_rows = 0
+        taps = np.ones(1)
+        if self.decimation > 1 :
+            half_band = num_band_bins // 2
+            num_taps, beta = kaiserord(ZOOM_ATTENUATION, (self.zoom_fft - 2*half_band) / (num_fft/2))
+            self.half_rows = -(-(num_taps - 1) // (2*self.decimation))
+            taps = firwin(2*self.half_rows*self.decimation + 1, 1/self.decimation, window=('kaiser', beta))
+        centre_bin = first_bin + num_band_bins//2 - num_fft//2
+        n = np.arange(len(taps)) - self.half_rows*self.decimation
+        phases = np.zeros((2*self.half_rows + 1) * self.decimation, dtype=np.complex64)
+        phases[:len(taps)] = taps * np.exp(-2j * np.pi * centre_bin * n / num_fft)
+        self.filter_phases = np.ascontiguousarray(phases.reshape(-1, self.decimation).T)
+
+        # The decimated samples are the lowpass filtered samples at every decimation'th sample, so the window is scaled by the decimation
+        self.zoom_window = (self.decimation * self.plan.window[::self.decimation]).astype(np.complex64)
+        self.num_probe_bins = NUM_PROBE_BINS if num_fft % NUM_PROBE_BINS == 0 else 1
+
+
+    # Create a workspace for the analysis of blocks of up to max_samples samples, with the power of only the decimated frames
+    def create_workspace(self, max_samples) :
+        return ZoomWorkspace(max_samples, len(self.plan.frame_view(np.zeros(max_samples, dtype=np.complex64))), self.num_fft, self.zoom_fft, self.decimation,
+                             self.filter_phases.shape[1], self.num_probe_bins, self.band_bins.stop - self.band_bins.start, self.num_detection_bins)
+
+
+    # Power of a block of samples in the band bins for each time step, and the median power of each time step from the probe bins.
+    # The samples are decimated, and the decimated frames windowed and transformed in place, in the workspace
+    def band_power(self, samples, workspace=None) :
+        if workspace is None : workspace = self.create_workspace(len(samples))
+        frame_view = self.plan.frame_view(samples)
+        num_frames = len(frame_view)
+
+        # Band pass filter and decimate the samples, with the samples before and after the block taken as zero
+        num_decimated = len(samples) // self.decimation
+        filter_rows = self.filter_phases.shape[1]
+        padded = workspace.padded[:(num_decimated + filter_rows - 1) * self.decimation]
+        first = self.half_rows * self.decimation
+        np.copyto(padded[first:first + num_decimated*self.decimation], samples[:num_decimated*self.decimation])
+        padded[first + num_decimated*self.decimation:] = 0
+        products = np.matmul(padded.reshape(-1, self.decimation), self.filter_phases, out=workspace.products[:num_decimated + filter_rows - 1])
+        diagonals = np.ndarray((num_decimated, filter_rows), dtype=np.complex64, buffer=products, strides=(products.strides[0], products.strides[0] + products.strides[1]))
+        decimated = np.sum(diagonals, axis=1, out=workspace.decimated[:num_decimated])
+
+        # The decimated frames start at the same samples as the frames of the STFT engine. The short frames are windowed
+        # one at a time, as numpy buffers the whole product when the rows are short
+        zoom_view = np.ndarray((num_frames, self.zoom_fft), dtype=np.complex64, buffer=decimated, offset=self.plan.first_frame_sample() // self.decimation * decimated.itemsize,
+                               strides=(self.hop // self.decimation * decimated.itemsize, decimated.itemsize))
+        frames = workspace.frames[:num_frames]
+        for frame in range(num_frames) :
+            np.multiply(zoom_view[frame], self.zoom_window, out=frames[frame])
+        spectrum = scipy.fft.fft(frames, axis=1, overwrite_x=True, workers=get_fft_workers())
+
+        power = workspace.power[:num_frames]
+        np.abs(spectrum, out=power)
+        np.square(power, out=power)
+
+        Pxx = workspace.band_power(num_frames)
+        for fft_bins, rows in self.zoom_runs :
+            np.copyto(Pxx[rows], power[:, fft_bins].T)
+
+        # Probe bins from the windowed full frames folded to the number of probe bins
+        full_frames = workspace.full_frames[:num_frames]
+        np.multiply(frame_view, self.window, out=full_frames)
+        probe_spectrum = np.sum(full_frames.reshape(num_frames, -1, self.num_probe_bins), axis=1, out=workspace.probe_spectrum[:num_frames])
+        probe_spectrum = scipy.fft.fft(probe_spectrum, axis=1, overwrite_x=True)
+        probe_power = workspace.probe_power[:num_frames]
+        np.abs(probe_spectrum, out=probe_power)
+        np.square(probe_power, out=probe_power)
+        return Pxx, workspace.row_medians(probe_power, workspace.time_medians[:num_frames])
+
+
+# Trigger engine using a cell averaging CFAR detector over the short time FFT of each block
+#
+# The noise level of each cell is the mean power of the training cells around it, excluding the guard cells
+# next to it, so the threshold follows broadband interference and noise storms. The window sums are calculated
+# for all cells at once from the corners of the window of each cell in the integral (cumulative sums) of the
+# band power, in the buffers of a CfarWorkspace. Cells of the detection band above the threshold form the
+# detection mask, and the extent of the mask is returned with the trigger statistics.
+class CfarTriggerEngine(StftTriggerEngine):
+
+    uses_noise_floor = False
+
+    def __init__(self, sample_rate, tuning_freq, centre_freq, detection_band, noise_band, num_fft, hop, snr_threshold=CFAR_THRESHOLD, cache_band=None) :
+        super().__init__(sample_rate, tuning_freq, centre_freq, detection_band, noise_band, num_fft, hop, cache_band)
+        self.snr_threshold = snr_threshold
+        self.num_trigger_bins = self.trigger_rows.stop - self.trigger_rows.start
+        self.box_corners = {}
+
+
+    # Create a workspace for the analysis of blocks of up to max_samples samples
+    def create_workspace(self, max_samples) :
+        return self.create_frames_workspace(len(self.plan.frame_view(np.zeros(max_samples, dtype=np.complex64))))
+
+
+    # Create a workspace for the analysis of blocks of up to max_frames frames
+    def create_frames_workspace(self, max_frames) :
+        return CfarWorkspace(max_frames, self.num_fft, self.band_bins.stop - self.band_bins.start, self.num_trigger_bins, self.num_detection_bins)
+
+
+    # Corners of the training and guard windows of each cell of a block of num_frames frames, as (sign, flat indices into the
+    # integral of the trigger rows), and the number of training cells of each cell. Cells outside the trigger rows are not included
+    def corners(self, num_frames) :
+        if num_frames not in self.box_corners :
+            rows = self.num_trigger_bins
+            corners = []
+            for (half_rows, half_cols), window_sign in [(CFAR_TRAINING, 1), (CFAR_GUARD, -1)] :
+                r0 = np.clip(np.arange(rows) - half_rows, 0, rows)[:, None]
+                r1 = np.clip(np.arange(rows) + half_rows + 1, 0, rows)[:, None]
+                c0 = np.clip(np.arange(num_frames) - half_cols, 0, num_frames)[None, :]
+                c1 = np.clip(np.arange(num_frames) + half_cols + 1, 0, num_frames)[None, :]
+                for r, c, sign in [(r1, c1, 1), (r0, c1, -1), (r1, c0, -1), (r0, c0, 1)] :
+                    corners.append((window_sign * sign, r * (num_frames + 1) + c))
+
+            ones = np.ones((rows, num_frames))
+            training_cells = box_sum(ones, *CFAR_TRAINING) - box_sum(ones, *CFAR_GUARD)
+            self.box_corners[num_frames] = corners, training_cells
+        return self.box_corners[num_frames]
+
+
+    # Noise level of each cell of the trigger rows of the band power, the median equivalent of the mean training cell power
+    def cell_noise(self, Pxx, workspace=None) :
+        trigger_power = Pxx[self.trigger_rows]
+        rows, num_frames = trigger_power.shape
+        if workspace is None : workspace = self.create_frames_workspace(num_frames)
+        corners, training_cells = self.corners(num_frames)
+
+        # Integral of the trigger rows, with a row and a column of zeros before them
+        integral = workspace.cells(workspace.integral_buffer, rows + 1, num_frames + 1)
+        integral[0] = 0
+        integral[:, 0] = 0
+        np.copyto(integral[1:, 1:], trigger_power)
+        np.add.accumulate(integral[1:, 1:], axis=0, out=integral[1:, 1:])
+        np.add.accumulate(integral[1:, 1:], axis=1, out=integral[1:, 1:])
+
+        # Sum of the training cells of each cell from the corners of the training and guard windows
+        flat_integral = workspace.integral_buffer[:(rows + 1) * (num_frames + 1)]
+        training_power = workspace.cells(workspace.box_buffer, rows, num_frames)
+        corner = workspace.cells(workspace.corner_buffer, rows, num_frames)
+        training_power[:] = 0
+        for sign, indices in corners :
+            np.take(flat_integral, indices, out=corner, mode='clip')
+            if sign > 0 : training_power += corner
+            else : training_power -= corner
+
+        training_power /= training_cells
+        training_power *= MEDIAN_TO_MEAN
+        noise = workspace.cells(workspace.noise_buffer, rows, num_frames)
+        np.copyto(noise, training_power)
+        return noise
+
+
+    # Detection mask and SNR of each cell of the detection band of a target, by default the first, and the noise level of the cells
+    def detect(self, Pxx, noise=None, target=None, workspace=None) :
+        if workspace is None : workspace = self.create_frames_workspace(Pxx.shape[1])
+        if noise is None : noise = self.cell_noise(Pxx, workspace)
+        if target is None : target = self.targets[0]
+
+        detection_power = Pxx[self.trigger_rows][target.detection_rows]
+        rows, num_frames = detection_power.shape
+        snr = np.divide(detection_power, noise[target.detection_rows], out=workspace.cells(workspace.snr_buffer, rows, num_frames))
+        mask = np.greater(snr, self.snr_threshold, out=workspace.cells(workspace.mask_buffer, rows, num_frames))
+        return mask, snr, noise[target.detection_rows]
+
+
+    # Time (s from the start of the sample stream) and frequency (MHz) extent of a detection mask
+    def detection_extent(self, mask, num_samples, first_sample, detection_freqs, workspace) :
+        cells = int(np.count_nonzero(mask))
+        if cells == 0 : return None
+
+        rows = np.any(mask, axis=1, out=workspace.detection_rows[:mask.shape[0]])
+        steps = np.any(mask, axis=0, out=workspace.detection_steps[:mask.shape[1]])
+        return {'cells': cells,
+                'start': float(self.plan.frame_time(np.argmax(steps), first_sample)), 'end': float(self.plan.frame_time(len(steps) - 1 - np.argmax(steps[::-1]), first_sample)),
+                'low_freq': float(detection_freqs[np.argmax(rows)]), 'high_freq': float(detection_freqs[len(rows) - 1 - np.argmax(rows[::-1])])}
+
+
+    # Trigger statistics and the extent of the detection of a target from the band power of a block
+    def statistics(self, Pxx, time_medians, num_samples, first_sample=0, workspace=None, target=None, noise=None) :
+        if workspace is None : workspace = self.create_workspace(num_samples)
+        if target is None : target = self.targets[0]
+        mask, snr, noise = self.detect(Pxx, noise, target, workspace)
+
+        trigger_power = Pxx[self.trigger_rows]
+        peak_row, peak_time = np.unravel_index(np.argmax(snr), snr.shape)
+        mn = np.mean(trigger_power[target.noise_rows])
+        sigmedian = noise[peak_row, peak_time]
+        sigmax = trigger_power[target.detection_rows][peak_row, peak_time]
+        ratio_median = np.max(time_medians)/workspace.median(time_medians)
+        return mn, sigmedian, sigmax, target.detection_freqs[peak_row], ratio_median, self.detection_extent(mask, num_samples, first_sample, target.detection_freqs, workspace)
+
+
+    # Trigger statistics of each target from the band power of a block. The noise level of the cells is calculated once for all the targets
+    def target_statistics(self, Pxx, time_medians, num_samples, first_sample=0, workspace=None) :
+        if workspace is None : workspace = self.create_workspace(num_samples)
+        noise = self.cell_noise(Pxx, workspace)
+        return [self.statistics(Pxx, time_medians, num_samples, first_sample, workspace, target, noise) for target in self.targets]
+
+
+# Create the named trigger engine
+def create_trigger_engine(name, sample_rate, tuning_freq, centre_freq, detection_band, noise_band, num_fft, hop, snr_threshold=CFAR_THRESHOLD, cache_band=None) :
+    if name == 'dft' :
+        return DftTriggerEngine(sample_rate, tuning_freq, centre_freq, detection_band, noise_band, num_fft, hop, cache_band)
+    if name == 'cfar' :
+        return CfarTriggerEngine(sample_rate, tuning_freq, centre_freq, detection_band, noise_band, num_fft, hop, snr_threshold, cache_band)
+    return StftTriggerEngine(sample_rate, tuning_freq, centre_freq, detection_band, noise_band, num_fft, hop, cache_band)
@@ -0,0 +1,182 @@
+# Analysis workspace benchmark and allocation check
+#
+# Runs the trigger path of an analysis worker (band power and statistics of each block) over the blocks of SMP
+# sample files, or of generated noise, in three ways:
+#
+# reference  The float64 spectrogram and np.median analysis used before the analysis workspace
+# fresh      The float32 analysis with a new workspace for each block
+# workspace  The float32 analysis reusing one workspace, as the analysis workers do
+#
+# Each way runs in its own process, and the block latency and the resident set size (RSS) are reported.
+# The memory allocated while analysing each block in the workspace is then measured with tracemalloc. The analysis
+# is not free of allocations: each numpy call allocates its own bookkeeping, such as the iterator of a reduction or
+# the pivot stack of a partition, a few kB at its peak, which is freed before the call returns. This does not depend
+# on the size of the block, while any array allocated for the analysis does. So the blocks are analysed again with
+# the FFT length, the hop and the number of frames in each block all scaled by SCALE, and the check fails (exit
+# status 1) if the peak allocation of a block grows by more than ALLOCATION_LIMIT, a few Python scalars and tuples,
+# or if any memory is kept from one pass over the blocks to the next.
+# The blocks are copied into one buffer and analysed as views of it, as the analysis workers analyse views of the
+# sample ring. The check is of the steady state, so only the blocks with the history from the previous block are
+# used, as the FFT plan for the shorter first block is made again when the number of frames changes.
+
+import argparse
+import glob
+import os
+import time
+import tracemalloc
+import gc
+import numpy as np
+from multiprocessing import Process, Queue as mpQueue
+from trigger_engines import TRIGGER_ENGINES, create_trigger_engine
+from trigger_compare import read_smp_file
+from analysis_settings import BLOCK_LENGTH, DECIMATED_SAMPLE_RATE, HISTORY_LENGTH, FREQUENCY_OFFSET, DETECTION_FREQUENCY_BAND, NOISE_CALCULATION_BAND, \
+    COMPRESSION_FREQUENCY_BAND, NUM_FFT, HOP
+
+CENTRE_FREQ = 143050000             # Centre frequency of the generated noise
+WARMUP_BLOCKS = 10
+RSS_SAMPLES = 20                    # Number of times the RSS is sampled during each run
+SCALE = 2                           # Scale of the FFT length and the frames of each block for the allocation check
+ALLOCATION_LIMIT = 256              # Largest growth in bytes of the peak allocation of a block with the scale
+BENCHMARK_MODES = ['reference', 'fresh', 'workspace']
+
+
+# Current resident set size in bytes
+def current_rss() :
+    with open('/proc/self/statm') as statm :
+        return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+
+
+# Get the samples to analyse from the files, or num_samples of generated noise, and the centre frequency and sample rate
+def get_samples(filenames, num_samples) :
+    if filenames :
+        samples, centre_freq, sample_rate = read_smp_file(filenames[0])
+        for filename in filenames[1:] :
+            samples = np.concatenate((samples, read_smp_file(filename)[0]))
+        return samples, centre_freq, sample_rate
+
+    rng = np.random.default_rng(0)
+    samples = ((rng.standard_normal(num_samples) + 1j * rng.standard_normal(num_samples)) * 0.01).astype(np.complex64)
+    return samples, CENTRE_FREQ, DECIMATED_SAMPLE_RATE
+
+
+# Split the samples into blocks, each with the history from the previous block
+def get_blocks(samples, block_length=BLOCK_LENGTH, history_length=HISTORY_LENGTH) :
+    return [samples[max(0, start - history_length):start + block_length] for start in range(0, len(samples) - block_length + 1, block_length)]
+
+
+# Reference analysis of a block with the float64 spectrogram, as before the analysis workspace
+def reference_analysis(engine, samples) :
+    Pxx = engine.spectrogram(samples)
+    band_power = Pxx[engine.band_bins][engine.trigger_rows]
+    time_medians = np.median(Pxx, axis=0)
+    return np.mean(band_power, axis=1), np.max(band_power, axis=1), np.max(time_medians)/np.median(time_medians)
+
+
+# Analyse the blocks in one of the benchmark modes, putting the block latencies and the RSS samples on the result queue
+def run_mode(mode, engine, blocks, repeats, result_queue) :
+    workspace = engine.create_workspace(BLOCK_LENGTH + HISTORY_LENGTH)
+    for block in blocks[:WARMUP_BLOCKS] :
+        engine.analyse_bins(block, 0, workspace)
+
+    latencies = []
+    rss = []
+    total_blocks = repeats * len(blocks)
+    for index in range(total_blocks) :
+        block = blocks[index % len(blocks)]
+        start_time = time.perf_counter()
+        if mode == 'reference' : reference_analysis(engine, block)
+        elif mode == 'fresh' : engine.analyse_bins(block)
+        else : engine.analyse_bins(block, 0, workspace)
+        latencies.append(time.perf_counter() - start_time)
+        if index % max(1, total_blocks // RSS_SAMPLES) == 0 : rss.append(current_rss())
+
+    result_queue.put((latencies, rss))
+
+
+# Measure the memory allocated while analysing each block in the workspace, with the blocks copied into one buffer.
+# The first pass over the blocks brings the memory traced to its steady state. Returns the largest peak of a block in
+# the second pass and the memory kept from the end of the first pass to the end of the second, after the garbage
+# collector has freed the reference cycles left by scipy.fft
+def measure_allocations(engine, blocks, trigger_statistics) :
+    workspace = engine.create_workspace(len(blocks[0]))
+    analyse = engine.analyse if trigger_statistics else engine.analyse_bins
+    samples = np.zeros(len(blocks[0]), dtype=np.complex64)
+    for block in blocks[:WARMUP_BLOCKS] :
+        np.copyto(samples, block)
+        analyse(samples[:], 0, workspace)
+
+    # The results are put in arrays made before tracing starts, so the measurement itself keeps no memory
+    peaks = np.zeros(len(blocks), dtype=np.int64)
+    pass_memory = np.zeros(2, dtype=np.int64)
+    gc.collect()
+    tracemalloc.start()
+    for measure_pass in range(2) :
+        for index, block in enumerate(blocks) :
+            np.copyto(samples, block)
+            tracemalloc.reset_peak()
+            before = tracemalloc.get_traced_memory()[0]
+            analyse(samples[:], 0, workspace)
+            peaks[index] = tracemalloc.get_traced_memory()[1] - before
+        gc.collect()
+        pass_memory[measure_pass] = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return int(np.max(peaks)), int(pass_memory[1] - pass_memory[0])
+
+
+# Main program
+if __name__ == "__main__":
+
+    ap = argparse.ArgumentParser(description='Benchmark the analysis workspace and check that the analysis of each block allocates no arrays')
+    ap.add_argument("file", type=str, nargs='*', help="SMP*.npz files or directories of files. Generated noise is used if none are given")
+    ap.add_argument("--trigger", type=str, choices=TRIGGER_ENGINES, default='stft', help="Trigger engine. Default is stft")
+    ap.add_argument("-b", "--blocks", type=int, default=100, help="Number of blocks of generated noise. Default is 100")
+    ap.add_argument("-r", "--repeats", type=int, default=5, help="Number of times the blocks are analysed in each mode. Default is 5")
+    args = vars(ap.parse_args())
+
+    filenames = []
+    for file_or_dir in args['file'] :
+        if os.path.isdir(file_or_dir) : filenames += sorted(glob.glob(file_or_dir + '/**/SMP*.npz', recursive=True))
+        else: filenames.append(file_or_dir)
+
+    samples, centre_freq, sample_rate = get_samples(filenames, max(WARMUP_BLOCKS, args['blocks']) * BLOCK_LENGTH)
+    blocks = get_blocks(samples)
+    if len(blocks) == 0 :
+        print("No sample blocks found")
+        os._exit(0)
+    engine = create_trigger_engine(args['trigger'], sample_rate, centre_freq + FREQUENCY_OFFSET, centre_freq, DETECTION_FREQUENCY_BAND, NOISE_CALCULATION_BAND,
+                                   NUM_FFT, HOP, cache_band=[-COMPRESSION_FREQUENCY_BAND, COMPRESSION_FREQUENCY_BAND])
+    print("Trigger engine:", args['trigger'], " Blocks:", len(blocks), " Repeats:", args['repeats'])
+
+    # Run each mode in a new process so the RSS of each is measured separately
+    for mode in BENCHMARK_MODES :
+        result_queue = mpQueue()
+        process = Process(target=run_mode, args=(mode, engine, blocks, args['repeats'], result_queue))
+        process.start()
+        latencies, rss = result_queue.get()
+        process.join()
+
+        latencies = 1000 * np.array(latencies)
+        rss = np.array(rss) / 2**20
+        print('{0:10s} Latency mean:{1:7.3f} ms  p50:{2:7.3f} ms  p99:{3:7.3f} ms  RSS min:{4:7.1f} MB  max:{5:7.1f} MB'.format(
+            mode, np.mean(latencies), np.percentile(latencies, 50), np.percentile(latencies, 99), np.min(rss), np.max(rss)))
+
+    # The scaled blocks have SCALE times the frames of a block, each SCALE times the length, from the same samples
+    steady_blocks = [block for block in blocks if len(block) == BLOCK_LENGTH + HISTORY_LENGTH]
+    scaled_blocks = [block for block in get_blocks(samples, SCALE * SCALE * BLOCK_LENGTH, SCALE * HISTORY_LENGTH) if len(block) == SCALE * SCALE * BLOCK_LENGTH + SCALE * HISTORY_LENGTH]
+    scaled_engine = create_trigger_engine(args['trigger'], sample_rate, centre_freq + FREQUENCY_OFFSET, centre_freq, DETECTION_FREQUENCY_BAND, NOISE_CALCULATION_BAND,
+                                          SCALE * NUM_FFT, SCALE * HOP, cache_band=[-COMPRESSION_FREQUENCY_BAND, COMPRESSION_FREQUENCY_BAND])
+    if len(steady_blocks) == 0 or len(scaled_blocks) == 0 :
+        print("Not enough samples for the allocation check")
+        os._exit(1)
+
+    passed = True
+    for trigger_statistics in [False, True] :
+        max_peak, net = measure_allocations(engine, steady_blocks, trigger_statistics)
+        scaled_peak, scaled_net = measure_allocations(scaled_engine, scaled_blocks, trigger_statistics)
+        statistics = 'Trigger statistics' if trigger_statistics else 'Noise floor statistics'
+        check = scaled_peak - max_peak <= ALLOCATION_LIMIT and net == 0 and scaled_net == 0
+        passed = passed and check
+        print('{0:22s} Peak allocation per block:{1:6d} bytes  at scale {2}:{3:6d} bytes  Memory kept:{4:5d} bytes  at scale {2}:{5:5d} bytes  {6}'.format(
+            statistics, max_peak, SCALE, scaled_peak, net, scaled_net, 'PASS' if check else 'FAIL'))
+
+    os._exit(0 if passed else 1)